@@ -1,24 +1,30 @@
+import time
+_IMPORT_START = time.perf_counter()
 import os
 import warnings
 import sys
+import abc
+import collections
+import concurrent.futures
+import functools
+import math
+import mmap
+import queue
+import threading
 warnings.filterwarnings("ignore", category=UserWarning, message=".pkg_resources is deprecated.")
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
 import pygame
 import subprocess
-import time
 import numpy as np
-import mss
-from ultralytics import YOLO
-import cv2
-import win32gui
-import win32api
-import win32con
+# ultralytics/torch、cv2、mss 与 tkinter 导入较慢，均在首次使用处导入
+try:
+    import win32gui
+    import win32api
+    import win32con
+except ImportError:
+    # 非Windows平台：只能使用 xtest / autogui / mock 输入后端
+    win32gui = win32api = win32con = None
 import json
-import tkinter as tk
-from tkinter import filedialog, messagebox
-import pyautogui
-
-DEBUG_ENABLED = False
 
 class NullWriter:
     """一个用于重定向流的空设备，它会忽略所有写入操作。"""
@@ -27,10 +33,151 @@ class NullWriter:
     def flush(self):
         pass
 
-def _d_print(*args, **kwargs):
-    """全局打印函数，仅在DEBUG_ENABLED为True时输出到命令行。"""
-    if DEBUG_ENABLED:
-        print(*args, **kwargs)
+class RingLogger:
+    """
+    低开销的结构化日志。
+    调用方先做级别判断，参数不在调用处格式化，只把 (时间, 级别, 格式串, 参数) 追加到内存环形缓冲区；
+    格式化、控制台输出与写入滚动日志文件都由后台线程完成。
+    参数中含可变对象（暗子库、棋盘列表等）时在调用处立即格式化，否则后台线程读到的是之后被修改的状态。
+    出现事故（重置、异常）时可调用 dump_recent 把最近N秒的全部记录（含调试级别）写到磁盘。
+    """
+    DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+    LEVEL_NAMES = {10: 'DEBUG', 20: 'INFO', 30: 'WARNING', 40: 'ERROR'}
+    SCALAR_TYPES = (str, int, float, bytes, type(None))
+
+    def __init__(self, capacity=20000):
+        self.capture_level = self.DEBUG   # 进入环形缓冲区的最低级别
+        self.file_level = self.INFO       # 持续写入日志文件的最低级别
+        self.console = False              # 调试模式下由后台线程输出到控制台
+        self.log_dir = None
+        self.max_bytes = 2 * 1024 * 1024
+        self.backups = 3
+        self.max_incidents = 20
+        self._ring = collections.deque(maxlen=capacity)
+        self._pending = collections.deque(maxlen=capacity)  # 未调用 configure（后台线程未启动）时也不会无限增长
+        self._file = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def configure(self, log_dir=None, file_level=None, console=None):
+        if file_level is not None:
+            self.file_level = file_level if isinstance(file_level, int) else getattr(self, str(file_level).upper(), self.INFO)
+        if console is not None:
+            self.console = console
+        if log_dir and log_dir != self.log_dir:
+            self.log_dir = log_dir
+            if self._file:
+                self._file.close()
+                self._file = None
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._flush_loop, name="log-flush", daemon=True)
+            self._thread.start()
+
+    def is_enabled(self, level):
+        return level >= self.capture_level
+
+    def _log(self, level, msg, args):
+        if args and not all(isinstance(a, self.SCALAR_TYPES) for a in args):
+            msg, args = self._render(msg, args), ()
+        record = (time.time(), level, msg, args)
+        self._ring.append(record)
+        if level >= self.file_level or self.console:
+            self._pending.append(record)
+
+    def debug(self, msg, *args):
+        if self.capture_level <= 10:
+            self._log(10, msg, args)
+
+    def info(self, msg, *args):
+        if self.capture_level <= 20:
+            self._log(20, msg, args)
+
+    def warning(self, msg, *args):
+        if self.capture_level <= 30:
+            self._log(30, msg, args)
+
+    def error(self, msg, *args):
+        if self.capture_level <= 40:
+            self._log(40, msg, args)
+
+    @staticmethod
+    def _render(msg, args):
+        try:
+            return msg % args if args else msg
+        except (TypeError, ValueError):
+            return f"{msg} {args!r}"
+
+    def _format(self, record):
+        t, level, msg, args = record
+        text = self._render(msg, args)
+        stamp = time.strftime('%H:%M:%S', time.localtime(t))
+        return f"{stamp}.{int(t * 1000) % 1000:03d} {self.LEVEL_NAMES[level]:<7} {text}"
+
+    def _open_file(self):
+        if self._file is None and self.log_dir:
+            os.makedirs(self.log_dir, exist_ok=True)
+            self._file = open(os.path.join(self.log_dir, 'moonlink.log'), 'a', encoding='utf-8')
+        return self._file
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        base = os.path.join(self.log_dir, 'moonlink.log')
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{base}.{i}"):
+                os.replace(f"{base}.{i}", f"{base}.{i + 1}")
+        os.replace(base, f"{base}.1")
+
+    def flush(self):
+        lines = []
+        while self._pending:
+            record = self._pending.popleft()
+            line = self._format(record)
+            if self.console:
+                print(line)
+            if record[1] >= self.file_level:
+                lines.append(line)
+        if lines:
+            try:
+                f = self._open_file()
+                if f:
+                    f.write('\n'.join(lines) + '\n')
+                    f.flush()
+                    if f.tell() > self.max_bytes:
+                        self._rotate()
+            except OSError:
+                pass
+
+    def _flush_loop(self):
+        while not self._stop.wait(0.5):
+            self.flush()
+
+    def dump_recent(self, seconds=30.0, reason="incident"):
+        """把最近 seconds 秒内的全部记录写入单独的事故日志文件，返回文件路径。"""
+        if not self.log_dir:
+            return None
+        cutoff = time.time() - seconds
+        records = [r for r in list(self._ring) if r[0] >= cutoff]
+        try:
+            os.makedirs(self.log_dir, exist_ok=True)
+            path = os.path.join(self.log_dir, f"incident-{time.strftime('%Y%m%d-%H%M%S')}-{reason}.log")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(self._format(r) for r in records) + '\n')
+            incidents = sorted(n for n in os.listdir(self.log_dir) if n.startswith('incident-'))
+            for name in incidents[:-self.max_incidents]:
+                os.remove(os.path.join(self.log_dir, name))
+            return path
+        except OSError:
+            return None
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+        if self._file:
+            self._file.close()
+            self._file = None
+
+logger = RingLogger()
 
 BOARD_SIZE = (800, 850)
 PIECE_SIZE = 64          # 棋子逻辑尺寸
@@ -38,6 +185,8 @@ GRID_SIZE = 600 // 9
 BOARD_OFFSET = (5, 0)
 
 SETTINGS_FILE = os.path.join('resource', 'settings.json')
+# 设置项 -> UCI 引擎选项名
+ENGINE_OPTIONS = {'engine_threads': 'Threads', 'hash_size': 'Hash'}
 
 def get_default_settings():
     return {
@@ -47,9 +196,41 @@ def get_default_settings():
         "board_scan_interval": 0.15,
         "board_click_interval": 0.50,
         "fixed_scan_interval": 1.0,
+        "adaptive_scan": 1,
+        "scan_min_interval": 0.1,
+        "scan_max_interval": 2.0,
+        "scan_backoff": 1.5,
+        "motion_poll_interval": 0.05,
+        "motion_threshold": 12.0,
+        "scan_cpu_budget": 0.5,
         "model_path": "resource/models/Moonlink_tiantian_wooden_v1.pt",
+        "model_registry": "resource/models/registry.json",
+        "model_cache_size": 2,
+        "skin_match_distance": 0.25,
+        "engine_path": "",
         "confidence_threshold": 0.90,
+        "inference_threads": 0,
+        "warmup_runs": 3,
         "use_mouse_click": 0,
+        "input_backend": "auto",
+        "click_ack_threshold": 8.0,
+        "metrics_dir": "resource/metrics",
+        "metrics_interval": 30.0,
+        "likelihood_inference": 1,
+        "confirm_poll_interval": 0.02,
+        "inference_margin": 2.0,
+        "log_dir": "resource/logs",
+        "log_level": "INFO",
+        "incident_log_seconds": 30.0,
+        "flight_recorder": 1,
+        "flight_dir": "resource/flight",
+        "flight_seconds": 20.0,
+        "flight_fps": 4.0,
+        "hard_example_capture": 0,
+        "hard_example_dir": "resource/hard_examples",
+        "hard_example_max_mb": 500.0,
+        "hard_example_low_conf": 0.3,
+        "hard_example_interval": 2.0,
         "debug_mode": 0
     }
 
@@ -70,20 +251,24 @@ def load_settings():
                     settings[key] = value
             return settings
     except (json.JSONDecodeError, FileNotFoundError):
-        _d_print("警告: settings.json 读取失败，使用默认设置。")
+        logger.warning("警告: settings.json 读取失败，使用默认设置。")
         return get_default_settings()
 
 def save_settings(settings):
-    with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
+    # 先写临时文件再替换，运行中的程序监视设置文件时不会读到写了一半的内容
+    with open(SETTINGS_FILE + '.tmp', 'w', encoding='utf-8') as f:
         json.dump(settings, f, indent=4)
-    # 更新全局调试标志
-    global DEBUG_ENABLED
-    DEBUG_ENABLED = True if settings.get("debug_mode", 0) == 1 else False
+    os.replace(SETTINGS_FILE + '.tmp', SETTINGS_FILE)
+    # 更新日志输出设置
+    logger.configure(console=settings.get("debug_mode", 0) == 1,
+                     file_level='DEBUG' if settings.get("debug_mode", 0) == 1 else settings.get("log_level", "INFO"))
 
 def show_settings_window(current_settings):
+    import tkinter as tk
+    from tkinter import filedialog, messagebox
     window = tk.Tk()
     window.title("设置")
-    window.geometry("500x430")
+    window.geometry("500x535")
     window.resizable(False, False)
 
     entries = {}
@@ -94,8 +279,11 @@ def show_settings_window(current_settings):
         "board_scan_interval": "棋盘识别间隔 (s):",
         "board_click_interval": "棋盘点击间隔 (s):",
         "fixed_scan_interval": "固定刷新识别间隔 (s):",
+        "adaptive_scan": "自适应识别间隔:",
         "confidence_threshold": "置信度阈值 (0.0-1.0):",
+        "inference_threads": "推理线程数 (0=自动):",
         "use_mouse_click": "使用鼠标点击:",
+        "likelihood_inference": "概率推断走法:",
         "debug_mode": "调试模式:",
         "model_path": "识别模型:"
     }
@@ -114,7 +302,7 @@ def show_settings_window(current_settings):
 
         if key == "model_path":
             def browse_file(entry_widget=entry):
-                filepath = filedialog.askopenfilename(filetypes=[("PyTorch Models", "*.pt")])
+                filepath = filedialog.askopenfilename(filetypes=[("识别模型", "*.pt *.onnx *.cellnet"), ("PyTorch Models", "*.pt"), ("ONNX Models", "*.onnx"), ("逐格分类器", "*.cellnet")])
                 if filepath:
                     entry_widget.delete(0, tk.END)
                     entry_widget.insert(0, filepath)
@@ -124,20 +312,25 @@ def show_settings_window(current_settings):
 
     def on_save():
         try:
-            new_settings = {
+            # 保留未在界面中列出的设置项
+            new_settings = dict(current_settings)
+            new_settings.update({
                 "engine_threads": int(entries["engine_threads"].get()),
                 "hash_size": int(entries["hash_size"].get()),
                 "engine_think_time": int(entries["engine_think_time"].get()),
                 "board_scan_interval": float(entries["board_scan_interval"].get()),
                 "board_click_interval": float(entries["board_click_interval"].get()),
                 "fixed_scan_interval": float(entries["fixed_scan_interval"].get()),
+                "adaptive_scan": int(entries["adaptive_scan"].get()),
                 "model_path": entries["model_path"].get(),
                 "confidence_threshold": float(entries["confidence_threshold"].get()),
+                "inference_threads": int(entries["inference_threads"].get()),
                 "use_mouse_click": int(entries["use_mouse_click"].get()),
+                "likelihood_inference": int(entries["likelihood_inference"].get()),
                 "debug_mode": int(entries["debug_mode"].get())
-            }
+            })
             save_settings(new_settings)
-            messagebox.showinfo("成功", "设置已保存！部分设置将在程序重启后生效。")
+            messagebox.showinfo("成功", "设置已保存并立即生效！更换识别模型会在后台加载完成后自动切换。")
             window.destroy()
         except ValueError:
             messagebox.showerror("错误", "输入无效，请确保数值格式正确。")
@@ -158,6 +351,1000 @@ def show_settings_window(current_settings):
 class EngineCommunicationError(Exception):
     pass
 
+# --- 紧凑局面表示 ---
+# 局面统一以"红方在下"的方向编码为长度90的字符串（行优先，第0行为黑方底线），
+# 明子使用FEN字符（红大写、黑小写），暗子为 'X'/'x'，空位为 '.'。
+EMPTY_CELL = '.'
+
+# 每个初始位置对应的兵种，暗子按其所在初始位置的兵种走子
+START_ROLES = (
+    "RNBAKABNR"
+    "........."
+    ".C.....C."
+    "P.P.P.P.P"
+    "........."
+    "........."
+    "P.P.P.P.P"
+    ".C.....C."
+    "........."
+    "RNBAKABNR"
+)
+
+def board_to_compact(board_state, flipped=False):
+    """将界面棋盘 (10x9 列表) 转换为紧凑局面字符串。flipped 为 True 表示棋盘黑方在下，需要翻转。"""
+    rows = board_state[::-1] if flipped else board_state
+    cells = []
+    for row in rows:
+        for piece in (row[::-1] if flipped else row):
+            if not piece:
+                cells.append(EMPTY_CELL)
+            else:
+                p_char = piece[1]
+                cells.append(p_char.upper() if piece[0] == 'r' else p_char.lower())
+    return ''.join(cells)
+
+def compact_to_board(cells, flipped=False):
+    """board_to_compact 的逆变换，返回界面棋盘 (10x9 列表)。"""
+    board = [['' for _ in range(9)] for _ in range(10)]
+    for sq, p in enumerate(cells):
+        if p != EMPTY_CELL:
+            r, c = divmod(sq, 9)
+            if flipped:
+                r, c = 9 - r, 8 - c
+            board[r][c] = ('r' if p.isupper() else 'b') + p.upper()
+    return board
+
+def piece_role(cells, sq):
+    """返回格子上棋子的实际走法兵种（大写），暗子取其初始位置的兵种。"""
+    piece = cells[sq]
+    if piece in 'Xx':
+        return START_ROLES[sq]
+    return piece.upper()
+
+# --- 预计算走法表 ---
+# 所有表均以紧凑局面的格子下标 (0-89) 为索引，在模块加载时一次性生成。
+def _on_board(r, c):
+    return 0 <= r < 10 and 0 <= c < 9
+
+def _in_palace(r, c):
+    return 3 <= c <= 5 and (r <= 2 or r >= 7)
+
+def _build_move_tables():
+    rook_rays, knight_moves, knight_attackers = [], [], []
+    advisor_moves, palace_advisor_moves, bishop_moves, king_moves = [], [], [], []
+    pawn_moves = {'r': [], 'b': []}
+    pawn_attackers = {'r': [[] for _ in range(90)], 'b': [[] for _ in range(90)]}
+    for sq in range(90):
+        r, c = divmod(sq, 9)
+        rays = []
+        for dr, dc in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+            ray = []
+            nr, nc = r + dr, c + dc
+            while _on_board(nr, nc):
+                ray.append(nr * 9 + nc)
+                nr, nc = nr + dr, nc + dc
+            rays.append(tuple(ray))
+        rook_rays.append(tuple(rays))
+
+        # 马：(目标, 马腿)；反向表为 (马所在格, 马腿)，用于将军检测
+        moves, attackers = [], []
+        for dr, dc in ((2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2)):
+            nr, nc = r + dr, c + dc
+            if not _on_board(nr, nc):
+                continue
+            leg = (r + dr // 2) * 9 + c if abs(dr) == 2 else r * 9 + c + dc // 2
+            moves.append((nr * 9 + nc, leg))
+            back_leg = (nr - dr // 2) * 9 + nc if abs(dr) == 2 else nr * 9 + nc - dc // 2
+            attackers.append((nr * 9 + nc, back_leg))
+        knight_moves.append(tuple(moves))
+        knight_attackers.append(tuple(attackers))
+
+        diag, palace_diag, bishop = [], [], []
+        for dr, dc in ((1, 1), (1, -1), (-1, 1), (-1, -1)):
+            if _on_board(r + dr, c + dc):
+                diag.append((r + dr) * 9 + c + dc)
+                if _in_palace(r + dr, c + dc):
+                    palace_diag.append((r + dr) * 9 + c + dc)
+            if _on_board(r + 2 * dr, c + 2 * dc):
+                bishop.append(((r + 2 * dr) * 9 + c + 2 * dc, (r + dr) * 9 + c + dc))
+        advisor_moves.append(tuple(diag))
+        palace_advisor_moves.append(tuple(palace_diag))
+        bishop_moves.append(tuple(bishop))
+
+        king_moves.append(tuple((r + dr) * 9 + c + dc for dr, dc in ((1, 0), (-1, 0), (0, 1), (0, -1))
+                                if _on_board(r + dr, c + dc) and _in_palace(r + dr, c + dc)))
+
+        # 兵卒：红兵向上 (行号减小)，过河 (行号<=4) 后可横走；黑卒相反
+        for side, forward, crossed in (('r', -1, r <= 4), ('b', 1, r >= 5)):
+            steps = []
+            if _on_board(r + forward, c):
+                steps.append((r + forward) * 9 + c)
+            if crossed:
+                steps.extend(r * 9 + nc for nc in (c - 1, c + 1) if _on_board(r, nc))
+            pawn_moves[side].append(tuple(steps))
+            for to in steps:
+                pawn_attackers[side][to].append(sq)
+    pawn_attackers = {side: tuple(tuple(a) for a in table) for side, table in pawn_attackers.items()}
+    return (tuple(rook_rays), tuple(knight_moves), tuple(knight_attackers), tuple(advisor_moves),
+            tuple(palace_advisor_moves), tuple(bishop_moves), tuple(king_moves),
+            {side: tuple(t) for side, t in pawn_moves.items()}, pawn_attackers)
+
+(ROOK_RAYS, KNIGHT_MOVES, KNIGHT_ATTACKERS, ADVISOR_MOVES, PALACE_ADVISOR_MOVES,
+ BISHOP_MOVES, KING_MOVES, PAWN_MOVES, PAWN_ATTACKERS) = _build_move_tables()
+
+def _is_red(piece):
+    return piece.isupper()
+
+def is_in_check(cells, side):
+    """判断 side ('r'/'b') 一方的将帅是否正被将军（含将帅对脸）。"""
+    king_sq = cells.find('K' if side == 'r' else 'k')
+    if king_sq < 0:
+        return False
+    enemy_red = side == 'b'
+    enemy = 'b' if side == 'r' else 'r'
+
+    # 直线方向：车、炮、对脸的将帅（ROOK_RAYS 的前两条射线为纵向）
+    for i, ray in enumerate(ROOK_RAYS[king_sq]):
+        screened = False
+        for sq in ray:
+            p = cells[sq]
+            if p == EMPTY_CELL:
+                continue
+            if not screened:
+                if _is_red(p) == enemy_red:
+                    role = piece_role(cells, sq)
+                    if role == 'R' or (role == 'K' and i < 2):
+                        return True
+                screened = True
+            else:
+                if _is_red(p) == enemy_red and piece_role(cells, sq) == 'C':
+                    return True
+                break
+
+    for sq, leg in KNIGHT_ATTACKERS[king_sq]:
+        p = cells[sq]
+        if p != EMPTY_CELL and _is_red(p) == enemy_red and cells[leg] == EMPTY_CELL and piece_role(cells, sq) == 'N':
+            return True
+
+    for sq in PAWN_ATTACKERS[enemy][king_sq]:
+        p = cells[sq]
+        if p != EMPTY_CELL and _is_red(p) == enemy_red and piece_role(cells, sq) == 'P':
+            return True
+
+    # 揭棋中翻开的士、象不受九宫与河界限制，同样可能将军
+    for sq in ADVISOR_MOVES[king_sq]:
+        p = cells[sq]
+        if p != EMPTY_CELL and _is_red(p) == enemy_red and piece_role(cells, sq) == 'A':
+            return True
+    for sq, eye in BISHOP_MOVES[king_sq]:
+        p = cells[sq]
+        if p != EMPTY_CELL and _is_red(p) == enemy_red and cells[eye] == EMPTY_CELL and piece_role(cells, sq) == 'B':
+            return True
+    return False
+
+def generate_pseudo_moves(cells, side):
+    """生成 side 一方的所有伪合法走法 [(from_sq, to_sq), ...]，暗子按初始位置兵种走子。"""
+    own_red = side == 'r'
+    moves = []
+    for sq, p in enumerate(cells):
+        if p == EMPTY_CELL or _is_red(p) != own_red:
+            continue
+        dark = p in 'Xx'
+        role = START_ROLES[sq] if dark else p.upper()
+        if role == 'R' or role == 'C':
+            for ray in ROOK_RAYS[sq]:
+                screened = False
+                for to in ray:
+                    q = cells[to]
+                    if not screened:
+                        if q == EMPTY_CELL:
+                            moves.append((sq, to))
+                            continue
+                        if role == 'R':
+                            if _is_red(q) != own_red:
+                                moves.append((sq, to))
+                            break
+                        screened = True
+                    elif q != EMPTY_CELL:
+                        if _is_red(q) != own_red:
+                            moves.append((sq, to))
+                        break
+            continue
+        if role == 'N':
+            targets = (to for to, leg in KNIGHT_MOVES[sq] if cells[leg] == EMPTY_CELL)
+        elif role == 'B':
+            targets = (to for to, eye in BISHOP_MOVES[sq] if cells[eye] == EMPTY_CELL)
+        elif role == 'A':
+            targets = PALACE_ADVISOR_MOVES[sq] if dark else ADVISOR_MOVES[sq]
+        elif role == 'K':
+            targets = KING_MOVES[sq]
+        elif role == 'P':
+            targets = PAWN_MOVES[side][sq]
+        else:
+            continue
+        for to in targets:
+            q = cells[to]
+            if q == EMPTY_CELL or _is_red(q) != own_red:
+                moves.append((sq, to))
+    return moves
+
+def apply_compact_move(cells, from_sq, to_sq, piece=None):
+    """在紧凑局面上执行走法，返回新局面。piece 为落点处的棋子（用于暗子翻开），默认为原棋子。"""
+    if piece is None:
+        piece = cells[from_sq]
+    board = list(cells)
+    board[from_sq] = EMPTY_CELL
+    board[to_sq] = piece
+    return ''.join(board)
+
+def generate_legal_moves(cells, side):
+    """生成 side 一方的所有合法走法（走后己方不被将军、将帅不对脸）。"""
+    return [(f, t) for f, t in generate_pseudo_moves(cells, side)
+            if not is_in_check(apply_compact_move(cells, f, t), side)]
+
+class PositionHistory:
+    """
+    定长环形局面历史。
+    每个局面以"紧凑局面+走棋方"为键，另维护 键 -> [出现次数, 最近出现的步数] 索引，
+    使重复局面与长将的判断均为O(1)，且内存占用不随对局长度增长。
+    """
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self._ring = collections.deque()  # (key, ply)
+        self._index = {}
+        self._check_streak = {'r': 0, 'b': 0}
+        self._ply = 0
+        self._cycle = 0
+        self._last_key = None
+
+    def __len__(self):
+        return len(self._ring)
+
+    def clear(self):
+        self._ring.clear()
+        self._index.clear()
+        self._check_streak = {'r': 0, 'b': 0}
+        self._ply = 0
+        self._cycle = 0
+        self._last_key = None
+
+    def push(self, cells, side_to_move, in_check=None):
+        """记录一个新局面。in_check 为 None 时自动判断走棋方是否被将军。"""
+        if in_check is None:
+            in_check = is_in_check(cells, side_to_move)
+        key = cells + side_to_move
+
+        if len(self._ring) >= self.capacity:
+            old_key, _ = self._ring.popleft()
+            entry = self._index[old_key]
+            entry[0] -= 1
+            if entry[0] == 0:
+                del self._index[old_key]
+
+        self._ply += 1
+        entry = self._index.get(key)
+        if entry:
+            self._cycle = self._ply - entry[1]
+            entry[0] += 1
+            entry[1] = self._ply
+        else:
+            self._cycle = 0
+            self._index[key] = [1, self._ply]
+
+        self._check_streak[side_to_move] = self._check_streak[side_to_move] + 1 if in_check else 0
+        self._ring.append((key, self._ply))
+        self._last_key = key
+
+    def repetition_count(self, cells=None, side_to_move=None):
+        """返回指定局面（默认为最新局面）在历史窗口中的出现次数。"""
+        key = self._last_key if cells is None else cells + side_to_move
+        entry = self._index.get(key)
+        return entry[0] if entry else 0
+
+    def is_threefold(self):
+        return self.repetition_count() >= 3
+
+    def perpetual_checker(self, min_count=3):
+        """
+        若最新局面已重复 min_count 次，且在最近一个循环中某一方每次轮到走棋都被将军，
+        返回长将的一方 ('r'/'b')，否则返回 None。
+        """
+        if self._cycle == 0 or self.repetition_count() < min_count:
+            return None
+        turns_in_cycle = self._cycle // 2
+        for side in ('r', 'b'):
+            if turns_in_cycle and self._check_streak[side] >= turns_in_cycle:
+                return 'b' if side == 'r' else 'r'
+        return None
+
+class LatencyStats:
+    """
+    轻量的分阶段耗时统计：固定分桶直方图 + 计数器。
+    另按"每步棋"累计各阶段耗时，保留最近若干步的分解，可定期导出为 JSON 快照与 Prometheus 文本。
+    每步分解中 stages_ms 只含互不重叠的叶子阶段（总和不超过 total_ms）；包含其它阶段的外层阶段
+    （span=True，如 stabilize 包含 capture 与 inference）单独列在 spans_ms 中，不与叶子阶段相加。
+    """
+    BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+    def __init__(self, recent_moves=50):
+        self.started_at = time.time()
+        self.histograms = {}
+        self.counters = collections.Counter()
+        self.recent_moves = collections.deque(maxlen=recent_moves)
+        self._move_stages = collections.defaultdict(float)
+        self._move_spans = collections.defaultdict(float)
+        self._move_start = time.perf_counter()
+        self._last_export = time.time()
+
+    def observe(self, stage, seconds, span=False):
+        hist = self.histograms.get(stage)
+        if hist is None:
+            hist = self.histograms[stage] = {'buckets': [0] * (len(self.BUCKETS_MS) + 1), 'count': 0, 'sum': 0.0, 'max': 0.0}
+        ms = seconds * 1000.0
+        i = 0
+        while i < len(self.BUCKETS_MS) and ms > self.BUCKETS_MS[i]:
+            i += 1
+        hist['buckets'][i] += 1
+        hist['count'] += 1
+        hist['sum'] += ms
+        if ms > hist['max']:
+            hist['max'] = ms
+        (self._move_spans if span else self._move_stages)[stage] += ms
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def end_move(self, label):
+        """一步棋结束（我方确认或检测到对手走法）时调用，记录本步的总耗时与各阶段分解。"""
+        now = time.perf_counter()
+        total = now - self._move_start
+        self.observe(f"move_{label}", total, span=True)
+        self._move_spans.pop(f"move_{label}", None)
+        self.recent_moves.append({'label': label, 'total_ms': round(total * 1000.0, 2),
+                                  'stages_ms': {k: round(v, 2) for k, v in self._move_stages.items()},
+                                  'spans_ms': {k: round(v, 2) for k, v in self._move_spans.items()}})
+        self._move_stages.clear()
+        self._move_spans.clear()
+        self._move_start = now
+
+    def snapshot(self):
+        stages = {}
+        for stage, hist in self.histograms.items():
+            stages[stage] = {
+                'count': hist['count'],
+                'mean_ms': round(hist['sum'] / hist['count'], 3) if hist['count'] else 0.0,
+                'max_ms': round(hist['max'], 3),
+                'buckets_ms': dict(zip([str(b) for b in self.BUCKETS_MS] + ['+Inf'], hist['buckets'])),
+            }
+        return {'uptime_s': round(time.time() - self.started_at, 1), 'stages': stages,
+                'counters': dict(self.counters), 'recent_moves': list(self.recent_moves)}
+
+    def to_prometheus(self):
+        lines = ['# TYPE moonlink_stage_latency_ms histogram']
+        for stage, hist in self.histograms.items():
+            cumulative = 0
+            for bound, n in zip([str(b) for b in self.BUCKETS_MS] + ['+Inf'], hist['buckets']):
+                cumulative += n
+                lines.append(f'moonlink_stage_latency_ms_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'moonlink_stage_latency_ms_sum{{stage="{stage}"}} {hist["sum"]:.3f}')
+            lines.append(f'moonlink_stage_latency_ms_count{{stage="{stage}"}} {hist["count"]}')
+        lines.append('# TYPE moonlink_events_total counter')
+        for name, n in sorted(self.counters.items()):
+            lines.append(f'moonlink_events_total{{event="{name}"}} {n}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, directory):
+        """写出 metrics.json 与 metrics.prom（先写临时文件再替换，避免读到半个文件）。"""
+        os.makedirs(directory, exist_ok=True)
+        for filename, content in (('metrics.json', json.dumps(self.snapshot(), indent=2, ensure_ascii=False)),
+                                  ('metrics.prom', self.to_prometheus())):
+            path = os.path.join(directory, filename)
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(path + '.tmp', path)
+        self._last_export = time.time()
+
+    def maybe_export(self, directory, interval):
+        if interval and interval > 0 and time.time() - self._last_export >= interval:
+            try:
+                self.export(directory)
+            except OSError as e:
+                logger.warning("导出性能统计失败: %s", e)
+
+class FlightRecorder:
+    """
+    飞行记录仪：保存最近一段时间的ROI画面、识别结果、引擎收发与点击。
+    画面按 flight_fps 抽样后交给后台线程编码为JPEG，写入预分配的内存映射环形文件（固定大小的槽位）；
+    其余事件只是追加到内存队列。热路径上只有一次时间判断和一次非阻塞入队。
+    dump() 把缓冲区导出为一个目录：frames/*.jpg + events.jsonl + meta.json，可由离线工具回放。
+    """
+    SLOT_BYTES = 256 * 1024
+
+    def __init__(self, directory, seconds=20.0, fps=4.0, meta=None):
+        self.directory = directory
+        self.seconds = seconds
+        self.min_interval = 1.0 / fps if fps > 0 else 0.0
+        self.meta = meta or {}
+        self.num_slots = int(seconds * fps) + 8
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(os.path.join(directory, 'ring.bin'), 'w+b')
+        self._file.truncate(self.num_slots * self.SLOT_BYTES)
+        self._map = mmap.mmap(self._file.fileno(), self.num_slots * self.SLOT_BYTES)
+        self._frames = collections.deque()  # (seq, t, slot, length)
+        self._events = collections.deque()  # (t, kind, payload)
+        self._seq = 0
+        self._last_frame_time = 0.0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=4)
+        self._thread = threading.Thread(target=self._encode_loop, name="flight-recorder", daemon=True)
+        self._thread.start()
+
+    def record_frame(self, img_bgr):
+        now = time.time()
+        if now - self._last_frame_time < self.min_interval:
+            return
+        self._last_frame_time = now
+        try:
+            self._queue.put_nowait((now, img_bgr))
+        except queue.Full:
+            pass
+
+    def record_event(self, kind, payload):
+        now = time.time()
+        self._events.append((now, kind, payload))
+        cutoff = now - self.seconds
+        while self._events and self._events[0][0] < cutoff:
+            self._events.popleft()
+
+    def _encode_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            t, img = item
+            import cv2
+            ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 80])
+            if not ok or len(buf) > self.SLOT_BYTES:
+                continue
+            with self._lock:
+                slot = self._seq % self.num_slots
+                offset = slot * self.SLOT_BYTES
+                self._map[offset:offset + len(buf)] = buf.tobytes()
+                self._frames.append((self._seq, t, slot, len(buf)))
+                self._seq += 1
+                while len(self._frames) > self.num_slots or (self._frames and self._frames[0][1] < t - self.seconds):
+                    self._frames.popleft()
+
+    def dump(self, reason="manual"):
+        """导出缓冲区，返回导出目录。"""
+        bundle = os.path.join(self.directory, f"bundle-{time.strftime('%Y%m%d-%H%M%S')}-{reason}")
+        os.makedirs(os.path.join(bundle, 'frames'), exist_ok=True)
+        with self._lock:
+            frames = list(self._frames)
+            blobs = [bytes(self._map[slot * self.SLOT_BYTES:slot * self.SLOT_BYTES + length]) for _, _, slot, length in frames]
+        index = []
+        for (seq, t, _, _), blob in zip(frames, blobs):
+            name = f"{seq:08d}.jpg"
+            with open(os.path.join(bundle, 'frames', name), 'wb') as f:
+                f.write(blob)
+            index.append({'t': t, 'kind': 'frame', 'payload': f"frames/{name}"})
+        events = [{'t': t, 'kind': kind, 'payload': payload} for t, kind, payload in list(self._events)]
+        with open(os.path.join(bundle, 'events.jsonl'), 'w', encoding='utf-8') as f:
+            for record in sorted(index + events, key=lambda r: r['t']):
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        with open(os.path.join(bundle, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(dict(self.meta, reason=reason, dumped_at=time.time()), f, indent=2, ensure_ascii=False)
+        return bundle
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=1)
+        self._map.close()
+        self._file.close()
+
+# 与 train_tools/create_dataset.py 的 CLASS_NAMES 顺序一致，难例标签可直接与合成数据混合训练
+DATASET_CLASS_NAMES = [f"{c}{p}" for c in 'rb' for p in 'PRKNCABX'] + ['board']
+
+class HardExampleSink:
+    """
+    难例采集：把识别不确定或前后矛盾的ROI画面连同模型的识别结果（作为预标注）保存为 YOLO 数据集目录：
+    images/{train,val}/*.jpg + labels/{train,val}/*.txt + classes.txt，
+    类别顺序与 create_dataset 相同，可直接并入训练数据，或用 packed_dataset.py pack 打包、evaluate.py 评估。
+    热路径上只做一次时间判断和一次非阻塞入队；编码、感知哈希去重与磁盘容量控制都在后台线程中进行。
+    文件名中带有采集原因与画面哈希，重启后按文件名恢复去重集合；总大小超过上限时删除最早的样本。
+    """
+    HASH_SIZE = 16  # 差值哈希 16x16 = 256 位
+
+    def __init__(self, directory, max_mb=500.0, min_interval=2.0, hash_distance=8, val_every=10):
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.min_interval = min_interval
+        self.hash_distance = hash_distance
+        self.val_every = val_every
+        self._last_offer = 0.0
+        self.saved = 0
+        self.duplicates = 0
+        for split in ('train', 'val'):
+            os.makedirs(os.path.join(directory, 'images', split), exist_ok=True)
+            os.makedirs(os.path.join(directory, 'labels', split), exist_ok=True)
+        with open(os.path.join(directory, 'classes.txt'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(DATASET_CLASS_NAMES) + '\n')
+        self._files = []  # (文件名, 划分, 图片+标签字节数)，按采集时间排序
+        self._hashes = {}  # 文件名 -> 哈希
+        for split in ('train', 'val'):
+            for name in os.listdir(os.path.join(directory, 'images', split)):
+                stem = os.path.splitext(name)[0]
+                try:
+                    self._hashes[stem] = int(stem.rsplit('-', 1)[1], 16)
+                except (IndexError, ValueError):
+                    continue
+                self._files.append((stem, split, self._sample_bytes(stem, split)))
+        self._files.sort()
+        self._total = sum(size for _, _, size in self._files)
+        self._queue = queue.Queue(maxsize=4)
+        self._thread = threading.Thread(target=self._write_loop, name="hard-examples", daemon=True)
+        self._thread.start()
+
+    def offer(self, img_bgr, labels, reason):
+        """
+        提交一帧。labels: [(棋子名, cx, cy, w, h)]，坐标已按ROI宽高归一化；
+        也可以传入返回该列表的函数，只在这一帧确实会入队时才调用，被限流丢弃的帧不必生成预标注。
+        距上次提交不足 min_interval 或队列已满时直接丢弃。
+        """
+        if img_bgr is None:
+            return False
+        now = time.time()
+        if now - self._last_offer < self.min_interval or self._queue.full():
+            return False
+        if callable(labels):
+            labels = labels()
+        try:
+            self._queue.put_nowait((now, img_bgr, labels, reason))
+        except queue.Full:
+            return False
+        self._last_offer = now
+        return True
+
+    @classmethod
+    def perceptual_hash(cls, img_bgr):
+        """差值哈希：灰度缩小到 (N+1)xN 后比较相邻像素的明暗，对轻微的亮度与压缩差异不敏感。"""
+        import cv2
+        gray = cv2.resize(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY), (cls.HASH_SIZE + 1, cls.HASH_SIZE),
+                          interpolation=cv2.INTER_AREA)
+        bits = (gray[:, 1:] > gray[:, :-1]).flatten()
+        return int(''.join('1' if b else '0' for b in bits), 2)
+
+    def _is_duplicate(self, digest):
+        return any(bin(digest ^ other).count('1') <= self.hash_distance for other in self._hashes.values())
+
+    def _sample_bytes(self, stem, split):
+        total = 0
+        for path in (os.path.join(self.directory, 'images', split, stem + '.jpg'),
+                     os.path.join(self.directory, 'labels', split, stem + '.txt')):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def _write_loop(self):
+        import cv2
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            t, img, labels, reason = item
+            digest = self.perceptual_hash(img)
+            if self._is_duplicate(digest):
+                self.duplicates += 1
+                continue
+            ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 95])
+            if not ok:
+                continue
+            stem = (f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(t))}-{int(t * 1000) % 1000:03d}"
+                    f"-{reason}-{digest:0{self.HASH_SIZE * self.HASH_SIZE // 4}x}")
+            split = 'val' if self.val_every and digest % self.val_every == 0 else 'train'
+            lines = [f"{DATASET_CLASS_NAMES.index(name)} {cx:.6f} {cy:.6f} {w:.6f} {h:.6f}\n"
+                     for name, cx, cy, w, h in labels if name in DATASET_CLASS_NAMES]
+            try:
+                with open(os.path.join(self.directory, 'images', split, stem + '.jpg'), 'wb') as f:
+                    f.write(buf.tobytes())
+                with open(os.path.join(self.directory, 'labels', split, stem + '.txt'), 'w', encoding='utf-8') as f:
+                    f.writelines(lines)
+            except OSError as e:
+                logger.warning("难例保存失败: %s", e)
+                continue
+            self._hashes[stem] = digest
+            size = self._sample_bytes(stem, split)
+            self._files.append((stem, split, size))
+            self._total += size
+            self.saved += 1
+            logger.debug("[难例] 已保存 %s (%s, %d 个标注)", stem, reason, len(lines))
+            while self._total > self.max_bytes and len(self._files) > 1:
+                old, old_split, old_size = self._files.pop(0)
+                for path in (os.path.join(self.directory, 'images', old_split, old + '.jpg'),
+                             os.path.join(self.directory, 'labels', old_split, old + '.txt')):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                self._hashes.pop(old, None)
+                self._total -= old_size
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=2)
+
+class ScanScheduler:
+    """
+    对手回合的自适应识别调度。
+    - 我方走完或开局后以 scan_min_interval 快速识别；之后每次识别无变化，间隔按 scan_backoff 指数增长，上限 scan_max_interval。
+    - 两次识别之间每隔 motion_poll_interval 截屏一次，只与上次识别时的画面做按格的像素差分（不推理），
+      任一格平均差异超过 motion_threshold 即视为有动静，立即识别并恢复最短间隔。
+    - 由调度器触发的识别与运动检测截屏，累计耗时占本次会话（从新局开始算起）时长的比例不超过 scan_cpu_budget
+      （0 表示不限），超出时推迟截屏与识别。我方回合的确认识别与等待新局时的识别不由调度器控制，不计入预算。
+    设置每次调用时从传入的 settings 读取，支持运行中修改。
+    """
+
+    def __init__(self):
+        self.start_session()
+
+    def start_session(self):
+        """新局开始时调用：清零会话计时、累计耗时与差分参照，预算按新的一局重新计算，不含等待新局的空闲时间。"""
+        self.started = time.time()
+        self.spent = 0.0
+        self.interval = None
+        self.last_scan = self.started
+        self._reference = None
+        self._triggered = False
+
+    def reset(self, settings):
+        """我方走完或新局开始：恢复最短识别间隔。"""
+        self.interval = settings.get('scan_min_interval', 0.1)
+        self._triggered = False
+
+    def spend(self, seconds):
+        self.spent += seconds
+
+    def charge_scan(self, seconds):
+        """记录一次识别的耗时：只有 wait() 返回后、note_scan() 之前的识别计入预算。"""
+        if self._triggered:
+            self.spent += seconds
+
+    def within_budget(self, settings):
+        budget = settings.get('scan_cpu_budget', 0.5)
+        return budget <= 0 or self.spent <= budget * (time.time() - self.started)
+
+    @staticmethod
+    def _signature(frame):
+        """降采样灰度图，尺寸裁成10x9格的整数倍，每格约8x8个采样点。"""
+        step = max(1, min(frame.shape[0] // 80, frame.shape[1] // 72))
+        gray = frame[::step, ::step].mean(axis=2, dtype=np.float32)
+        h, w = gray.shape[0] // 10 * 10, gray.shape[1] // 9 * 9
+        return gray[:h, :w]
+
+    def note_scan(self, frame):
+        """记录一次完成的识别及其画面，作为之后像素差分的参照。"""
+        self.last_scan = time.time()
+        self._triggered = False
+        self._reference = self._signature(frame) if frame is not None else None
+
+    def _moved(self, frame, threshold):
+        current = self._signature(frame)
+        if current.shape != self._reference.shape:
+            return True
+        h, w = current.shape
+        cells = np.abs(current - self._reference).reshape(10, h // 10, 9, w // 9).mean(axis=(1, 3))
+        return float(cells.max()) > threshold
+
+    def wait(self, player):
+        """等待下一次识别的时机，返回 'motion'（画面变化）或 'timer'（间隔到期）。"""
+        settings = player.settings
+        if self.interval is None:
+            self.reset(settings)
+        deadline = self.last_scan + self.interval
+        while not player.game_over:
+            budget_ok = self.within_budget(settings)
+            if time.time() >= deadline and budget_ok:
+                self.interval = min(self.interval * settings.get('scan_backoff', 1.5), settings.get('scan_max_interval', 2.0))
+                self._triggered = True
+                return 'timer'
+            time.sleep(settings.get('motion_poll_interval', 0.05))
+            if self._reference is None or not budget_ok:
+                continue
+            start = time.perf_counter()
+            moved = self._moved(player._grab_roi('motion_poll'), settings.get('motion_threshold', 12.0))
+            self.spend(time.perf_counter() - start)
+            if moved:
+                self.interval = settings.get('scan_min_interval', 0.1)
+                self._triggered = True
+                return 'motion'
+        return 'timer'
+
+class StartupTimer:
+    """记录启动各阶段的耗时。各阶段可以在不同线程中并行执行，report() 汇总为一行文字。"""
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def run(self, name, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.phases[name] = time.perf_counter() - start
+
+    def report(self):
+        parts = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+        return f"{parts}; 自启动起共 {time.perf_counter() - self.started:.2f}s"
+
+def set_inference_threads(threads):
+    """固定 torch 的CPU推理线程数；0 表示使用库的默认值。需要在执行推理的线程中调用。"""
+    if threads and threads > 0:
+        import torch
+        torch.set_num_threads(int(threads))
+
+def load_yolo_model(model_path, threads=0):
+    """导入 ultralytics 并加载模型。耗时主要在导入 torch 与读取权重，可在后台线程中调用。"""
+    from ultralytics import YOLO
+    set_inference_threads(threads)
+    return YOLO(model_path)
+
+CELL_CLASSIFIER_EXT = '.cellnet'
+
+class CellClassifier:
+    """
+    逐格分类器（train_tools/train_cell_classifier.py 训练导出的 TorchScript 模型）。
+    棋子位置固定，整盘识别即90个格子各自分类：ROI 一次缩放到 9S x 10S 后按格切开，90格作为一个批次推理。
+    names 与 YOLO 的 model.names 形式相同（类别序号 -> 棋子名），空格类别不在其中。
+    """
+
+    def __init__(self, model_path):
+        import torch
+        self._torch = torch
+        extra = {'meta.json': ''}
+        self.module = torch.jit.load(model_path, map_location='cpu', _extra_files=extra).eval()
+        meta = json.loads(extra['meta.json'])
+        self.labels = meta['names']  # 类别序号 -> 棋子名，空格为 ''
+        self.size = meta['size']
+        self.names = {i: name for i, name in enumerate(self.labels) if name}
+
+    def _predict(self, crops):
+        """crops: (N, S, S, 3) uint8 BGR，返回 (N, 类别数) 概率。"""
+        torch = self._torch
+        with torch.inference_mode():
+            x = torch.from_numpy(np.ascontiguousarray(crops)).permute(0, 3, 1, 2).float().div_(255)
+            return torch.softmax(self.module(x), dim=1).numpy()
+
+    def _decode(self, probs, threshold):
+        """单格概率 -> (棋子名或'', {棋子名: 概率})，保留概率不低于1%的棋子供概率推断使用。"""
+        scores = {name: float(probs[i]) for i, name in enumerate(self.labels) if name and probs[i] >= 0.01}
+        best = int(probs.argmax())
+        name = self.labels[best] if probs[best] > threshold else ''
+        return name, scores
+
+    def classify_board(self, img_bgr, threshold):
+        """识别整盘，返回 (棋盘, 逐格 {棋子名: 概率})，形式与检测模型的结果相同。"""
+        import cv2
+        s = self.size
+        resized = cv2.resize(img_bgr, (9 * s, 10 * s), interpolation=cv2.INTER_AREA)
+        crops = resized.reshape(10, s, 9, s, 3).transpose(0, 2, 1, 3, 4).reshape(90, s, s, 3)
+        probs = self._predict(crops)
+        board, scores = [], []
+        for row in range(10):
+            decoded = [self._decode(probs[row * 9 + col], threshold) for col in range(9)]
+            board.append([name for name, _ in decoded])
+            scores.append([cell for _, cell in decoded])
+        return board, scores
+
+    def classify_cells(self, img_bgr, positions, threshold):
+        """只识别指定格子，返回 {(row, col): 棋子名或''}。"""
+        import cv2
+        grid_h, grid_w = img_bgr.shape[0] / 10, img_bgr.shape[1] / 9
+        crops = np.stack([
+            cv2.resize(img_bgr[int(row * grid_h):int((row + 1) * grid_h), int(col * grid_w):int((col + 1) * grid_w)],
+                       (self.size, self.size), interpolation=cv2.INTER_AREA)
+            for row, col in positions])
+        probs = self._predict(crops)
+        return {pos: self._decode(p, threshold)[0] for pos, p in zip(positions, probs)}
+
+def load_recognition_model(model_path, threads=0):
+    """按扩展名加载识别模型：.cellnet 为逐格分类器，其它交给 ultralytics。"""
+    if model_path.lower().endswith(CELL_CLASSIFIER_EXT):
+        set_inference_threads(threads)
+        return CellClassifier(model_path)
+    return load_yolo_model(model_path, threads)
+
+def run_in_background(name, func, *args):
+    """在后台守护线程中执行 func，返回 Future。程序退出时不必等待其完成。"""
+    future = concurrent.futures.Future()
+    def worker():
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+    threading.Thread(target=worker, name=name, daemon=True).start()
+    return future
+
+def preload_model(model_path, startup, threads=0):
+    """在后台加载模型，返回 Future。"""
+    return run_in_background("model-preload", startup.run, 'model_preload', load_recognition_model, model_path, threads)
+
+def skin_fingerprint(img_bgr):
+    """
+    皮肤指纹：ROI 每隔4个像素取样，统计 4x4x4 的颜色直方图并归一化。
+    棋盘底色、线条与棋子配色占主导，棋子位置变化对它影响很小，计算不到1毫秒。
+    """
+    sample = img_bgr[::4, ::4] // 64
+    bins = (sample[:, :, 0].astype(np.int32) * 16 + sample[:, :, 1] * 4 + sample[:, :, 2]).ravel()
+    hist = np.bincount(bins, minlength=64).astype(np.float32)
+    return hist / max(hist.sum(), 1.0)
+
+class ModelRegistry:
+    """
+    皮肤档案登记表：把不同平台/皮肤映射到各自的识别模型与置信度阈值。登记文件为 JSON:
+        {"profiles": [{"name": "tiantian_wooden", "model_path": "resource/models/xxx.pt",
+                       "confidence_threshold": 0.9, "references": ["resource/models/tiantian_wooden.jpg"]}]}
+    references 是该皮肤下的棋盘ROI截图（飞行记录仪或难例采集保存的画面即可），加载时计算指纹；
+    match() 返回指纹距离（直方图差的一半，0~1）最近且不超过 max_distance 的档案。
+    已加载的模型按最近使用保留 capacity 个，切回最近用过的皮肤时直接取用，不再加载和预热。
+    """
+
+    def __init__(self, path, capacity=2, max_distance=0.25):
+        self.path = path
+        self.capacity = max(1, capacity)
+        self.max_distance = max_distance
+        with open(path, 'r', encoding='utf-8') as f:
+            self.profiles = json.load(f).get('profiles', [])
+        import cv2
+        base = os.path.dirname(path)
+        self._fingerprints = []  # (档案, 指纹)
+        for profile in self.profiles:
+            for ref in profile.get('references', []):
+                img = cv2.imread(ref if os.path.exists(ref) else os.path.join(base, ref))
+                if img is None:
+                    logger.warning("[模型登记] 档案 %s 的参考截图无法读取: %s", profile.get('name'), ref)
+                    continue
+                self._fingerprints.append((profile, skin_fingerprint(img)))
+        self._models = collections.OrderedDict()  # 模型路径 -> 已加载的模型，末尾为最近使用
+        self._lock = threading.Lock()
+
+    def match(self, img_bgr):
+        """返回 (档案或 None, 最近距离)。"""
+        if not self._fingerprints:
+            return None, 1.0
+        fingerprint = skin_fingerprint(img_bgr)
+        distance, profile = min(((float(np.abs(fingerprint - ref).sum()) / 2, profile)
+                                 for profile, ref in self._fingerprints), key=lambda item: item[0])
+        return (profile if distance <= self.max_distance else None), distance
+
+    def get(self, model_path):
+        with self._lock:
+            model = self._models.get(model_path)
+            if model is not None:
+                self._models.move_to_end(model_path)
+            return model
+
+    def put(self, model_path, model):
+        """登记已加载的模型，超出容量时丢弃最久未用的模型，返回被丢弃的模型路径。"""
+        with self._lock:
+            self._models[model_path] = model
+            self._models.move_to_end(model_path)
+            evicted = []
+            while len(self._models) > self.capacity:
+                evicted.append(self._models.popitem(last=False)[0])
+            return evicted
+
+def timed(stage, span=False):
+    """方法装饰器：将方法耗时计入 self.metrics 的 stage 直方图。span=True 表示方法内还有其它被计时的阶段。"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self.metrics.observe(stage, time.perf_counter() - start, span)
+        return wrapper
+    return decorator
+
+class InputInjector(abc.ABC):
+    """输入注入后端的基类。坐标均为屏幕绝对坐标。"""
+    name = "base"
+    needs_window = False
+
+    @abc.abstractmethod
+    def click(self, x, y):
+        """在屏幕坐标 (x, y) 处点击一次。"""
+
+    def click_sequence(self, points, wait_ack=None):
+        """
+        依次点击 points。除最后一次外，每次点击后调用 wait_ack(i) 等待画面确认该次点击已生效，
+        确认后立即发出下一次点击，而不是固定等待。
+        """
+        for i, (x, y) in enumerate(points):
+            self.click(x, y)
+            if wait_ack and i < len(points) - 1:
+                wait_ack(i)
+
+class Win32PostMessageInjector(InputInjector):
+    """使用 PostMessage 向游戏窗口发送后台点击消息。"""
+    name = "win32"
+    needs_window = True
+
+    def __init__(self, hwnd):
+        self.hwnd = hwnd
+
+    def click(self, x, y):
+        client_pos = win32gui.ScreenToClient(self.hwnd, (int(x), int(y)))
+        lParam = win32api.MAKELONG(client_pos[0], client_pos[1])
+        # 消息按顺序进入窗口队列，按下与抬起之间无需等待
+        win32api.PostMessage(self.hwnd, win32con.WM_LBUTTONDOWN, win32con.MK_LBUTTON, lParam)
+        win32api.PostMessage(self.hwnd, win32con.WM_LBUTTONUP, 0, lParam)
+
+class AutoGuiInjector(InputInjector):
+    """使用 pyautogui 移动真实鼠标进行点击。"""
+    name = "autogui"
+
+    def __init__(self):
+        import pyautogui
+        self._pyautogui = pyautogui
+
+    def click(self, x, y):
+        # 只对本次调用关闭 pyautogui 的全局停顿，不改动进程内其它使用者的 PAUSE 设置
+        self._pyautogui.click(x=x, y=y, _pause=False)
+
+class XTestInjector(InputInjector):
+    """使用 X11 XTest 扩展注入点击（Linux）。"""
+    name = "xtest"
+
+    def __init__(self):
+        from Xlib import X, display
+        from Xlib.ext import xtest
+        self._X = X
+        self._xtest = xtest
+        self._display = display.Display()
+
+    def click(self, x, y):
+        self._xtest.fake_input(self._display, self._X.MotionNotify, x=int(x), y=int(y))
+        self._xtest.fake_input(self._display, self._X.ButtonPress, 1)
+        self._xtest.fake_input(self._display, self._X.ButtonRelease, 1)
+        self._display.sync()
+
+class MockInjector(InputInjector):
+    """内存中的模拟后端：只记录点击，可选地通过 on_click 回调驱动模拟棋盘。"""
+    name = "mock"
+
+    def __init__(self, on_click=None):
+        self.clicks = []
+        self.on_click = on_click
+
+    def click(self, x, y):
+        self.clicks.append((x, y))
+        if self.on_click:
+            self.on_click(x, y)
+
+def create_injector(settings, hwnd=None):
+    """根据设置创建输入后端。auto: 设置了鼠标点击时用 autogui，否则 Windows 上用 win32，其余平台用 xtest。"""
+    backend = settings.get('input_backend', 'auto')
+    if backend == 'auto':
+        if settings.get('use_mouse_click', 0) == 1:
+            backend = 'autogui'
+        else:
+            backend = 'win32' if win32gui is not None else 'xtest'
+    if backend == 'win32':
+        return Win32PostMessageInjector(hwnd)
+    if backend == 'autogui':
+        return AutoGuiInjector()
+    if backend == 'xtest':
+        return XTestInjector()
+    if backend == 'mock':
+        return MockInjector()
+    raise ValueError(f"未知的输入后端: {backend}")
+
 def get_main_window_handle(hwnd):
     """获取窗口的顶级父句柄"""
     while win32gui.GetParent(hwnd):
@@ -166,6 +1353,7 @@ def get_main_window_handle(hwnd):
 
 def select_board_roi():
     """让用户通过截图和拖拽选择棋盘区域"""
+    import mss
     pygame.init()
     info = pygame.display.Info()
     screen_width, screen_height = info.current_w, info.current_h
@@ -234,9 +1422,108 @@ def select_board_roi():
     if rect:
         return {'top': rect.y, 'left': rect.x, 'width': rect.width, 'height': rect.height}
     else:
-        _d_print("未选择任何区域，程序退出。")
+        logger.debug("未选择任何区域，程序退出。")
         sys.exit()
 
+class DarkPiecePool:
+    """
+    增量维护的暗子库。
+    每次翻子或手动调整都记入撤销日志 [步数, 棋子, 所在格, 数量变化]，所在格随走子更新、被吃后置为 None。
+    某次翻子识别有误时，可从该条记录处撤销并以修正后的棋子重放之后的记录；FEN暗子串按需生成并缓存。
+    """
+    FEN_ORDER = ['R','r','N','n','B','b','A','a','C','c','P','p']
+    MAX_COUNTS = {'R':2,'N':2,'B':2,'A':2,'C':2,'P':5}
+
+    def __init__(self, initial):
+        self.initial = dict(initial)
+        self.counts = dict(initial)
+        self.log = []
+        self._fen_cache = None
+
+    def __getitem__(self, key):
+        return self.counts[key]
+
+    def __contains__(self, key):
+        return key in self.counts
+
+    def __repr__(self):
+        return repr(self.counts)
+
+    def get(self, key, default=0):
+        return self.counts.get(key, default)
+
+    def reset(self, counts=None):
+        self.counts = dict(self.initial if counts is None else counts)
+        self.log.clear()
+        self._fen_cache = None
+
+    def reveal(self, key, ply, square=None):
+        """记录一次翻子。库中该棋子数量已为0时仍记入日志（数量不变），以便之后修正。"""
+        delta = -1 if self.counts.get(key, 0) > 0 else 0
+        self.counts[key] = self.counts.get(key, 0) + delta
+        self.log.append([ply, key, square, delta])
+        self._fen_cache = None
+        return delta != 0
+
+    def adjust(self, key, delta):
+        """手动调整数量（界面上的 +/- 按钮），同样记入日志。"""
+        new_count = self.counts.get(key, 0) + delta
+        if not 0 <= new_count <= self.MAX_COUNTS[key[1]]:
+            return False
+        self.counts[key] = new_count
+        self.log.append([None, key, None, delta])
+        self._fen_cache = None
+        return True
+
+    def on_move(self, from_sq, to_sq):
+        """走子后更新日志中翻开棋子的所在格：终点上的旧棋子被吃，起点上的棋子移到终点。"""
+        for entry in self.log:
+            if entry[2] == to_sq:
+                entry[2] = None
+        for entry in self.log:
+            if entry[2] == from_sq:
+                entry[2] = to_sq
+
+    def reveal_index_at(self, square):
+        for index in range(len(self.log) - 1, -1, -1):
+            if self.log[index][2] == square and self.log[index][0] is not None:
+                return index
+        return None
+
+    def rollback(self, index):
+        """撤销日志中 index 及之后的所有记录，返回被撤销的记录。"""
+        undone = self.log[index:]
+        del self.log[index:]
+        for _, key, _, delta in reversed(undone):
+            self.counts[key] -= delta
+        self._fen_cache = None
+        return undone
+
+    def correct_reveal(self, square, new_key):
+        """将当前位于 square 的翻开棋子更正为 new_key，并重放其后的日志。"""
+        index = self.reveal_index_at(square)
+        if index is None:
+            return False
+        undone = self.rollback(index)
+        undone[0][1] = new_key
+        for ply, key, sq, delta in undone:
+            if ply is None:
+                self.adjust(key, delta)
+            else:
+                self.reveal(key, ply, sq)
+        return True
+
+    def fen_pool(self):
+        """返回FEN中的暗子串，例如 'R2r2N1...'，结果缓存到下一次变化为止。"""
+        if self._fen_cache is None:
+            parts = []
+            for p_char in self.FEN_ORDER:
+                count = self.counts.get(('r' if p_char.isupper() else 'b') + p_char.upper(), 0)
+                if count > 0:
+                    parts.append(f"{p_char}{count}")
+            self._fen_cache = ''.join(parts)
+        return self._fen_cache
+
 class BoardDisplay:
     def __init__(self):
         pygame.init()
@@ -380,15 +1667,9 @@ class BoardDisplay:
 
     def handle_dark_piece_library_click(self, pos, dark_pieces):
         """检查点击位置是否在暗子库按钮上，并更新暗子数量"""
-        max_counts = {'R':2,'N':2,'B':2,'A':2,'C':2,'P':5}
         for (key, action), rect in self.dark_piece_buttons.items():
             if rect.collidepoint(pos):
-                p_char = key[1]
-                limit = max_counts[p_char]
-                if action == 'add' and dark_pieces[key] < limit:
-                    dark_pieces[key] += 1
-                elif action == 'sub' and dark_pieces[key] > 0:
-                    dark_pieces[key] -= 1
+                dark_pieces.adjust(key, 1 if action == 'add' else -1)
                 return True
         return False
 
@@ -444,47 +1725,333 @@ class BoardDisplay:
         pygame.display.flip()
 
 class AutoChessPlayer:
-    def __init__(self, roi):
-        self.settings = load_settings()
+    def __init__(self, roi, settings=None, startup=None, model_future=None):
+        """
+        model_future: 可选，已在后台开始加载的模型（例如在用户框选棋盘时预加载）。
+        模型加载、引擎启动与握手、界面与图片加载三者并行进行。
+        """
+        self.settings = settings if settings is not None else load_settings()
         self.roi = roi
-        try:
-            self.yolo_model = YOLO(self.settings['model_path'])
-            self.piece_names = self.yolo_model.names
-        except Exception as e:
-            _d_print(f"错误: 无法加载YOLO模型于路径 '{self.settings['model_path']}'. 错误: {e}")
-            _d_print("请在设置中检查模型路径是否正确。程序将退出。")
-            sys.exit(1)
+        self.startup = startup or StartupTimer()
+        self._model_future = model_future
+        # 设置热更新：只有从设置文件读取设置时才监视文件
+        self._watch_settings = settings is None
+        self._settings_mtime = self._settings_file_mtime()
+        self._settings_checked = time.time()
+        self._pending_engine_options = {}
+        self._engine_restart_pending = False
+        self._model_swap = None  # (模型路径, Future)
+        self.active_model_path = self.settings['model_path']
+        self.active_profile = None # 当前使用的皮肤档案，None 表示使用设置中的模型与阈值
+        self._skin_matched = False # 本次等待新局期间是否已匹配到皮肤档案，重置游戏时清除
+        self.model_registry = self._load_model_registry()
+        self.metrics = LatencyStats()
+        self.recorder = None
+        if self.settings.get('flight_recorder', 1) == 1:
+            try:
+                self.recorder = FlightRecorder(self.settings.get('flight_dir', 'resource/flight'),
+                                               self.settings.get('flight_seconds', 20.0),
+                                               self.settings.get('flight_fps', 4.0),
+                                               meta={'roi': roi, 'model_path': self.settings['model_path']})
+            except OSError as e:
+                logger.warning("飞行记录仪初始化失败: %s", e)
+        self.hard_examples = None
+        if self.settings.get('hard_example_capture', 0) == 1:
+            try:
+                self.hard_examples = HardExampleSink(self.settings.get('hard_example_dir', 'resource/hard_examples'),
+                                                     self.settings.get('hard_example_max_mb', 500.0),
+                                                     self.settings.get('hard_example_interval', 2.0))
+            except OSError as e:
+                logger.warning("难例采集初始化失败: %s", e)
+        self.yolo_model = None
+        self.piece_names = {}
         
         self.last_board_state = None
+        self.last_cell_scores = None # 最近一次识别的逐格 {类别: 置信度}
+        self.last_frame = None # 最近一次整盘识别所用的画面
+        self.last_cell_boxes = None # 最近一次检测的逐格 {类别: 检测框}，逐格分类器没有检测框
+        self.scan_scheduler = ScanScheduler()
         self.computer_side = None # 'r' or 'b'
         
         self.hwnd = None
+        self.injector = None
 
         self.current_player = 'r'
         self.game_over = False
         self.move_notations = []
-        self.board_history = []
+        self.position_history = PositionHistory()
         
         self.game_state = "WAITING_FOR_NEW_GAME" 
 
         self.engine = None
-        self.engine_path = os.path.join('resource', 'engine', 'engine.exe')
+        self.engine_path = self.settings.get('engine_path') or os.path.join('resource', 'engine', 'engine.exe')
         
         self.initial_dark_pool = {
             'rR': 2, 'rN': 2, 'rB': 2, 'rA': 2, 'rC': 2, 'rP': 5,
             'bR': 2, 'bN': 2, 'bB': 2, 'bA': 2, 'bC': 2, 'bP': 5
         }
-        self.dark_piece_library = self.initial_dark_pool.copy()
-        
-        try:
-            self.init_engine()
-        except EngineCommunicationError as e:
-            _d_print(f"FATAL: 引擎初始化失败: {e}. 程序无法启动。")
+        self.dark_piece_library = DarkPiecePool(self.initial_dark_pool)
+        self._pending_correction = None
+        self.is_running = False
+
+        # 界面必须在主线程创建；模型与引擎在后台线程中同时准备
+        ready_start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="startup") as pool:
+            model_job = pool.submit(self._prepare_model)
+            engine_job = pool.submit(self.startup.run, 'engine', self.init_engine)
+            self.display = self.startup.run('display', self._create_display)
+            model_error = model_job.exception()
+            engine_error = engine_job.exception()
+        self.startup.phases['ready'] = time.perf_counter() - ready_start
+
+        if model_error is not None:
+            logger.error("错误: 无法加载识别模型于路径 '%s'. 错误: %s", self.settings['model_path'], model_error)
+            logger.error("请在设置中检查模型路径是否正确。程序将退出。")
+            if self.engine and self.engine.poll() is None:
+                self.engine.terminate()
+            sys.exit(1)
+        if engine_error is not None:
+            logger.error("FATAL: 引擎初始化失败: %s. 程序无法启动。", engine_error)
             sys.exit(1)
+        if self.yolo_model is not None:
+            # 实际识别在主线程中进行：线程数与线程池等按线程的状态需要在主线程中再预热一次
+            set_inference_threads(self.settings.get('inference_threads', 0))
+            if self.settings.get('warmup_runs', 3) > 0:
+                self.startup.run('warmup_main', self._warm_up_model, 1)
+        for name, seconds in self.startup.phases.items():
+            self.metrics.observe(f"startup_{name}", seconds)
+        logger.info("[启动耗时] %s", self.startup.report())
+
+    def _prepare_model(self):
+        """后台线程：加载模型后按实际输入尺寸预热。"""
+        self.startup.run('model', self._load_model)
+        runs = self.settings.get('warmup_runs', 3)
+        if self.yolo_model is not None and runs > 0:
+            self.startup.run('warmup', self._warm_up_model, runs)
+
+    def _load_model(self):
+        """加载识别模型（在后台线程中执行）；若已有预加载任务则等待其结果。"""
+        if self._model_future is not None:
+            model = self._model_future.result()
+        else:
+            model = load_recognition_model(self.settings['model_path'], self.settings.get('inference_threads', 0))
+        self.yolo_model = model
+        self.piece_names = model.names
+        if self.model_registry:
+            self.model_registry.put(self.active_model_path, model)
+
+    def _load_model_registry(self):
+        """读取皮肤档案登记文件；未配置或文件不存在时返回 None，始终使用设置中的模型。"""
+        path = self.settings.get('model_registry')
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            registry = ModelRegistry(path, self.settings.get('model_cache_size', 2), self.settings.get('skin_match_distance', 0.25))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("[模型登记] 读取 %s 失败，使用设置中的模型: %s", path, e)
+            return None
+        logger.info("[模型登记] 已加载 %d 个皮肤档案。", len(registry.profiles))
+        return registry
 
-        self.display = BoardDisplay()
-        
-        self.is_running = False
+    @property
+    def confidence_threshold(self):
+        """识别置信度阈值：当前皮肤档案指定了阈值时优先使用。"""
+        if self.active_profile and self.active_profile.get('confidence_threshold') is not None:
+            return self.active_profile['confidence_threshold']
+        return self.settings['confidence_threshold']
+
+    def _select_skin_profile(self):
+        """
+        每局开始前用刚识别过的画面（last_frame，不另行截屏）的皮肤指纹选择档案，匹配成功后本局不再重复计算。
+        模型在缓存中时立即切换，否则在后台加载，完成后由主循环替换；
+        没有匹配的档案时（例如画面不是棋盘）保持当前模型不变，下一次识别后再试。
+        返回是否切换了档案（调用方应丢弃本次用旧模型得到的识别结果）。
+        """
+        if not self.model_registry or self._skin_matched or self.last_frame is None:
+            return False
+        profile, distance = self.model_registry.match(self.last_frame)
+        if profile is None:
+            return False
+        self._skin_matched = True
+        if profile is self.active_profile:
+            return False
+        logger.info("[模型登记] 识别到皮肤 %s（指纹距离 %.3f），使用模型 %s。", profile.get('name'), distance, profile['model_path'])
+        self.active_profile = profile
+        self._use_model(profile['model_path'])
+        return True
+
+    def _use_model(self, model_path):
+        """切换到 model_path：已在缓存中的模型直接替换，否则在后台加载。"""
+        if model_path == self.active_model_path and self._model_swap is None:
+            return
+        if self._model_swap is not None and self._model_swap[0] == model_path:
+            return
+        cached = self.model_registry.get(model_path) if self.model_registry else None
+        if cached is not None:
+            self._model_swap = None
+            self.yolo_model, self.piece_names = cached, cached.names
+            self.active_model_path = model_path
+            self.last_cell_scores = None
+            self.metrics.count('model_cache_hits')
+            logger.info("[模型登记] 已从缓存切换到模型: %s", model_path)
+            return
+        self._start_model_swap(model_path)
+
+    def _warm_up_model(self, runs, model=None):
+        """
+        用与实际识别完全相同的输入（整盘ROI尺寸，以及走法确认时两个小块的批量与 imgsz）推理 runs 次，
+        使层初始化、融合与内存分配在开局前完成。记录首次与稳定后的耗时；只推理一次时没有稳定耗时，只记录首次。
+        """
+        model = model or self.yolo_model
+        frame = np.random.default_rng(0).integers(0, 256, (self.roi['height'], self.roi['width'], 3), dtype=np.uint8)
+        if isinstance(model, CellClassifier):
+            run_frame = lambda: model.classify_board(frame, 1.0)
+            run_cells = lambda: model.classify_cells(frame, [(0, 0), (9, 8)], 1.0)
+        else:
+            crop_w, crop_h, imgsz = self._cell_crop_geometry()
+            crops = [frame[:crop_h, :crop_w], frame[-crop_h:, -crop_w:]]
+            run_frame = lambda: model(frame, verbose=False)
+            run_cells = lambda: model(crops, imgsz=imgsz, verbose=False)
+        timings = {'frame': [], 'cells': []}
+        for _ in range(runs):
+            start = time.perf_counter()
+            run_frame()
+            middle = time.perf_counter()
+            run_cells()
+            timings['frame'].append(middle - start)
+            timings['cells'].append(time.perf_counter() - middle)
+        for kind, values in timings.items():
+            label = "整盘" if kind == 'frame' else "小块"
+            self.metrics.observe(f"warmup_{kind}_first", values[0])
+            if len(values) < 2:
+                logger.info("[模型预热] %s (%s): 首次 %.1f ms", label, threading.current_thread().name, values[0] * 1000)
+                continue
+            steady = sorted(values[1:])[len(values[1:]) // 2]
+            self.metrics.observe(f"warmup_{kind}_steady", steady)
+            logger.info("[模型预热] %s (%s): 首次 %.1f ms，稳定 %.1f ms",
+                        label, threading.current_thread().name, values[0] * 1000, steady * 1000)
+
+    def _create_display(self):
+        return BoardDisplay()
+
+    @staticmethod
+    def _settings_file_mtime():
+        try:
+            return os.stat(SETTINGS_FILE).st_mtime_ns
+        except OSError:
+            return None
+
+    def poll_settings_file(self, force=False):
+        """每秒最多检查一次设置文件，文件被修改（设置窗口保存或手动编辑）后应用新设置。"""
+        if not self._watch_settings or (not force and time.time() - self._settings_checked < 1.0):
+            return
+        self._settings_checked = time.time()
+        mtime = self._settings_file_mtime()
+        if mtime is None or mtime == self._settings_mtime:
+            return
+        try:
+            with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning("[设置] 读取修改后的设置文件失败，稍后重试: %s", e)
+            return
+        self._settings_mtime = mtime
+        new_settings = get_default_settings()
+        new_settings.update(data)
+        self.apply_settings(new_settings)
+
+    def apply_settings(self, new_settings):
+        """
+        在运行中应用新设置：识别间隔、阈值等每次使用时读取的设置立即生效；
+        引擎参数在下一次搜索前的安全点发送，引擎路径变更时在安全点重启引擎；
+        新模型在后台加载并预热，完成后由主循环整体替换。
+        """
+        old = self.settings
+        changed = sorted(k for k in set(old) | set(new_settings) if old.get(k) != new_settings.get(k))
+        self.settings = new_settings
+        if not changed:
+            return
+        logger.info("[设置] 已应用新设置: %s", ', '.join(changed))
+        for key, option in ENGINE_OPTIONS.items():
+            if key in changed:
+                self._pending_engine_options[option] = new_settings[key]
+        if 'engine_path' in changed:
+            self.engine_path = new_settings.get('engine_path') or os.path.join('resource', 'engine', 'engine.exe')
+            self._engine_restart_pending = True
+        if {'model_registry', 'model_cache_size', 'skin_match_distance'} & set(changed):
+            self.model_registry = self._load_model_registry()
+            if self.model_registry and self.yolo_model is not None:
+                self.model_registry.put(self.active_model_path, self.yolo_model)
+            self.active_profile = None
+            self._skin_matched = False
+        if 'confidence_threshold' in changed and self.active_profile \
+                and self.active_profile.get('confidence_threshold') is not None:
+            logger.warning("[设置] 当前皮肤档案 %s 指定了置信度阈值 %s，新的 confidence_threshold=%s 在使用该档案期间不生效。",
+                           self.active_profile.get('name'), self.active_profile['confidence_threshold'],
+                           new_settings['confidence_threshold'])
+        if 'model_path' in changed:
+            self.active_profile = None
+            self._use_model(new_settings['model_path'])
+        if 'inference_threads' in changed:
+            set_inference_threads(new_settings.get('inference_threads', 0))
+        if self.injector is not None and ('input_backend' in changed or 'use_mouse_click' in changed):
+            self.setup_injector()
+        if {'debug_mode', 'log_level', 'log_dir'} & set(changed):
+            debug_mode = new_settings.get('debug_mode', 0) == 1
+            logger.configure(log_dir=new_settings.get('log_dir'), console=debug_mode,
+                             file_level='DEBUG' if debug_mode else new_settings.get('log_level', 'INFO'))
+
+    def _start_model_swap(self, model_path):
+        """在后台加载并预热新模型；之后的替换由 _finish_model_swap 在主循环中完成。"""
+        logger.info("[设置] 正在后台加载新模型: %s", model_path)
+        def load():
+            model = load_recognition_model(model_path, self.settings.get('inference_threads', 0))
+            runs = self.settings.get('warmup_runs', 3)
+            if runs > 0:
+                self._warm_up_model(runs, model)
+            return model
+        # 连续修改时只保留最后一次请求
+        self._model_swap = (model_path, run_in_background("model-swap", load))
+
+    def _finish_model_swap(self):
+        """主循环的安全点：新模型加载完成后一次性替换模型与类别表。"""
+        if self._model_swap is None or not self._model_swap[1].done():
+            return
+        model_path, future = self._model_swap
+        self._model_swap = None
+        try:
+            model = future.result()
+        except Exception as e:
+            logger.error("[设置] 新模型 '%s' 加载失败，继续使用原模型: %s", model_path, e)
+            return
+        self.yolo_model, self.piece_names = model, model.names
+        self.active_model_path = model_path
+        self.last_cell_scores = None
+        if self.model_registry:
+            for evicted in self.model_registry.put(model_path, model):
+                logger.info("[模型登记] 已释放最久未用的模型: %s", evicted)
+        logger.info("[设置] 已切换到新模型: %s", model_path)
+
+    def _apply_engine_settings(self):
+        """在两次搜索之间（安全点）把变更的引擎参数发送给引擎，必要时重启引擎。"""
+        if self._engine_restart_pending:
+            self._engine_restart_pending = False
+            self._pending_engine_options.clear()
+            logger.info("[设置] 引擎路径已变更，正在重启引擎。")
+            self.metrics.count('engine_restarts')
+            self.init_engine()
+            return
+        if not self._pending_engine_options:
+            return
+        for option, value in self._pending_engine_options.items():
+            self.send_engine_command(f"setoption name {option} value {value}")
+        self._pending_engine_options.clear()
+        self.send_engine_command("isready")
+        start_time = time.time()
+        while "readyok" not in self.read_engine_output():
+            if time.time() - start_time > 10:
+                raise EngineCommunicationError("引擎在更新参数后未准备就绪。")
+        logger.info("[设置] 引擎参数已更新。")
 
     def create_empty_board(self):
         return [['' for _ in range(9)] for _ in range(10)]
@@ -500,40 +2067,117 @@ class AutoChessPlayer:
                     if piece in pool and pool[piece] > 0:
                         pool[piece] -= 1
         
-        self.dark_piece_library = pool
-        _d_print("暗子库已根据当前棋盘状态更新。")
+        self.dark_piece_library.reset(pool)
+        logger.debug("暗子库已根据当前棋盘状态更新。")
+
+    def _record_position(self, board_state):
+        """将当前局面（以当前走棋方为准）写入局面历史，并提示重复局面与长将（我方长将由 _perpetual_check_filter 避免）。"""
+        cells = board_to_compact(board_state, self.computer_side == 'b')
+        self.position_history.push(cells, self.current_player)
+        count = self.position_history.repetition_count()
+        if count >= 3:
+            logger.info("[重复局面] 当前局面已出现 %s 次。", count)
+            checker = self.position_history.perpetual_checker()
+            if checker:
+                who = "我方" if checker == self.computer_side else "对方"
+                logger.info("[重复局面] 检测到%s长将。", who)
+
+    def _perpetual_check_filter(self):
+        """
+        长将判负：若我方某些将军走法会使局面第三次出现，返回其余合法走法（UCI）供 go searchmoves 限定搜索范围；
+        没有这类走法，或所有走法都是这类走法时返回 None，照常搜索。暗子走动后局面未知，不计入。
+        """
+        side = self.current_player
+        opponent = 'b' if side == 'r' else 'r'
+        cells = board_to_compact(self.last_board_state, self.computer_side == 'b')
+        allowed, avoided = [], []
+        for from_sq, to_sq in generate_legal_moves(cells, side):
+            after = apply_compact_move(cells, from_sq, to_sq)
+            uci = self.move_to_uci(*self.square_to_board(from_sq), *self.square_to_board(to_sq))
+            if (cells[from_sq] not in 'Xx' and self.position_history.repetition_count(after, opponent) >= 2
+                    and is_in_check(after, opponent)):
+                avoided.append(uci)
+            else:
+                allowed.append(uci)
+        if not avoided or not allowed:
+            return None
+        logger.info("[重复局面] 避免长将，排除走法: %s", ' '.join(avoided))
+        self.metrics.count('perpetual_checks_avoided')
+        return allowed
 
-    def _handle_piece_reveal(self, revealed_piece_key):
+    def _handle_piece_reveal(self, revealed_piece_key, square=None):
         """
         当一个暗子被翻开时，调用此函数来更新暗子库。
         :param revealed_piece_key: 被翻开棋子的字符串标识，例如 'rR', 'bN'。
+        :param square: 翻开后棋子所在的紧凑局面下标，用于之后的识别修正。
         """
         if revealed_piece_key and revealed_piece_key in self.dark_piece_library:
-            if self.dark_piece_library[revealed_piece_key] > 0:
-                self.dark_piece_library[revealed_piece_key] -= 1
-                _d_print(f"[暗子库更新] 棋子 '{revealed_piece_key}' 被翻开，剩余数量: {self.dark_piece_library[revealed_piece_key]}")
+            if self.dark_piece_library.reveal(revealed_piece_key, len(self.move_notations), square):
+                logger.debug("[暗子库更新] 棋子 '%s' 被翻开，剩余数量: %s", revealed_piece_key, self.dark_piece_library[revealed_piece_key])
             else:
-                _d_print(f"[警告] 尝试减少一个在暗子库中数量已为0的棋子: '{revealed_piece_key}'。这可能表示之前的识别有误。")
+                logger.warning("[警告] 尝试减少一个在暗子库中数量已为0的棋子: '%s'。这可能表示之前的识别有误。", revealed_piece_key)
+
+    def _track_move(self, move_tuple, board_after):
+        """在确认一步走法后调用（记录走法之前）：更新暗子库日志中的棋子位置，并处理翻子。"""
+        from_sq = self.board_to_square(move_tuple[0], move_tuple[1])
+        to_sq = self.board_to_square(move_tuple[2], move_tuple[3])
+        if from_sq != to_sq:
+            self.dark_piece_library.on_move(from_sq, to_sq)
+        if move_tuple[4]:
+            self._handle_piece_reveal(board_after[move_tuple[2]][move_tuple[3]], to_sq)
+
+    def _check_reveal_correction(self, old_board, new_board):
+        """
+        若新棋盘只有一格与旧棋盘不同，且该格上记录过的翻开棋子变成了另一种同色明子，
+        视为之前的翻子识别有误。连续两次观察到同一修正才生效并更正暗子库；
+        返回 True 表示本次变化已按修正处理（含等待第二次观察），调用方不应再将其当作走法。
+        """
+        diffs = [(r, c) for r in range(10) for c in range(9) if old_board[r][c] != new_board[r][c]]
+        if len(diffs) != 1:
+            self._pending_correction = None
+            return False
+        r, c = diffs[0]
+        old_piece, new_piece = old_board[r][c], new_board[r][c]
+        if not old_piece or not new_piece or old_piece[0] != new_piece[0] or new_piece[1] in 'XK' or 'X' in old_piece:
+            self._pending_correction = None
+            return False
+        square = self.board_to_square(r, c)
+        if self.dark_piece_library.reveal_index_at(square) is None:
+            self._pending_correction = None
+            return False
+        correction = (r, c, new_piece)
+        if self._pending_correction != correction:
+            self._pending_correction = correction
+            return True
+        self._pending_correction = None
+        self.dark_piece_library.correct_reveal(square, new_piece)
+        logger.info("[暗子库修正] (%s, %s) 处翻开的棋子由 '%s' 更正为 '%s'，剩余暗子: %s", r, c, old_piece, new_piece, self.dark_piece_library)
+        self.last_board_state = [row[:] for row in old_board]
+        self.last_board_state[r][c] = new_piece
+        return True
 
     def init_engine(self):
         """
         初始化或重新初始化UCI引擎。如果已存在引擎进程，会尝试终止它。
         """
+        # 新进程按当前设置初始化，尚未发送的参数变更随之作废
+        self._pending_engine_options.clear()
+        self._engine_restart_pending = False
         if self.engine:
-            _d_print("正在终止现有引擎进程以进行重新初始化...")
+            logger.debug("正在终止现有引擎进程以进行重新初始化...")
             try:
                 self.send_engine_command("quit")
                 self.engine.wait(timeout=1)
             except (EngineCommunicationError, subprocess.TimeoutExpired):
                 pass
             except Exception as e:
-                _d_print(f"终止现有引擎时发生未知错误: {e}")
+                logger.error("终止现有引擎时发生未知错误: %s", e)
             if self.engine.poll() is None:
-                _d_print("强制终止旧引擎进程。")
+                logger.debug("强制终止旧引擎进程。")
                 self.engine.terminate()
             self.engine = None
 
-        _d_print("正在启动新的引擎进程...")
+        logger.debug("正在启动新的引擎进程...")
         try:
             self.engine = subprocess.Popen(
                 self.engine_path,
@@ -542,11 +2186,15 @@ class AutoChessPlayer:
                 stderr=subprocess.PIPE,
                 universal_newlines=True,
                 bufsize=1,
-                creationflags=subprocess.CREATE_NO_WINDOW
+                creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0)
             )
+            # 由后台线程逐行读取引擎输出，读取方可以带超时等待，引擎卡死时不会阻塞主循环
+            self._engine_lines = queue.Queue()
+            threading.Thread(target=self._pump_engine_output, args=(self.engine.stdout, self._engine_lines),
+                             name="engine-reader", daemon=True).start()
             self.send_engine_command("uci")
-            self.send_engine_command(f"setoption name Threads value {self.settings['engine_threads']}")
-            self.send_engine_command(f"setoption name Hash value {self.settings['hash_size']}")
+            for key, option in ENGINE_OPTIONS.items():
+                self.send_engine_command(f"setoption name {option} value {self.settings[key]}")
             self.send_engine_command("isready")
             
             ready_timeout = 10
@@ -554,10 +2202,11 @@ class AutoChessPlayer:
             while time.time() - start_time < ready_timeout:
                 output = self.read_engine_output()
                 if "readyok" in output:
-                    _d_print("引擎已准备就绪。")
+                    logger.info("引擎已准备就绪。")
                     return
-                time.sleep(0.1)
-            
+                if not output and self.engine.poll() is not None:
+                    raise EngineCommunicationError("引擎在启动过程中退出。")
+
             raise EngineCommunicationError("引擎未能在规定时间内响应'readyok'。")
 
         except EngineCommunicationError:
@@ -578,12 +2227,13 @@ class AutoChessPlayer:
         向UCI引擎发送命令。
         """
         if self.engine and self.engine.stdin:
-            _d_print(f"To Engine: {command}")
+            logger.debug("To Engine: %s", command)
             try:
                 self.engine.stdin.write(command + "\n")
+                if self.recorder: self.recorder.record_event('to_engine', command)
                 self.engine.stdin.flush()
             except OSError as e:
-                _d_print(f"ERROR: 无法向引擎发送命令 '{command}'。错误: {e}")
+                logger.error("ERROR: 无法向引擎发送命令 '%s'。错误: %s", command, e)
                 if self.engine: self.engine.terminate()
                 self.engine = None
                 raise EngineCommunicationError(f"引擎通信失败 (stdin不可用): {e}")
@@ -594,62 +2244,281 @@ class AutoChessPlayer:
             self.engine = None
             raise EngineCommunicationError("引擎stdin不可用。")
 
-    def read_engine_output(self):
-        """从引擎读取一行输出"""
-        if self.engine and self.engine.stdout:
-            return self.engine.stdout.readline().strip()
-        return ""
+    @staticmethod
+    def _pump_engine_output(stream, lines):
+        try:
+            for line in stream:
+                lines.put(line.strip())
+        except (OSError, ValueError):
+            pass
+
+    def read_engine_output(self, timeout=0.1):
+        """从引擎读取一行输出；timeout 秒内没有输出时返回空字符串。"""
+        if not self.engine:
+            return ""
+        try:
+            line = self._engine_lines.get(timeout=timeout)
+        except queue.Empty:
+            return ""
+        if line and self.recorder: self.recorder.record_event('from_engine', line)
+        return line
+
+    def setup_injector(self):
+        """创建输入后端；需要窗口句柄的后端会先查找游戏窗口。"""
+        try:
+            injector = create_injector(self.settings)
+        except Exception as e:
+            logger.error("创建输入后端失败: %s", e)
+            return False
+        if injector.needs_window:
+            if not self.find_game_window():
+                return False
+            injector.hwnd = self.hwnd
+        self.injector = injector
+        logger.info("输入后端: %s", injector.name)
+        return True
 
     def find_game_window(self):
         """
         根据ROI区域的左上角坐标找到游戏窗口的句柄。
         """
+        if win32gui is None:
+            logger.error("错误：当前平台不支持窗口句柄查找。")
+            return False
         try:
             point = (self.roi['left'], self.roi['top'])
             hwnd_child = win32gui.WindowFromPoint(point)
             
             if hwnd_child == 0:
-                _d_print(f"错误：在坐标 {point} 处未找到窗口。请确保ROI完全在游戏窗口内。")
+                logger.error("错误：在坐标 %s 处未找到窗口。请确保ROI完全在游戏窗口内。", point)
                 return False
             
             self.hwnd = get_main_window_handle(hwnd_child)
             
             window_text = win32gui.GetWindowText(self.hwnd)
-            _d_print(f"成功绑定到游戏窗口：句柄={self.hwnd}, 标题='{window_text}'")
+            logger.info("成功绑定到游戏窗口：句柄=%s, 标题='%s'", self.hwnd, window_text)
             return True
         except Exception as e:
-            _d_print(f"查找窗口句柄时发生错误: {e}")
+            logger.error("查找窗口句柄时发生错误: %s", e)
             self.hwnd = None
             return False
 
+    def _grab_roi(self, stage='capture'):
+        """
+        截取ROI区域，返回BGR图像。耗时计入 stage：识别用的截屏为 capture，
+        点击确认与运动检测的轮询截屏分别计入 click_ack 与 motion_poll，不混入识别的截屏耗时。
+        """
+        import mss
+        start = time.perf_counter()
+        with mss.mss() as sct:
+            img = np.array(sct.grab(self.roi))
+        img_bgr = np.ascontiguousarray(img[:, :, :3])  # BGRA -> BGR
+        self.metrics.observe(stage, time.perf_counter() - start)
+        if self.recorder: self.recorder.record_frame(img_bgr)
+        return img_bgr
+
+    def _cell_pixels(self, img_bgr, row, col):
+        grid_h = self.roi['height'] / 10
+        grid_w = self.roi['width'] / 9
+        return img_bgr[int(row * grid_h):int((row + 1) * grid_h), int(col * grid_w):int((col + 1) * grid_w)]
+
+    def _wait_cell_change(self, row, col, before, timeout):
+        """
+        点击确认门：轮询截屏，直到指定格子的像素相对点击前发生明显变化（选中高亮出现）或超时。
+        返回是否检测到变化。
+        """
+        threshold = self.settings.get('click_ack_threshold', 8.0)
+        start_time = time.time()
+        while time.time() - start_time < timeout:
+            now = self._cell_pixels(self._grab_roi('click_ack'), row, col)
+            if np.abs(now.astype(np.int16) - before.astype(np.int16)).mean() > threshold:
+                return True
+            time.sleep(0.005)
+        return False
+
     def _capture_single_frame(self):
         """
         执行一次屏幕捕获和YOLO识别，返回单次的棋盘状态。
         """
-        with mss.mss() as sct:
-            screenshot = sct.grab(self.roi)
-            img = np.array(screenshot)
-            img_bgr = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+        capture_start = time.perf_counter()
+        img_bgr = self._grab_roi()
+        self.last_frame = img_bgr
 
-        results = self.yolo_model(img_bgr, verbose=False)
-        
+        start = time.perf_counter()
+        if isinstance(self.yolo_model, CellClassifier):
+            board_state, cell_scores = self.yolo_model.classify_board(img_bgr, self.confidence_threshold)
+        else:
+            results = self.yolo_model(img_bgr, verbose=False)
+        end = time.perf_counter()
+        self.metrics.observe('inference', end - start)
+        self.scan_scheduler.charge_scan(end - capture_start)
+        self.metrics.count('scans')
+        if isinstance(self.yolo_model, CellClassifier):
+            self.last_cell_boxes = None
+        else:
+            board_state, cell_scores = self._boxes_to_board(results)
+        self.last_cell_scores = cell_scores
+        if self.hard_examples and self._has_uncertain_cell(cell_scores):
+            self.save_hard_example('lowconf')
+        if self.recorder: self.recorder.record_event('board', [''.join(p or '..' for p in row) for row in board_state])
+        return board_state
+
+    def _boxes_to_board(self, results):
+        """把检测框按中心点落入的格子转换为 (棋盘, 逐格 {棋子名: 置信度})。"""
         board_state = self.create_empty_board()
+        # 同时保留低于阈值的检测结果，供概率推断使用
+        cell_scores = [[{} for _ in range(9)] for _ in range(10)]
+        cell_boxes = [[{} for _ in range(9)] for _ in range(10)]
         grid_h = self.roi['height'] / 10
         grid_w = self.roi['width'] / 9
 
         for res in results:
             for box in res.boxes:
-                if box.conf[0] > self.settings['confidence_threshold']:
-                    x1, y1, x2, y2 = box.xyxy[0]
-                    center_x = (x1 + x2) / 2
-                    center_y = (y1 + y2) / 2
-                    row = int(center_y / grid_h)
-                    col = int(center_x / grid_w)
-                    if 0 <= row < 10 and 0 <= col < 9:
-                        piece_id = int(box.cls[0])
-                        board_state[row][col] = self.piece_names[piece_id]
-        return board_state
+                conf = float(box.conf[0])
+                x1, y1, x2, y2 = box.xyxy[0]
+                center_x = (x1 + x2) / 2
+                center_y = (y1 + y2) / 2
+                row = int(center_y / grid_h)
+                col = int(center_x / grid_w)
+                if 0 <= row < 10 and 0 <= col < 9:
+                    piece_name = self.piece_names[int(box.cls[0])]
+                    scores = cell_scores[row][col]
+                    if conf > scores.get(piece_name, 0.0):
+                        scores[piece_name] = conf
+                        cell_boxes[row][col][piece_name] = (float(x1), float(y1), float(x2), float(y2))
+                    if conf > self.confidence_threshold:
+                        board_state[row][col] = piece_name
+        self.last_cell_boxes = cell_boxes
+        return board_state, cell_scores
+
+    def _has_uncertain_cell(self, cell_scores):
+        """是否有格子的最高置信度落在 [hard_example_low_conf, confidence_threshold] 之间。"""
+        low, high = self.settings.get('hard_example_low_conf', 0.3), self.confidence_threshold
+        return any(scores and low <= max(scores.values()) <= high for row in cell_scores for scores in row)
+
+    def _hard_example_labels(self):
+        """
+        用最近一次整盘识别结果生成预标注 [(类别, cx, cy, w, h)]（按ROI归一化）：
+        每格取置信度最高且不低于 hard_example_low_conf 的棋子，有检测框时用检测框，否则用以格子中心为圆心的方框；
+        再加上与合成数据相同定义的棋盘区域（四角交叉点围成的矩形）。
+        """
+        width, height = self.roi['width'], self.roi['height']
+        grid_w, grid_h = width / 9, height / 10
+        side = 0.85 * min(grid_w, grid_h)
+        labels = [('board', 0.5, 0.5, 8 / 9, 9 / 10)]
+        for row in range(10):
+            for col in range(9):
+                scores = self.last_cell_scores[row][col]
+                if not scores:
+                    continue
+                name = max(scores, key=scores.get)
+                if scores[name] < self.settings.get('hard_example_low_conf', 0.3):
+                    continue
+                box = self.last_cell_boxes[row][col].get(name) if self.last_cell_boxes else None
+                if box:
+                    x1, y1, x2, y2 = box
+                    labels.append((name, (x1 + x2) / 2 / width, (y1 + y2) / 2 / height, (x2 - x1) / width, (y2 - y1) / height))
+                else:
+                    labels.append((name, (col + 0.5) / 9, (row + 0.5) / 10, side / width, side / height))
+        return labels
+
+    def save_hard_example(self, reason):
+        """把最近一次整盘识别的画面和预标注交给难例采集（未开启时什么也不做）。"""
+        if not self.hard_examples or self.last_frame is None or self.last_cell_scores is None:
+            return
+        if self.hard_examples.offer(self.last_frame, self._hard_example_labels, reason):
+            self.metrics.count('hard_examples')
+
+    def _cell_crop_geometry(self):
+        """返回单格识别的小块尺寸与推理尺寸 (crop_w, crop_h, imgsz)。"""
+        crop_w, crop_h = int(self.roi['width'] / 9 * 2), int(self.roi['height'] / 10 * 2)
+        # 整盘识别时ROI被缩放到640，小块使用相同的缩放比例，使棋子尺寸与训练数据一致
+        scale = 640 / max(self.roi['width'], self.roi['height'])
+        imgsz = max(32, math.ceil(max(crop_w, crop_h) * scale / 32) * 32)
+        return crop_w, crop_h, imgsz
+
+    def _recognize_cells(self, positions):
+        """
+        只识别指定格子：截取每个格子周围2x2格大小的小块，按与整盘识别相同的像素比例批量推理。
+        返回 {(row, col): 棋子名或''}。
+        """
+        img_bgr = self._grab_roi()
+        if isinstance(self.yolo_model, CellClassifier):
+            start = time.perf_counter()
+            found = self.yolo_model.classify_cells(img_bgr, positions, self.confidence_threshold)
+            self.metrics.observe('cell_inference', time.perf_counter() - start)
+            self.metrics.count('cell_scans')
+            return found
+
+        grid_h = self.roi['height'] / 10
+        grid_w = self.roi['width'] / 9
+        crop_w, crop_h, imgsz = self._cell_crop_geometry()
+
+        crops, origins = [], []
+        for row, col in positions:
+            x0 = int(min(max((col + 0.5) * grid_w - crop_w / 2, 0), self.roi['width'] - crop_w))
+            y0 = int(min(max((row + 0.5) * grid_h - crop_h / 2, 0), self.roi['height'] - crop_h))
+            crops.append(img_bgr[y0:y0 + crop_h, x0:x0 + crop_w])
+            origins.append((x0, y0))
+
+        start = time.perf_counter()
+        results = self.yolo_model(crops, imgsz=imgsz, verbose=False)
+        self.metrics.observe('cell_inference', time.perf_counter() - start)
+        self.metrics.count('cell_scans')
+        found = {}
+        for (row, col), (x0, y0), res in zip(positions, origins, results):
+            best_name, best_conf = '', self.confidence_threshold
+            for box in res.boxes:
+                conf = float(box.conf[0])
+                if conf <= best_conf:
+                    continue
+                x1, y1, x2, y2 = box.xyxy[0]
+                if int((y0 + (y1 + y2) / 2) / grid_h) == row and int((x0 + (x1 + x2) / 2) / grid_w) == col:
+                    best_name, best_conf = self.piece_names[int(box.cls[0])], conf
+            found[(row, col)] = best_name
+        return found
+
+    def confirm_move_by_cells(self, board_before, uci_move, timeout=2.0):
+        """
+        根据引擎走法预测走后的棋盘，只检查起点与终点两格来确认走棋。
+        暗子走动时终点接受任意同色明子。连续两次检查一致即确认，返回 (走法元组, 走后棋盘)；
+        若两格状态既不是走前也不是预期的走后（或超时），返回 None，由调用方回退到整盘识别。
+        """
+        from_row, from_col, to_row, to_col = self.uci_to_board_coords(uci_move)
+        mover = board_before[from_row][from_col]
+        target_before = board_before[to_row][to_col]
+        if not mover:
+            return None
+        positions = [(from_row, from_col), (to_row, to_col)]
 
+        agreed = None
+        start_time = time.time()
+        while time.time() - start_time < timeout:
+            cells = self._recognize_cells(positions)
+            at_from, at_to = cells[positions[0]], cells[positions[1]]
+            if 'X' in mover:
+                landed_ok = bool(at_to) and at_to[0] == mover[0] and at_to[1] not in 'XK'
+            else:
+                landed_ok = at_to == mover
+            if at_from == '' and landed_ok:
+                if agreed == at_to:
+                    board_after = [row[:] for row in board_before]
+                    board_after[from_row][from_col] = ''
+                    board_after[to_row][to_col] = at_to
+                    revealed_char = ''
+                    if 'X' in mover:
+                        revealed_char = at_to[1] if at_to[0] == 'r' else at_to[1].lower()
+                    return (from_row, from_col, to_row, to_col, revealed_char), board_after
+                agreed = at_to
+            elif at_from in (mover, '') and at_to == target_before:
+                agreed = None # 点击尚未生效或走子动画中
+            else:
+                logger.debug("[走法确认] 起止格识别为 %s / %s，与预期不符，改用整盘识别。", at_from or '空', at_to or '空')
+                return None
+            time.sleep(self.settings.get('confirm_poll_interval', 0.02))
+        return None
+
+    @timed('stabilize', span=True)
     def get_board_state_from_screen(self, max_retries=10):
         """
         通过连续两次识别结果是否一致来确保捕获的是静止的棋盘状态。
@@ -661,9 +2530,10 @@ class AutoChessPlayer:
             board2 = self._capture_single_frame()
             if board1 == board2:
                 return board2
-        board1 = board2
-        
-        _d_print("\n警告: 棋盘状态在多次尝试后仍未稳定，可能导致识别错误。")
+            board1 = board2
+
+        logger.warning("警告: 棋盘状态在多次尝试后仍未稳定，可能导致识别错误。")
+        self.save_hard_example('unstable')
         return board1
 
     def compare_boards(self, old_board, new_board):
@@ -721,6 +2591,139 @@ class AutoChessPlayer:
         
         return None
 
+    def board_to_square(self, row, col):
+        """将界面棋盘坐标转换为紧凑局面下标（红方在下）"""
+        if self.computer_side == 'b':
+            return (9 - row) * 9 + (8 - col)
+        return row * 9 + col
+
+    def square_to_board(self, sq):
+        """将紧凑局面下标转换为界面棋盘坐标"""
+        r, c = divmod(sq, 9)
+        if self.computer_side == 'b':
+            return 9 - r, 8 - c
+        return r, c
+
+    @timed('compare')
+    def infer_move(self, old_board, new_board, side):
+        """
+        推断 side 一方的走法并用合法走法集合校验。
+        compare_boards 的结果合法则直接采用；否则在合法走法中寻找能唯一解释新棋盘的走法，找不到则返回 None。
+        """
+        flipped = self.computer_side == 'b'
+        old_cells = board_to_compact(old_board, flipped)
+        legal = set(generate_legal_moves(old_cells, side))
+
+        move = self.compare_boards(old_board, new_board)
+        if move:
+            from_sq = self.board_to_square(move[0], move[1])
+            to_sq = self.board_to_square(move[2], move[3])
+            # 原地翻子属于识别修正而非走法，保持原有处理方式
+            if from_sq == to_sq or (from_sq, to_sq) in legal:
+                return move
+            logger.debug("[走法校验] 差分推断的走法 %s 不合法，尝试从合法走法中匹配。", self.move_to_uci(*move))
+
+        new_cells = board_to_compact(new_board, flipped)
+        changed = [sq for sq in range(90) if old_cells[sq] != new_cells[sq]]
+        if len(changed) != 2:
+            return None
+
+        candidates = []
+        for from_sq, to_sq in ((changed[0], changed[1]), (changed[1], changed[0])):
+            if (from_sq, to_sq) not in legal or new_cells[from_sq] != EMPTY_CELL:
+                continue
+            mover, landed = old_cells[from_sq], new_cells[to_sq]
+            if mover in 'Xx':
+                # 暗子走动后必然翻开为同色的非将帅棋子
+                if landed in 'XxKk' or _is_red(landed) != _is_red(mover):
+                    continue
+                revealed_char = landed
+            elif landed == mover:
+                revealed_char = ''
+            else:
+                continue
+            candidates.append(self.square_to_board(from_sq) + self.square_to_board(to_sq) + (revealed_char,))
+
+        if len(candidates) == 1:
+            return candidates[0]
+        return None
+
+    @timed('likelihood')
+    def infer_move_from_scores(self, old_board, cell_scores, side, max_mismatch=2):
+        """
+        概率推断：用逐格置信度为"未走棋"及 side 一方的每个合法走法打分（对数似然），
+        返回 (状态, 走法, 走后棋盘)。状态为:
+          'move'        最优走法领先次优假设至少 inference_margin
+          'unchanged'   最优假设为未走棋，观测变化视为识别噪声
+          'ambiguous'   最优与次优假设差距不足
+          'unexplained' 最优假设与观测仍有较多不符（如开始了新对局）
+        """
+        eps = 1e-3
+        flipped = self.computer_side == 'b'
+        old_cells = board_to_compact(old_board, flipped)
+        scores = [None] * 90
+        for r in range(10):
+            for c in range(9):
+                scores[self.board_to_square(r, c)] = cell_scores[r][c]
+
+        def ll_empty(sq):
+            return math.log(max(1.0 - max(scores[sq].values(), default=0.0), eps))
+
+        def ll_piece(sq, p):
+            if p == EMPTY_CELL:
+                return ll_empty(sq)
+            name = ('r' if p.isupper() else 'b') + p.upper()
+            return math.log(max(scores[sq].get(name, 0.0), eps))
+
+        def best_reveal(sq, color):
+            # 翻开的棋子只可能是暗子库中仍有剩余的兵种
+            roles = [p for p in 'RNBACP' if self.dark_piece_library.get(color + p, 0) > 0] or list('RNBACP')
+            return max((math.log(max(scores[sq].get(color + p, 0.0), eps)), p) for p in roles)
+
+        old_ll = [ll_piece(sq, old_cells[sq]) for sq in range(90)]
+        hypotheses = [(0.0, None, None)]  # (相对"未走棋"的对数似然增量, 走法, 落点棋子)
+        for from_sq, to_sq in generate_legal_moves(old_cells, side):
+            mover = old_cells[from_sq]
+            if mover in 'Xx':
+                color = 'r' if mover.isupper() else 'b'
+                landed_ll, role = best_reveal(to_sq, color)
+                landed = role if color == 'r' else role.lower()
+            else:
+                landed = mover
+                landed_ll = ll_piece(to_sq, mover)
+            delta = ll_empty(from_sq) + landed_ll - old_ll[from_sq] - old_ll[to_sq]
+            hypotheses.append((delta, (from_sq, to_sq), landed))
+
+        hypotheses.sort(key=lambda h: h[0], reverse=True)
+        best_delta, best_move, landed = hypotheses[0]
+        predicted = old_cells if best_move is None else apply_compact_move(old_cells, best_move[0], best_move[1], landed)
+
+        # 与阈值化后的观测比较，差异过多说明没有任何假设能解释画面
+        threshold = self.confidence_threshold
+        mismatch = 0
+        for sq in range(90):
+            observed = max(scores[sq].items(), key=lambda kv: kv[1], default=(None, 0.0))
+            expected = predicted[sq]
+            if expected == EMPTY_CELL:
+                mismatch += observed[1] > threshold
+            else:
+                name = ('r' if expected.isupper() else 'b') + expected.upper()
+                mismatch += observed[0] != name
+        if mismatch > max_mismatch:
+            return 'unexplained', None, None
+
+        if len(hypotheses) > 1 and best_delta - hypotheses[1][0] < self.settings.get('inference_margin', 2.0):
+            logger.debug("[概率推断] 最优与次优假设差距不足 (%.2f)，等待下一次识别。", best_delta - hypotheses[1][0])
+            return 'ambiguous', None, None
+        if best_move is None:
+            return 'unchanged', None, None
+
+        from_row, from_col = self.square_to_board(best_move[0])
+        to_row, to_col = self.square_to_board(best_move[1])
+        revealed_char = landed if old_cells[best_move[0]] in 'Xx' else ''
+        logger.debug("[概率推断] 采用走法 %s，领先 %.2f。", self.move_to_uci(from_row, from_col, to_row, to_col, revealed_char), best_delta - hypotheses[1][0])
+        return 'move', (from_row, from_col, to_row, to_col, revealed_char), compact_to_board(predicted, flipped)
+
     def move_to_uci(self, from_row, from_col, to_row, to_col, revealed_piece=''):
         """将棋盘坐标转换为UCI移动字符串"""
         col_map = "abcdefghi"
@@ -755,53 +2758,29 @@ class AutoChessPlayer:
         screen_y = self.roi['top'] + (row * grid_h) + (grid_h / 2)
         return screen_x, screen_y
 
+    @timed('click', span=True)
     def perform_move_on_screen(self, uci_move):
-        """根据设置选择并执行走棋方法"""
-        if self.settings.get('use_mouse_click', 0) == 1:
-            self.simulate_move_with_autogui(uci_move)
-        else:
-            self.simulate_move_with_postmessage(uci_move)
-            
-    def simulate_move_with_autogui(self, uci_move):
-        """使用 pyautogui 模拟鼠标点击来执行走棋"""
-        if len(uci_move) < 4: return
-
-        from_row, from_col, to_row, to_col = self.uci_to_board_coords(uci_move)
-        start_screen_x, start_screen_y = self.grid_to_screen_coords(from_row, from_col)
-        end_screen_x, end_screen_y = self.grid_to_screen_coords(to_row, to_col)
-
-        _d_print(f"执行鼠标点击: {uci_move} 从 ({int(start_screen_x)}, {int(start_screen_y)}) 到 ({int(end_screen_x)}, {int(end_screen_y)}) (屏幕坐标)")
-
-        pyautogui.click(x=start_screen_x, y=start_screen_y)
-        time.sleep(self.settings['board_click_interval'])
-        pyautogui.click(x=end_screen_x, y=end_screen_y)
-
-    def simulate_move_with_postmessage(self, uci_move):
-        """使用 PostMessage 发送后台点击消息来执行走棋"""
+        """
+        通过输入后端执行走棋：点击起点后，一旦截屏检测到起点格发生变化（棋子被选中）就立即点击终点，
+        board_click_interval 仅作为等待确认的上限。
+        """
         if len(uci_move) < 4: return
-        if not self.hwnd:
-            _d_print("错误：未找到有效的游戏窗口句柄，无法执行走子。")
+        if self.injector is None:
+            logger.error("错误：未初始化输入后端，无法执行走子。")
             return
 
         from_row, from_col, to_row, to_col = self.uci_to_board_coords(uci_move)
         start_screen_pos = self.grid_to_screen_coords(from_row, from_col)
         end_screen_pos = self.grid_to_screen_coords(to_row, to_col)
-        start_client_pos = win32gui.ScreenToClient(self.hwnd, (int(start_screen_pos[0]), int(start_screen_pos[1])))
-        end_client_pos = win32gui.ScreenToClient(self.hwnd, (int(end_screen_pos[0]), int(end_screen_pos[1])))
-        start_lParam = win32api.MAKELONG(start_client_pos[0], start_client_pos[1])
-        end_lParam = win32api.MAKELONG(end_client_pos[0], end_client_pos[1])
+        before = self._cell_pixels(self._grab_roi('click_ack'), from_row, from_col).copy()
 
-        _d_print(f"发送后台点击: {uci_move} 从 {start_client_pos} 到 {end_client_pos} (窗口坐标)")
-        
-        win32api.PostMessage(self.hwnd, win32con.WM_LBUTTONDOWN, win32con.MK_LBUTTON, start_lParam)
-        time.sleep(0.05)
-        win32api.PostMessage(self.hwnd, win32con.WM_LBUTTONUP, 0, start_lParam)
-        
-        time.sleep(self.settings['board_click_interval'])
-        
-        win32api.PostMessage(self.hwnd, win32con.WM_LBUTTONDOWN, win32con.MK_LBUTTON, end_lParam)
-        time.sleep(0.05)
-        win32api.PostMessage(self.hwnd, win32con.WM_LBUTTONUP, 0, end_lParam)
+        def wait_ack(_):
+            if not self._wait_cell_change(from_row, from_col, before, self.settings['board_click_interval']):
+                logger.debug("[点击确认] 起点格未检测到变化，超时后继续点击终点。")
+
+        logger.debug("执行点击 (%s): %s 从 (%s, %s) 到 (%s, %s) (屏幕坐标)", self.injector.name, uci_move, int(start_screen_pos[0]), int(start_screen_pos[1]), int(end_screen_pos[0]), int(end_screen_pos[1]))
+        if self.recorder: self.recorder.record_event('click', {'move': uci_move, 'from': start_screen_pos, 'to': end_screen_pos})
+        self.injector.click_sequence([start_screen_pos, end_screen_pos], wait_ack)
 
     def is_board_state_valid(self, board_state):
         """验证棋盘状态是否合法"""
@@ -819,21 +2798,22 @@ class AutoChessPlayer:
 
         for piece, count in piece_counts.items():
             if count > max_counts[piece]:
-                _d_print(f"\n[Validation Error] 非法棋子数量: {piece}. 发现 {count}, 最大允许 {max_counts[piece]}.")
-                self.reset_game()
+                logger.warning("[Validation Error] 非法棋子数量: %s. 发现 %s, 最大允许 %s.", piece, count, max_counts[piece])
+                self.reset_game("invalid")
                 return False
 
         if red_king_pos and not (7<=red_king_pos[0]<=9 and 3<=red_king_pos[1]<=5 or 0<=red_king_pos[0]<=2 and 3<=red_king_pos[1]<=5):
-            _d_print(f"\n[Validation Error] 红帅位置非法: {red_king_pos}.")
+            logger.warning("[Validation Error] 红帅位置非法: %s.", red_king_pos)
             return False
         if black_king_pos and not (0<=black_king_pos[0]<=2 and 3<=black_king_pos[1]<=5 or 7<=black_king_pos[0]<=9 and 3<=black_king_pos[1]<=5):
-            _d_print(f"\n[Validation Error] 黑将位置非法: {black_king_pos}.")
+            logger.warning("[Validation Error] 黑将位置非法: %s.", black_king_pos)
             return False
         if sum(piece_counts.values()) > 2 and (not red_king_pos or not black_king_pos):
-            _d_print("\n[Validation Error] 棋盘上缺少将/帅。")
+            logger.warning("[Validation Error] 棋盘上缺少将/帅。")
             return False
         return True
         
+    @timed('fen')
     def board_state_to_jieqi_fen(self, board_state):
         """将棋盘状态转换为揭棋FEN字符串"""
         if not board_state: return ""
@@ -861,47 +2841,37 @@ class AutoChessPlayer:
             fen_parts.append(row_str)
         board_fen = "/".join(fen_parts)
 
-        pool_str = ""
-        fen_order = ['R','r','N','n','B','b','A','a','C','c','P','p']
-        
-        internal_to_fen = {
-            'rR':'R', 'bR':'r', 'rN':'N', 'bN':'n', 'rB':'B', 'bB':'b',
-            'rA':'A', 'bA':'a', 'rC':'C', 'bC':'c', 'rP':'P', 'bP':'p'
-        }
-        fen_to_internal = {v: k for k, v in internal_to_fen.items()}
-
-        for p_char in fen_order:
-            internal_key = fen_to_internal[p_char]
-            count = self.dark_piece_library.get(internal_key, 0)
-            if count > 0:
-                pool_str += f"{p_char}{count}"
+        pool_str = self.dark_piece_library.fen_pool()
         
         player_turn = 'w' if self.current_player == 'r' else 'b'
         full_fen = f"{board_fen} {player_turn} {pool_str} 0 1"
         return full_fen
 
+    @timed('engine_search', span=True)
     def get_engine_move(self):
         """从引擎获取最佳走法"""
+        self._apply_engine_settings()
         movetime = self.settings['engine_think_time']
         current_fen = self.board_state_to_jieqi_fen(self.last_board_state)
         if not current_fen:
-            _d_print("错误：无法生成当前局面的FEN，无法获取引擎走法。")
+            logger.error("错误：无法生成当前局面的FEN，无法获取引擎走法。")
             return None
         
         position_cmd = f"position fen {current_fen}"
-        _d_print(f"为引擎生成了新的FEN: {current_fen}")
+        logger.debug("为引擎生成了新的FEN: %s", current_fen)
         
         try:
             self.send_engine_command(position_cmd)
-            self.send_engine_command(f"go movetime {movetime}")
+            searchmoves = self._perpetual_check_filter()
+            self.send_engine_command(f"go movetime {movetime}" + (f" searchmoves {' '.join(searchmoves)}" if searchmoves else ""))
         except EngineCommunicationError:
-            _d_print("ERROR: 无法向引擎发送 'position' 或 'go' 命令。")
+            logger.error("ERROR: 无法向引擎发送 'position' 或 'go' 命令。")
             raise
 
         bestmove = None
         timeout = (movetime / 1000) + 5.0
         start_time = time.time()
-        _d_print("正在等待引擎计算最佳走法...")
+        logger.debug("正在等待引擎计算最佳走法...")
 
         while time.time() - start_time < timeout:
             for event in pygame.event.get():
@@ -910,7 +2880,7 @@ class AutoChessPlayer:
                     return None
             if self.game_over: break
             
-            output = self.read_engine_output()
+            output = self.read_engine_output(0.05)
             if output.startswith("info"):
                 parts = output.split()
                 try:
@@ -926,16 +2896,17 @@ class AutoChessPlayer:
                 except (ValueError, IndexError): pass
 
             elif output.startswith("bestmove"):
-                bestmove = output.split(" ")[1]
-                _d_print(f"引擎已找到最佳走法: {bestmove}")
+                parts = output.split()
+                if len(parts) < 2:
+                    raise EngineCommunicationError(f"引擎返回了格式错误的bestmove: '{output}'")
+                bestmove = parts[1]
+                logger.debug("引擎已找到最佳走法: %s", bestmove)
                 self.display.update_engine_info("", "", "")
                 self.display.draw_captured_board(self.last_board_state, self.dark_piece_library, self.is_running)
                 break
             elif not output and self.engine and self.engine.poll() is not None:
                 self.engine = None
                 raise EngineCommunicationError("引擎在计算最佳走法时意外终止。")
-            elif not output:
-                 time.sleep(0.01)
 
         if bestmove is None:
             if self.engine and self.engine.poll() is not None:
@@ -945,18 +2916,27 @@ class AutoChessPlayer:
 
         return bestmove
 
-    def reset_game(self):
-        """重置游戏变量并准备等待新游戏。"""
-        _d_print("\n游戏结束或检测到错误。正在重置并等待新游戏...")
+    def reset_game(self, reason=None):
+        """
+        重置游戏变量并准备等待新游戏。
+        reason 为出错原因；只有对局进行中因出错而重置时才导出事故记录，正常结束与用户按“重启”不导出。
+        """
+        logger.info("游戏结束或检测到错误。正在重置并等待新游戏...")
+        self.metrics.count('resets')
+        if reason and self.last_board_state is not None:
+            # 对局进行中出错被重置，保存事故前的详细日志与画面
+            self.dump_incident(reason)
         self.move_notations.clear()
         self.current_player, self.computer_side = 'r', None
         self.last_board_state = None
-        self.board_history.clear()
+        self.position_history.clear()
         self.game_state = "WAITING_FOR_NEW_GAME"
         self.display.update_engine_info("", "", "")
         
-        self.dark_piece_library = self.initial_dark_pool.copy()
-        _d_print("暗子库已重置为初始状态。")
+        self.dark_piece_library.reset()
+        self._pending_correction = None
+        self._skin_matched = False
+        logger.debug("暗子库已重置为初始状态。")
         
         ready_timeout = 5
         try:
@@ -966,18 +2946,28 @@ class AutoChessPlayer:
             while "readyok" not in self.read_engine_output():
                 if time.time() - start_time > ready_timeout:
                     raise EngineCommunicationError("引擎在ucinewgame后未准备就绪。")
-                time.sleep(0.1)
         except EngineCommunicationError as e:
-            _d_print(f"引擎通信错误: {e}，尝试重新初始化引擎。")
+            logger.error("引擎通信错误: %s，尝试重新初始化引擎。", e)
             try:
+                self.metrics.count('engine_restarts')
                 self.init_engine()
-                _d_print("引擎重新初始化成功。")
+                logger.info("引擎重新初始化成功。")
             except EngineCommunicationError as re_init_e:
-                _d_print(f"FATAL: 引擎重新初始化失败: {re_init_e}。")
+                logger.error("FATAL: 引擎重新初始化失败: %s。", re_init_e)
                 self.game_over = True
                 return
             
-        _d_print("游戏状态重置完成。现在等待新游戏。")
+        logger.info("游戏状态重置完成。现在等待新游戏。")
+
+    def dump_incident(self, reason):
+        """导出最近的详细日志与飞行记录。"""
+        logger.dump_recent(self.settings.get('incident_log_seconds', 30.0), reason)
+        if self.recorder:
+            try:
+                bundle = self.recorder.dump(reason)
+                logger.info("飞行记录已导出: %s", bundle)
+            except OSError as e:
+                logger.warning("飞行记录导出失败: %s", e)
 
     def run(self):
         """主循环"""
@@ -986,41 +2976,49 @@ class AutoChessPlayer:
                 if event.type == pygame.QUIT:
                     self.game_over = True
                     break
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F12:
+                    logger.info("[界面操作] F12: 手动导出飞行记录。")
+                    self.dump_incident("manual")
                 if event.type == pygame.MOUSEBUTTONDOWN:
 
                     if self.display.handle_dark_piece_library_click(event.pos, self.dark_piece_library):
-                        _d_print(f"手动调整暗子库: {self.dark_piece_library}")
+                        logger.debug("手动调整暗子库: %s", self.dark_piece_library)
                         pass
 
                     elif self.display.settings_button_rect.collidepoint(event.pos):
-                        _d_print("\n[界面操作] “设置”按钮被按下。")
-                        self.settings = load_settings()
+                        logger.debug("[界面操作] “设置”按钮被按下。")
                         show_settings_window(self.settings)
-                        self.settings = load_settings()
-                        _d_print("设置窗口已关闭。")
+                        self.poll_settings_file(force=True)
+                        logger.debug("设置窗口已关闭。")
 
                     elif self.display.connect_button_rect.collidepoint(event.pos):
                         if self.is_running:
-                            _d_print("\n[界面操作] “重启”按钮被按下。正在重置游戏状态...")
+                            logger.debug("[界面操作] “重启”按钮被按下。正在重置游戏状态...")
                             self.is_running = False
                             try: self.reset_game()
                             except EngineCommunicationError:
-                                _d_print("错误：无法重启游戏，引擎通信失败。程序将退出。")
+                                logger.error("错误：无法重启游戏，引擎通信失败。程序将退出。")
                                 self.game_over = True
                         else:
-                            _d_print("\n[界面操作] “连线”按钮被按下。正在启动自动对弈...")
+                            logger.debug("[界面操作] “连线”按钮被按下。正在启动自动对弈...")
                             self.is_running = True
                             try: self.reset_game()
                             except EngineCommunicationError:
-                                _d_print("错误：无法启动游戏，引擎通信失败。程序将退出。")
+                                logger.error("错误：无法启动游戏，引擎通信失败。程序将退出。")
                                 self.game_over = True
             if self.game_over: break
 
+            self.metrics.maybe_export(self.settings.get('metrics_dir', 'resource/metrics'), self.settings.get('metrics_interval', 30.0))
+            self.poll_settings_file()
+            self._finish_model_swap()
+
             if self.is_running:
                 try:
                     if self.game_state == "WAITING_FOR_NEW_GAME":
-                        _d_print("\r正在搜索新的、合法的游戏棋盘...", end="", flush=True)
+                        logger.debug("正在搜索新的、合法的游戏棋盘...")
                         current_board = self.get_board_state_from_screen()
+                        if self._select_skin_profile():
+                            continue
                         # 在等待时，也保持界面上的暗子库显示为最新状态
                         if self.last_board_state is None:
                             self.display.draw_captured_board(current_board, self.dark_piece_library, self.is_running)
@@ -1034,13 +3032,13 @@ class AutoChessPlayer:
                             
                             if found_red_king_at_bottom:
                                 self.computer_side, side_determined = 'r', True
-                                _d_print("\n执棋方已确定: 电脑执红 (将帅在底部)。")
+                                logger.info("执棋方已确定: 电脑执红 (将帅在底部)。")
                             elif found_black_king_at_bottom:
                                 self.computer_side, side_determined = 'b', True
-                                _d_print("\n执棋方已确定: 电脑执黑 (将帅在底部，棋盘已翻转)。")
+                                logger.info("执棋方已确定: 电脑执黑 (将帅在底部，棋盘已翻转)。")
                             elif dark_piece_count == 32:
                                 self.computer_side, side_determined = 'r', True
-                                _d_print("\n检测到所有棋子面朝下。默认为电脑执红。")
+                                logger.info("检测到所有棋子面朝下。默认为电脑执红。")
                             
                             if side_determined:
                                 # --- NEW: 根据识别到的棋盘，计算并设置初始暗子库 ---
@@ -1048,19 +3046,21 @@ class AutoChessPlayer:
                                 # --- END NEW ---
 
                                 self.last_board_state = current_board
-                                self.board_history.append(current_board)
                                 self.current_player = 'r'
+                                self._record_position(current_board)
                                 
                                 if self.computer_side == 'b':
                                     self.game_state = "HYPOTHESIZE_BLACK_TURN"
-                                    _d_print("检测到执黑方，进入先手假设模式。")
+                                    logger.debug("检测到执黑方，进入先手假设模式。")
                                 else:
                                     self.game_state = "PLAYING"
-                                    _d_print("新游戏开始。进入对战模式。")
+                                    logger.info("新游戏开始。进入对战模式。")
+                                self.scan_scheduler.start_session()
+                                self.scan_scheduler.reset(self.settings)
                         time.sleep(2)
 
                     elif self.game_state == "HYPOTHESIZE_BLACK_TURN":
-                        _d_print("\n[执黑方] 检测到新局面，假设对手已走，尝试我方先行...")
+                        logger.debug("[执黑方] 检测到新局面，假设对手已走，尝试我方先行...")
                         
                         # 在黑方假设先行时，需要临时将走棋方设置为 'b' 来生成正确的FEN
                         original_player = self.current_player
@@ -1079,38 +3079,36 @@ class AutoChessPlayer:
                         while time.time() - start_time < 4.0:
                             current_board = self.get_board_state_from_screen()
                             if current_board != board_before_move:
-                                move_tuple = self.compare_boards(board_before_move, current_board)
+                                # 可能是我方（黑）走棋成功，也可能是对手（红）抢先
+                                move_tuple = (self.infer_move(board_before_move, current_board, 'b')
+                                              or self.infer_move(board_before_move, current_board, 'r'))
                                 if move_tuple:
                                     detected_uci_move = self.move_to_uci(*move_tuple)
-                                    # --- LOGIC CHANGE START ---
                                     # 如果检测到翻子，立即更新暗子库
-                                    if move_tuple[4]:
-                                        revealed_piece_pos = (move_tuple[2], move_tuple[3])
-                                        piece_key = current_board[revealed_piece_pos[0]][revealed_piece_pos[1]]
-                                        self._handle_piece_reveal(piece_key)
-                                    # --- LOGIC CHANGE END ---
+                                    self._track_move(move_tuple, current_board)
                                     
                                     self.move_notations.append(detected_uci_move)
                                     self.last_board_state = current_board
-                                    self.board_history.append(current_board)
                                     
                                     # 判断是我方走棋成功还是对方抢先了
                                     if detected_uci_move[:4] == engine_move[:4]:
-                                        _d_print(f"假设成功！我方走法 {detected_uci_move} 已确认。")
+                                        logger.info("假设成功！我方走法 %s 已确认。", detected_uci_move)
                                         self.current_player = 'r'
                                     else:
-                                        _d_print(f"假设失败！对手抢先移动: {detected_uci_move}")
+                                        logger.info("假设失败！对手抢先移动: %s", detected_uci_move)
                                         self.current_player = 'b' # 对手走了，轮到我了
+                                    self._record_position(current_board)
                                     
                                     break
                             time.sleep(0.1)
                         
                         self.game_state = "PLAYING"
+                        self.scan_scheduler.reset(self.settings)
 
 
                     elif self.game_state == "PLAYING":
                         if self.current_player == self.computer_side:
-                            _d_print("\n--- 电脑回合 ---")
+                            logger.debug("--- 电脑回合 ---")
                             engine_move = self.get_engine_move()
                             if not engine_move or engine_move == "(none)":
                                 self.reset_game(); continue
@@ -1118,78 +3116,106 @@ class AutoChessPlayer:
                             board_before_move = self.last_board_state
                             self.perform_move_on_screen(engine_move)
                             
-                            # 确认我方走棋是否成功
+                            # 确认我方走棋是否成功：先只检查起止两格，不符时再回退到整盘识别
                             board_after_our_move = None
+                            move_tuple = None
                             start_time = time.time()
-                            time.sleep(self.settings['board_click_interval']) # 等待点击生效
-                            while time.time() - start_time < 5.0:
+                            confirm_start = time.perf_counter()
+                            confirmed = self.confirm_move_by_cells(board_before_move, engine_move)
+                            if confirmed:
+                                move_tuple, board_after_our_move = confirmed
+                            while not confirmed and time.time() - start_time < 5.0:
                                 snapshot = self.get_board_state_from_screen()
                                 if snapshot != board_before_move:
-                                    move_tuple = self.compare_boards(board_before_move, snapshot)
+                                    move_tuple = self.infer_move(board_before_move, snapshot, self.computer_side)
+                                    if not move_tuple and self.settings.get('likelihood_inference', 1) == 1:
+                                        _, move_tuple, predicted_board = self.infer_move_from_scores(
+                                            board_before_move, self.last_cell_scores, self.computer_side)
+                                        if move_tuple:
+                                            snapshot = predicted_board
                                     if move_tuple:
-                                        # --- LOGIC CHANGE START ---
-                                        # 如果我方走法是翻子，则更新暗子库
-                                        if move_tuple[4]:
-                                            revealed_pos = (move_tuple[2], move_tuple[3])
-                                            piece_key = snapshot[revealed_pos[0]][revealed_pos[1]]
-                                            self._handle_piece_reveal(piece_key)
-                                        # --- LOGIC CHANGE END ---
-                                        
-                                        corrected_uci_move = self.move_to_uci(*move_tuple)
                                         board_after_our_move = snapshot
-                                        _d_print(f"最终确认我方走法: {corrected_uci_move}")
-                                        self.move_notations.append(corrected_uci_move)
                                         break
                                 time.sleep(0.1)
+                            self.metrics.observe('confirm', time.perf_counter() - confirm_start, span=True)
+                            if not confirmed:
+                                self.metrics.count('confirm_fallbacks')
 
                             if board_after_our_move:
+                                # 如果我方走法是翻子，则更新暗子库
+                                self._track_move(move_tuple, board_after_our_move)
+                                corrected_uci_move = self.move_to_uci(*move_tuple)
+                                logger.info("最终确认我方走法: %s", corrected_uci_move)
+                                self.move_notations.append(corrected_uci_move)
+                                self.metrics.end_move('ours')
+
                                 self.display.draw_captured_board(board_after_our_move, self.dark_piece_library, self.is_running)
                                 self.last_board_state = board_after_our_move
-                                self.board_history.append(board_after_our_move)
                                 self.current_player = 'b' if self.current_player == 'r' else 'r'
+                                self._record_position(board_after_our_move)
+                                self.scan_scheduler.reset(self.settings)
                             else:
-                                _d_print("错误：未能确认我方走法。尝试重置游戏。")
-                                self.reset_game()
+                                logger.error("错误：未能确认我方走法。尝试重置游戏。")
+                                self.save_hard_example('unconfirmed')
+                                self.reset_game("unconfirmed")
                         else: 
-                            _d_print("\r--- 对手回合: 监控中 ---", end="", flush=True)
+                            logger.debug("--- 对手回合: 监控中 ---")
                             new_board_state = self.get_board_state_from_screen()
                             
-                            if new_board_state != self.last_board_state:
-                                _d_print() # 换行
-                                if not self.is_board_state_valid(new_board_state):
-                                    time.sleep(1)
-                                    continue
-                                    
-                                move = self.compare_boards(self.last_board_state, new_board_state)
+                            if new_board_state != self.last_board_state and self._check_reveal_correction(self.last_board_state, new_board_state):
+                                pass
+                            elif new_board_state != self.last_board_state:
+                                status, move = 'unexplained', None
+                                if self.settings.get('likelihood_inference', 1) == 1 and self.last_cell_scores:
+                                    status, move, predicted_board = self.infer_move_from_scores(
+                                        self.last_board_state, self.last_cell_scores, self.current_player)
+                                    if status == 'move':
+                                        new_board_state = predicted_board
+                                    elif status == 'ambiguous':
+                                        self.metrics.count('ambiguous_scans')
+                                        self.save_hard_example('ambiguous')
+
+                                if status == 'unexplained':
+                                    if not self.is_board_state_valid(new_board_state):
+                                        self.metrics.count('invalid_boards')
+                                        self.save_hard_example('invalid')
+                                        time.sleep(1)
+                                        continue
+                                    move = self.infer_move(self.last_board_state, new_board_state, self.current_player)
+
                                 if move:
                                     # 如果对手的走法是翻子，则更新暗子库
-                                    if move[4]:
-                                        revealed_pos = (move[2], move[3])
-                                        piece_key = new_board_state[revealed_pos[0]][revealed_pos[1]]
-                                        self._handle_piece_reveal(piece_key)
+                                    self._track_move(move, new_board_state)
                                     
                                     uci_move = self.move_to_uci(*move)
-                                    _d_print(f"检测到对手走法: {uci_move}")
+                                    logger.info("检测到对手走法: %s", uci_move)
                                     self.move_notations.append(uci_move)
+                                    self.metrics.end_move('opponent')
                                     self.last_board_state = new_board_state
-                                    self.board_history.append(new_board_state)
                                     self.current_player = 'b' if self.current_player == 'r' else 'r'
-                                else: 
-                                    _d_print("\n检测到无法识别的棋盘变化，尝试重置游戏。")
+                                    self._record_position(new_board_state)
+                                elif status == 'unexplained':
+                                    self.metrics.count('misrecognitions')
+                                    self.save_hard_example('unexplained')
+                                    logger.warning("检测到无法识别的棋盘变化，尝试重置游戏。")
                                     self.last_board_state = new_board_state # 更新状态以避免循环重置
-                                    self.reset_game()
+                                    self.reset_game("unexplained")
                             
                             # 界面实时更新，即使棋盘没变化
                             self.display.draw_captured_board(new_board_state, self.dark_piece_library, self.is_running)
-                            time.sleep(self.settings['fixed_scan_interval'])
+                            if self.settings.get('adaptive_scan', 1) == 1:
+                                self.scan_scheduler.note_scan(self.last_frame)
+                                self.metrics.count(f"{self.scan_scheduler.wait(self)}_scans")
+                            else:
+                                time.sleep(self.settings['fixed_scan_interval'])
 
                 except EngineCommunicationError as e:
-                    _d_print(f"\n[错误] 引擎通信失败: {e}。")
-                    self.reset_game()
+                    logger.error("[错误] 引擎通信失败: %s。", e)
+                    self.reset_game("engine")
                     if self.game_over: break
                 except Exception as e:
-                    _d_print(f"\n在对战中发生错误: {e}。尝试重置。")
-                    self.reset_game()
+                    logger.error("在对战中发生错误: %s。尝试重置。", e)
+                    self.reset_game("exception")
             
             else:
                 current_board = self._capture_single_frame()
@@ -1203,30 +3229,46 @@ class AutoChessPlayer:
                 if self.engine and self.engine.poll() is None:
                     self.engine.terminate()
     
+        if self.settings.get('metrics_interval', 30.0) > 0:
+            try: self.metrics.export(self.settings.get('metrics_dir', 'resource/metrics'))
+            except OSError: pass
+
+        if self.recorder: self.recorder.close()
+        if self.hard_examples: self.hard_examples.close()
+
         pygame.quit()
-        _d_print("引擎已关闭。程序退出。")
+        logger.info("引擎已关闭。程序退出。")
 
 if __name__ == "__main__":
 
     settings = load_settings()
-    if settings.get("debug_mode", 0) == 1:
-        DEBUG_ENABLED = True
-    else:
+    debug_mode = settings.get("debug_mode", 0) == 1
+    logger.configure(log_dir=settings.get("log_dir", "resource/logs"), console=debug_mode,
+                     file_level='DEBUG' if debug_mode else settings.get("log_level", "INFO"))
+    if not debug_mode:
         # 如果关闭调试模式，将标准错误流重定向到空设备以抑制所有错误消息
         sys.stderr = NullWriter()
 
+    startup = StartupTimer(_IMPORT_START)
+    startup.phases['imports'] = time.perf_counter() - _IMPORT_START
+    # 用户框选棋盘期间在后台预加载模型
+    model_future = preload_model(settings['model_path'], startup, settings.get('inference_threads', 0))
+
     try:
-        roi = select_board_roi()
+        roi = startup.run('select_roi', select_board_roi)
         if roi:
-            _d_print(f"棋盘区域已选定: {roi}")
-            player = AutoChessPlayer(roi)
+            logger.info("棋盘区域已选定: %s", roi)
+            player = AutoChessPlayer(roi, startup=startup, model_future=model_future)
             
-            if not player.find_game_window():
-                 _d_print("\n未能找到有效的游戏窗口句柄，程序即将退出。")
+            if not player.setup_injector():
+                 logger.error("未能初始化输入后端（或找到有效的游戏窗口句柄），程序即将退出。")
                  sys.exit(1)
                  
             player.run()
     except Exception as e:
         # 捕获所有未处理的异常，仅在调试模式下打印
-        _d_print(f"程序发生错误: {e}")
-        sys.exit(1)
\ No newline at end of file
+        logger.error("程序发生错误: %s", e)
+        logger.dump_recent(settings.get("incident_log_seconds", 30.0), "crash")
+        sys.exit(1)
+    finally:
+        logger.close()
\ No newline at end of file
@@ -0,0 +1,252 @@
+"""
+模拟UCI引擎：供模拟器（simulate.py）、引擎层压测与离线调试使用，不做真正的搜索。
+收到 go 后在当前局面的合法走法中选一步：有吃子时吃价值最高的子，否则按局面哈希与种子确定性地随机选择。
+
+可配置的行为：
+  --think-ms / --think-scale   每步思考时间（固定毫秒，或按 go movetime 的比例）
+  --info-rate                  思考期间每秒输出的 info 行数
+  --ready-delay-ms             每次回复 readyok 前的延迟；--startup-delay-ms 启动后处理命令前的延迟
+  --script                     逐步动作脚本，每次 go 消耗一行：
+                                 legal    正常选择合法走法（空行相同）
+                                 none     回复 bestmove (none)
+                                 crash    立即退出进程
+                                 hang     不再响应任何命令
+                                 timeout  本步不给出 bestmove，但仍响应其它命令
+                                 garbage  回复格式错误的 bestmove
+                                 其它     原样作为 bestmove 的走法（例如 h2e2）
+  --crash-after / --hang-after 第N次 go 时崩溃/卡死；--crash-prob 每次 go 按概率崩溃
+
+用法: 在设置或模拟器中把引擎路径设为 [python, mock_engine.py, --seed, N, ...]
+"""
+import argparse
+import contextlib
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import zlib
+
+# main 在导入时可能向标准输出打印信息，这里改写到标准错误，避免污染UCI协议
+with contextlib.redirect_stdout(sys.stderr):
+    from main import EMPTY_CELL, apply_compact_move, generate_legal_moves
+
+FILES = "abcdefghi"
+PIECE_VALUES = {'k': 1000, 'r': 9, 'c': 5, 'n': 4, 'x': 3, 'b': 2, 'a': 2, 'p': 1}
+
+def parse_fen(fen):
+    """解析揭棋FEN的棋盘与走棋方，返回 (紧凑局面, 'r'|'b')。"""
+    fields = fen.split()
+    cells = []
+    for row in fields[0].split('/'):
+        for ch in row:
+            if ch.isdigit():
+                cells.extend(EMPTY_CELL * int(ch))
+            else:
+                cells.append(ch)
+    side = 'b' if len(fields) > 1 and fields[1] == 'b' else 'r'
+    return ''.join(cells), side
+
+def square_to_uci(sq):
+    r, c = divmod(sq, 9)
+    return f"{FILES[c]}{9 - r}"
+
+def uci_to_square(text):
+    return (9 - int(text[1])) * 9 + FILES.index(text[0])
+
+def choose_move(cells, side, seed, allowed=None):
+    """返回选中的 (from_sq, to_sq)，无合法走法时返回 None。allowed 为 go searchmoves 限定的走法集合。"""
+    moves = generate_legal_moves(cells, side)
+    if allowed:
+        moves = [m for m in moves if m in allowed] or moves
+    if not moves:
+        return None
+    captures = [m for m in moves if cells[m[1]] != EMPTY_CELL]
+    if captures:
+        return max(captures, key=lambda m: (PIECE_VALUES[cells[m[1]].lower()], -m[0], -m[1]))
+    rng = random.Random(seed ^ zlib.crc32(cells.encode() + side.encode()))
+    return rng.choice(moves)
+
+def handle_position(tokens):
+    """解析 position 命令，返回 (紧凑局面, 走棋方)。"""
+    if tokens[1] == 'startpos':
+        raise ValueError("揭棋模拟引擎只支持 position fen")
+    end = tokens.index('moves') if 'moves' in tokens else len(tokens)
+    cells, side = parse_fen(' '.join(tokens[2:end]))
+    for move in tokens[end + 1:]:
+        cells = apply_compact_move(cells, uci_to_square(move[:2]), uci_to_square(move[2:4]))
+        side = 'b' if side == 'r' else 'r'
+    return cells, side
+
+def _read_stdin(commands):
+    for line in sys.stdin:
+        commands.put(line.split())
+    commands.put(None)  # 标准输入关闭
+
+class MockEngine:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.script = []
+        if args.script:
+            with open(args.script, encoding='utf-8') as f:
+                self.script = [line.split('#')[0].strip() for line in f]
+        self.cells, self.side = None, 'r'
+        self.options = {}
+        self.go_count = 0
+        self.hung = False
+        self.commands = queue.Queue()
+
+    def send(self, text):
+        sys.stdout.write(text + "\n")
+        sys.stdout.flush()
+
+    def run(self):
+        if self.args.startup_delay_ms > 0:
+            time.sleep(self.args.startup_delay_ms / 1000)
+        threading.Thread(target=_read_stdin, args=(self.commands,), daemon=True).start()
+        while True:
+            tokens = self.commands.get()
+            if tokens is None:
+                return
+            if tokens and not self.hung and not self.handle(tokens):
+                return
+
+    def handle(self, tokens):
+        """处理一条命令，返回 False 表示退出。"""
+        command = tokens[0]
+        if command == 'uci':
+            self.send("id name MoonlinkMock")
+            self.send("id author Moonlink")
+            self.send("option name Threads type spin default 1 min 1 max 1024")
+            self.send("option name Hash type spin default 16 min 1 max 33554432")
+            self.send("uciok")
+        elif command == 'isready':
+            if self.args.ready_delay_ms > 0:
+                time.sleep(self.args.ready_delay_ms / 1000)
+            self.send("readyok")
+        elif command == 'setoption' and 'name' in tokens:
+            rest = tokens[tokens.index('name') + 1:]
+            split = rest.index('value') if 'value' in rest else len(rest)
+            self.options[' '.join(rest[:split])] = ' '.join(rest[split + 1:])
+        elif command == 'ucinewgame':
+            self.cells = None
+        elif command == 'position':
+            try:
+                self.cells, self.side = handle_position(tokens)
+            except (ValueError, IndexError) as e:
+                self.send(f"info string bad position: {e}")
+                self.cells = None
+        elif command == 'go':
+            return self.search(tokens)
+        elif command == 'quit':
+            return False
+        return True
+
+    def next_action(self):
+        self.go_count += 1
+        args = self.args
+        if args.crash_after and self.go_count >= args.crash_after:
+            return 'crash'
+        if args.hang_after and self.go_count >= args.hang_after:
+            return 'hang'
+        if args.crash_prob > 0 and self.rng.random() < args.crash_prob:
+            return 'crash'
+        if self.go_count <= len(self.script):
+            return self.script[self.go_count - 1] or 'legal'
+        return 'legal'
+
+    def think_seconds(self, tokens):
+        if 'infinite' in tokens:
+            return None
+        movetime = 0
+        if 'movetime' in tokens:
+            try:
+                movetime = int(tokens[tokens.index('movetime') + 1])
+            except (ValueError, IndexError):
+                pass
+        return max(self.args.think_ms, movetime * self.args.think_scale) / 1000
+
+    def search(self, tokens):
+        """模拟一次搜索：思考期间按频率输出 info，并继续响应 isready/stop/quit。返回 False 表示退出。"""
+        action = self.next_action()
+        if action == 'crash':
+            sys.stdout.flush()
+            os._exit(3)
+        if action == 'hang':
+            self.hung = True
+            return True
+
+        allowed = None
+        if 'searchmoves' in tokens:
+            allowed = {(uci_to_square(t[:2]), uci_to_square(t[2:4]))
+                       for t in tokens[tokens.index('searchmoves') + 1:] if len(t) >= 4 and t[0] in FILES and t[1].isdigit()}
+        move = choose_move(self.cells, self.side, self.args.seed, allowed) if self.cells else None
+        pv = f"{square_to_uci(move[0])}{square_to_uci(move[1])}" if move else ""
+        think = self.think_seconds(tokens)
+        start = time.monotonic()
+        # timeout 动作与 go infinite 一样没有截止时间，只等待 stop
+        deadline = None if think is None or action == 'timeout' else start + think
+        interval = 1.0 / self.args.info_rate if self.args.info_rate > 0 else None
+        next_info = start + interval if interval else None
+        depth = 0
+        deferred = []
+        while True:
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                break
+            if next_info is not None and now >= next_info:
+                depth += 1
+                self.send(f"info depth {depth} seldepth {depth} score cp {self.rng.randint(-50, 50)} "
+                          f"nodes {depth * 1000} nps 100000 time {int((now - start) * 1000)} pv {pv}".rstrip())
+                next_info += interval
+                continue
+            wakeups = [t for t in (deadline, next_info) if t is not None]
+            try:
+                cmd = self.commands.get(timeout=max(0.0, min(wakeups) - now) if wakeups else None)
+            except queue.Empty:
+                continue
+            if cmd is None or (cmd and cmd[0] == 'quit'):
+                return False
+            if not cmd:
+                continue
+            if cmd[0] == 'stop':
+                break
+            if cmd[0] == 'isready':
+                self.send("readyok")
+            else:
+                deferred.append(cmd)
+
+        if action == 'timeout':
+            pass
+        elif action == 'garbage':
+            self.send("bestmove")
+        elif action == 'none' or (action == 'legal' and not move):
+            self.send("bestmove (none)")
+        elif action == 'legal':
+            self.send(f"info depth {max(depth, 1)} score cp 0 nodes 1 pv {pv}")
+            self.send(f"bestmove {pv}")
+        else:
+            self.send(f"bestmove {action}")
+        for cmd in deferred:
+            if not self.handle(cmd):
+                return False
+        return True
+
+def main():
+    parser = argparse.ArgumentParser(description='揭棋模拟UCI引擎')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--think-ms', type=float, default=0, help='每步固定思考毫秒数')
+    parser.add_argument('--think-scale', type=float, default=0, help='按 go movetime 的比例思考，0 表示忽略 movetime')
+    parser.add_argument('--info-rate', type=float, default=0, help='思考期间每秒输出的 info 行数')
+    parser.add_argument('--ready-delay-ms', type=float, default=0, help='回复 readyok 前的延迟毫秒数')
+    parser.add_argument('--startup-delay-ms', type=float, default=0, help='启动后开始处理命令前的延迟毫秒数')
+    parser.add_argument('--script', help='逐步动作脚本文件')
+    parser.add_argument('--crash-after', type=int, default=0, help='第N次 go 时崩溃')
+    parser.add_argument('--hang-after', type=int, default=0, help='第N次 go 时卡死')
+    parser.add_argument('--crash-prob', type=float, default=0, help='每次 go 崩溃的概率')
+    MockEngine(parser.parse_args()).run()
+
+if __name__ == '__main__':
+    main()
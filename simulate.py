@@ -0,0 +1,588 @@
+"""
+揭棋连线模拟器：不需要游戏窗口、屏幕或真实引擎，在虚拟时间里驱动 AutoChessPlayer 的完整状态机。
+
+- 模拟棋桌 (SimTable) 代替屏幕：维护真实局面（含暗子的真实身份），按识别结果的形式输出棋盘与逐格置信度，
+  可注入识别噪声与走子动画；对手按脚本或种子随机走棋。
+- MockInjector 的点击回调推动模拟棋桌，模拟UCI引擎 (mock_engine.py) 负责我方走法。
+- 虚拟时钟替换 main 模块中的 time：sleep 只推进虚拟时间，不真正等待。
+- 也可以回放飞行记录仪导出的目录：按记录的识别结果（或配合 --model 对记录的画面重新识别）逐次喂给状态机。
+
+结束后输出吞吐量、走法延迟（虚拟时间）与重置率，便于在改动前后对比。
+
+另有引擎层压测模式 (--engine-bench)：在真实时间中反复向模拟引擎请求走法，统计吞吐量、
+故障检测时间与重置恢复时间；配合 --engine-args 向 mock_engine.py 注入思考时间、崩溃或卡死。
+
+用法:
+  python simulate.py --games 20 --seed 1
+  python simulate.py --games 5 --noise 0.05 --side b --engine-args="--crash-prob 0.02"
+  python simulate.py --bundle resource/flight/bundle-20250101-120000-reset
+  python simulate.py --engine-bench 200 --engine-args="--think-ms 20 --info-rate 50 --hang-after 100"
+"""
+import argparse
+import json
+import os
+import random
+import shlex
+import sys
+import time as _real_time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import numpy as np
+import pygame
+
+import main
+from main import (EMPTY_CELL, START_ROLES, AutoChessPlayer, EngineCommunicationError, MockInjector, board_to_compact,
+                  compact_to_board, generate_legal_moves, apply_compact_move, get_default_settings, logger)
+
+SIM_ROI = {'left': 0, 'top': 0, 'width': 90, 'height': 100}
+INITIAL_CELLS = ''.join(
+    EMPTY_CELL if role == EMPTY_CELL else
+    ('K' if sq >= 45 else 'k') if role == 'K' else
+    ('X' if sq >= 45 else 'x')
+    for sq, role in enumerate(START_ROLES))
+DARK_POOL = {'r': "RRNNBBAACCPPPPP", 'b': "rrnnbbaaccppppp"}
+PIECE_SHADES = "XRNBAKCPxrnbakcp"  # render() 中每种棋子的灰度序号
+
+
+class VirtualClock:
+    """代替 time 模块：sleep 只推进虚拟时间；每次读时间前进1微秒，保证忙等循环也能结束。"""
+    strftime = staticmethod(_real_time.strftime)
+    localtime = staticmethod(_real_time.localtime)
+
+    def __init__(self, start=1_000_000.0):
+        self.now = start
+
+    def time(self):
+        self.now += 1e-6
+        return self.now
+
+    perf_counter = time
+    monotonic = time
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+
+class SimTable:
+    """
+    模拟棋桌。局面以紧凑字符串保存（红方在下）；暗子的真实身份在开局时按种子洗牌分配，
+    翻开时才显示。对局结束（无合法走法或达到步数上限）后显示空白画面，一段时间后开始新的一局。
+    """
+
+    def __init__(self, clock, rng, side='both', games=10, script=None, noise=0.0, noise_hold=0.5,
+                 animation=0.2, opponent_delay=(0.5, 3.0), restart_delay=3.0, max_plies=160, stall_timeout=120.0):
+        self.clock = clock
+        self.rng = rng
+        self.side_mode = side
+        self.target_games = games
+        self.script = list(script or [])
+        self.noise = noise
+        self.noise_hold = noise_hold
+        self.animation = animation
+        self.opponent_delay = opponent_delay
+        self.restart_delay = restart_delay
+        self.max_plies = max_plies
+        self.stall_timeout = stall_timeout
+        self.on_finish_all = None
+
+        self.game_id = 0
+        self.games_done = 0
+        self.results = []
+        self.opponent_moves = 0
+        self.our_moves = 0
+        self._glitch = None  # (结束时间, 格子下标, 观测到的棋子名, 置信度)
+
+    def start(self):
+        """开始第一局。在玩家（含引擎启动）构造完成后调用，使对局时间与启动耗时无关。"""
+        self._new_game(self.side_mode if self.side_mode != 'both' else 'r')
+
+    # --- 对局 ---
+    def _new_game(self, computer_side):
+        self.game_id += 1
+        self.computer_side = computer_side
+        self.opponent_side = 'b' if computer_side == 'r' else 'r'
+        self.cells = INITIAL_CELLS
+        self.hidden = {}
+        for color, upper in (('r', True), ('b', False)):
+            roles = list(DARK_POOL[color])
+            self.rng.shuffle(roles)
+            squares = [sq for sq, p in enumerate(INITIAL_CELLS) if p == ('X' if upper else 'x')]
+            self.hidden.update(zip(squares, roles))
+        self.side_to_move = 'r'
+        self.plies = 0
+        self.selected = None
+        self.finished = False
+        self.finished_at = None
+        self.moved_at = self.clock.now
+        self.last_move = None
+        self.last_opponent_move_time = None
+        self._schedule_opponent()
+
+    def _schedule_opponent(self):
+        self.opponent_due = self.clock.now + self.animation + self.rng.uniform(*self.opponent_delay)
+
+    def _make_move(self, from_sq, to_sq):
+        piece = self.cells[from_sq]
+        if piece in 'Xx':
+            piece = self.hidden.pop(from_sq)
+        self.hidden.pop(to_sq, None)
+        self.cells_before = self.cells
+        self.cells = apply_compact_move(self.cells, from_sq, to_sq, piece)
+        self.last_move = (from_sq, to_sq)
+        self.moved_at = self.clock.now
+        self.plies += 1
+        self.side_to_move = 'b' if self.side_to_move == 'r' else 'r'
+        if self.plies >= self.max_plies:
+            self._finish('draw')
+        elif not generate_legal_moves(self.cells, self.side_to_move):
+            self._finish('win' if self.side_to_move == self.opponent_side else 'loss')
+
+    def _finish(self, result):
+        self.finished = True
+        self.finished_at = self.clock.now
+        self.results.append(result)
+        self.games_done += 1
+
+    def _opponent_move(self):
+        legal = generate_legal_moves(self.cells, self.opponent_side)
+        while self.script:
+            text = self.script.pop(0)
+            move = ((9 - int(text[1])) * 9 + 'abcdefghi'.index(text[0]),
+                    (9 - int(text[3])) * 9 + 'abcdefghi'.index(text[2]))
+            if move in legal:
+                return move
+            logger.warning("[模拟] 脚本走法 %s 在当前局面不合法，改为随机走法。", text)
+        return self.rng.choice(legal)
+
+    def tick(self):
+        """推进棋桌：到时间时让对手走棋、结束后开新局。"""
+        now = self.clock.now
+        if self.finished:
+            if self.games_done >= self.target_games:
+                if self.on_finish_all:
+                    self.on_finish_all()
+            elif now - self.finished_at >= self.restart_delay:
+                nxt = self.computer_side
+                if self.side_mode == 'both':
+                    nxt = 'b' if self.computer_side == 'r' else 'r'
+                self._new_game(nxt)
+            return
+        if self.side_to_move == self.computer_side and now - self.moved_at > self.stall_timeout:
+            # 状态机认为不是自己走棋而一直等待：判负并开始下一局，避免模拟卡死
+            logger.warning("[模拟] 轮到电脑走棋但 %.0f 秒内没有走子，判负。", self.stall_timeout)
+            self._finish('stall')
+            return
+        if self.side_to_move == self.opponent_side and now >= self.opponent_due:
+            self._make_move(*self._opponent_move())
+            self.opponent_moves += 1
+            self.last_opponent_move_time = now + self.animation
+
+    # --- 输入 ---
+    def click(self, x, y):
+        self.tick()
+        col = int((x - SIM_ROI['left']) / (SIM_ROI['width'] / 9))
+        row = int((y - SIM_ROI['top']) / (SIM_ROI['height'] / 10))
+        if self.finished or self.side_to_move != self.computer_side or not (0 <= row < 10 and 0 <= col < 9):
+            self.selected = None
+            return
+        sq = (9 - row) * 9 + (8 - col) if self.computer_side == 'b' else row * 9 + col
+        piece = self.cells[sq]
+        own = piece != EMPTY_CELL and (piece.isupper() == (self.computer_side == 'r'))
+        selected, self.selected = self.selected, None
+        if selected is not None and (selected, sq) in generate_legal_moves(self.cells, self.computer_side):
+            self._make_move(selected, sq)
+            self.our_moves += 1
+            self._schedule_opponent()
+        elif own:
+            self.selected = sq
+
+    # --- 画面 ---
+    def visible_cells(self):
+        """当前画面上可见的局面；走子动画期间起点已空，终点仍显示原来的内容。"""
+        if self.finished:
+            return EMPTY_CELL * 90
+        if self.last_move and self.clock.now - self.moved_at < self.animation:
+            board = list(self.cells_before)
+            board[self.last_move[0]] = EMPTY_CELL
+            return ''.join(board)
+        return self.cells
+
+    def observe(self, noisy=True):
+        """返回 (界面棋盘, 逐格置信度)，与 AutoChessPlayer._capture_single_frame 的输出形式相同。"""
+        self.tick()
+        flipped = self.computer_side == 'b'
+        board = compact_to_board(self.visible_cells(), flipped)
+        scores = [[({board[r][c]: 0.97} if board[r][c] else {}) for c in range(9)] for r in range(10)]
+        if noisy and self.noise > 0:
+            now = self.clock.now
+            if self._glitch and self._glitch[0] <= now:
+                self._glitch = None
+            if self._glitch is None and self.rng.random() < self.noise:
+                occupied = [(r, c) for r in range(10) for c in range(9) if board[r][c]]
+                if occupied:
+                    r, c = self.rng.choice(occupied)
+                    true = board[r][c]
+                    if self.rng.random() < 0.5:
+                        wrong = true[0] + self.rng.choice([k for k in 'RNBACP' if k != true[1]])
+                        self._glitch = (now + self.noise_hold, (r, c), wrong, 0.93)
+                    else:
+                        self._glitch = (now + self.noise_hold, (r, c), true, 0.5)
+            if self._glitch:
+                _, (r, c), name, conf = self._glitch
+                if board[r][c]:
+                    scores[r][c] = {board[r][c]: 0.6 if name != board[r][c] else conf}
+                    scores[r][c][name] = conf
+                    board[r][c] = name if conf > 0.9 else ''
+        return board, scores
+
+    def render(self):
+        """生成ROI大小的画面：每种棋子画成不同灰度的格子，选中的格子画成白色高亮，
+        供点击确认门与自适应识别调度的像素差分使用。"""
+        img = np.full((SIM_ROI['height'], SIM_ROI['width'], 3), 30, dtype=np.uint8)
+        h, w = SIM_ROI['height'] // 10, SIM_ROI['width'] // 9
+        flipped = self.computer_side == 'b'
+        for sq, piece in enumerate(self.visible_cells()):
+            r, c = divmod(sq, 9)
+            if flipped:
+                r, c = 9 - r, 8 - c
+            if sq == self.selected:
+                img[r * h:(r + 1) * h, c * w:(c + 1) * w] = 255
+            elif piece != EMPTY_CELL:
+                img[r * h:(r + 1) * h, c * w:(c + 1) * w] = 40 + 7 * PIECE_SHADES.index(piece)
+        return img
+
+
+class NullDisplay:
+    """无界面的显示替身：接口与 BoardDisplay 相同，不绘制任何内容。"""
+
+    def __init__(self):
+        pygame.init()
+        pygame.display.set_mode((1, 1))
+        self.settings_button_rect = pygame.Rect(-10, -10, 1, 1)
+        self.connect_button_rect = pygame.Rect(-10, -10, 1, 1)
+
+    def update_engine_info(self, depth, score, score_type):
+        pass
+
+    def draw_captured_board(self, board_state, dark_piece_library, is_running):
+        pass
+
+    def handle_dark_piece_library_click(self, pos, dark_pieces):
+        return False
+
+
+class SimulatedPlayer(AutoChessPlayer):
+    """把屏幕识别、显示与输入替换为模拟棋桌的 AutoChessPlayer，状态机本身不变。"""
+
+    def __init__(self, table, settings, clock):
+        self.table = table
+        self.clock = clock
+        self.stats = {'opponent_latency': [], 'our_latency': [], 'desyncs': 0,
+                      'resets_expected': 0, 'resets_unexpected': 0}
+        self._game_id_at_start = None
+        self._move_started = None
+        super().__init__(SIM_ROI, settings)
+        self.injector = MockInjector(on_click=table.click)
+
+    def _load_model(self):
+        self.yolo_model = None
+        self.piece_names = {}
+
+    def _create_display(self):
+        return NullDisplay()
+
+    def read_engine_output(self, timeout=0.1):
+        line = super().read_engine_output(timeout)
+        if not line and self.clock is not None:
+            self.clock.sleep(timeout)  # 等待引擎的真实时间同样计入虚拟时间，使超时逻辑照常生效
+        return line
+
+    def _grab_roi(self, stage='capture'):
+        self.table.tick()
+        return self.table.render()
+
+    def _capture_single_frame(self):
+        self.metrics.count('scans')
+        board, self.last_cell_scores = self.table.observe()
+        self.last_frame = self.table.render()
+        return board
+
+    def _recognize_cells(self, positions):
+        board, _ = self.table.observe()
+        return {(r, c): board[r][c] for r, c in positions}
+
+    def update_library_from_board(self, board_state):
+        self._game_id_at_start = self.table.game_id
+        super().update_library_from_board(board_state)
+
+    def perform_move_on_screen(self, uci_move):
+        self._move_started = self.clock.now
+        super().perform_move_on_screen(uci_move)
+
+    def _record_position(self, board_state):
+        super()._record_position(board_state)
+        now = self.clock.now
+        if self.current_player == self.computer_side and self.table.last_opponent_move_time is not None:
+            self.stats['opponent_latency'].append(now - self.table.last_opponent_move_time)
+            self.table.last_opponent_move_time = None
+        elif self.current_player != self.computer_side and self._move_started is not None:
+            self.stats['our_latency'].append(now - self._move_started)
+            self._move_started = None
+        # 与棋桌的真实局面对比（动画期间除外），发现状态机与画面脱节
+        if (self.table.game_id == self._game_id_at_start and not self.table.finished
+                and board_to_compact(board_state, self.computer_side == 'b') != self.table.visible_cells()):
+            self.stats['desyncs'] += 1
+
+    def reset_game(self, reason=None):
+        if self.last_board_state is not None:
+            if self.table.finished or self.table.game_id != self._game_id_at_start:
+                self.stats['resets_expected'] += 1
+            else:
+                self.stats['resets_unexpected'] += 1
+        super().reset_game(reason)
+
+
+class ReplayPlayer(SimulatedPlayer):
+    """
+    回放飞行记录：把导出目录中按时间排列的识别结果逐次作为一次识别返回；
+    指定了模型时改为对记录的画面重新识别。点击只被记录，不影响回放内容。
+    """
+
+    def __init__(self, bundle, settings, clock, use_model=False):
+        with open(os.path.join(bundle, 'events.jsonl'), encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        self.use_model = use_model
+        kind = 'frame' if use_model else 'board'
+        self.items = [os.path.join(bundle, r['payload']) if use_model else r['payload']
+                      for r in records if r['kind'] == kind]
+        self.position = 0
+        self.current = None
+        self.all_moves = []
+        table = SimTable(clock, random.Random(0), games=1 << 30)
+        super().__init__(table, settings, clock)
+        self.injector = MockInjector()
+
+    def _load_model(self):
+        if self.use_model:
+            AutoChessPlayer._load_model(self)
+        else:
+            SimulatedPlayer._load_model(self)
+
+    def _next(self):
+        if self.position >= len(self.items):
+            self.game_over = True
+            return self.current
+        item = self.items[self.position]
+        self.position += 1
+        if self.use_model:
+            import cv2
+            self.current = cv2.imread(item)
+        else:
+            self.current = [[row[i:i + 2] if row[i:i + 2] != '..' else '' for i in range(0, 18, 2)] for row in item]
+        return self.current
+
+    def _grab_roi(self, stage='capture'):
+        if self.use_model:
+            return self._next()
+        return self.table.render()
+
+    def _capture_single_frame(self):
+        if self.use_model:
+            return AutoChessPlayer._capture_single_frame(self)
+        self.metrics.count('scans')
+        board = self._next() or self.create_empty_board()
+        self.last_cell_scores = [[({p: 0.97} if p else {}) for p in row] for row in board]
+        return board
+
+    def _recognize_cells(self, positions):
+        if self.use_model:
+            return AutoChessPlayer._recognize_cells(self, positions)
+        board = self.current or self.create_empty_board()
+        return {(r, c): board[r][c] for r, c in positions}
+
+    def _record_position(self, board_state):
+        AutoChessPlayer._record_position(self, board_state)
+        if self.move_notations:
+            self.all_moves.append(self.move_notations[-1])
+
+    def reset_game(self, reason=None):
+        if self.last_board_state is not None:
+            self.stats['resets_unexpected'] += 1
+        AutoChessPlayer.reset_game(self, reason)
+
+
+def summarize(values):
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {'count': len(ordered), 'mean_s': round(sum(ordered) / len(ordered), 3),
+            'p50_s': round(pick(0.5), 3), 'p95_s': round(pick(0.95), 3), 'max_s': round(ordered[-1], 3)}
+
+
+def engine_bench(player, iterations):
+    """
+    引擎层压测：在开局局面上反复调用 get_engine_move（真实时间）。
+    出错时与主循环一样调用 reset_game 重启引擎，分别统计故障检测耗时与恢复耗时。
+    """
+    board = compact_to_board(INITIAL_CELLS)
+    latencies, detections, recoveries = [], [], []
+    failures = {}
+    start = _real_time.perf_counter()
+    for _ in range(iterations):
+        player.computer_side, player.current_player = 'r', 'r'
+        player.last_board_state = [row[:] for row in board]
+        t0 = _real_time.perf_counter()
+        try:
+            player.get_engine_move()
+            latencies.append(_real_time.perf_counter() - t0)
+        except EngineCommunicationError as e:
+            t1 = _real_time.perf_counter()
+            detections.append(t1 - t0)
+            failures[str(e)] = failures.get(str(e), 0) + 1
+            player.reset_game("engine")
+            recoveries.append(_real_time.perf_counter() - t1)
+            if player.game_over:
+                break
+    elapsed = _real_time.perf_counter() - start
+    return {
+        'requests': iterations,
+        'moves': len(latencies),
+        'wall_seconds': round(elapsed, 2),
+        'moves_per_second': round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+        'move_latency': summarize(latencies),
+        'failure_detect': summarize(detections),
+        'recovery': summarize(recoveries),
+        'failures': failures,
+        'engine_restarts': player.metrics.counters.get('engine_restarts', 0),
+    }
+
+
+def build_settings(args):
+    settings = get_default_settings()
+    settings.update({
+        'engine_path': [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mock_engine.py'),
+                        '--seed', str(args.seed)] + shlex.split(args.engine_args or ''),
+        'input_backend': 'mock',
+        'flight_recorder': 0,
+        'metrics_interval': 0,
+        'metrics_dir': os.path.join('resource', 'metrics', 'sim'),
+        'engine_think_time': args.movetime,
+        'adaptive_scan': 0 if args.fixed_scan else 1,
+    })
+    if args.model:
+        settings['model_path'] = args.model
+    return settings
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='揭棋连线模拟器：在虚拟时间中运行完整状态机')
+    parser.add_argument('--games', type=int, default=10, help='模拟对局数')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子（棋桌、对手与模拟引擎）')
+    parser.add_argument('--side', choices=['r', 'b', 'both'], default='both', help='电脑执红/执黑/交替')
+    parser.add_argument('--noise', type=float, default=0.0, help='每次识别开始一处识别错误的概率')
+    parser.add_argument('--noise-hold', type=float, default=0.5, help='每处识别错误持续的虚拟秒数')
+    parser.add_argument('--animation', type=float, default=0.2, help='走子动画的虚拟秒数')
+    parser.add_argument('--max-plies', type=int, default=160, help='每局步数上限，达到后判和')
+    parser.add_argument('--max-seconds', type=float, default=24 * 3600, help='虚拟时间上限')
+    parser.add_argument('--script', help='对手走法脚本：每行一个引擎坐标走法，用完后随机走棋')
+    parser.add_argument('--bundle', help='回放飞行记录仪导出的目录')
+    parser.add_argument('--model', help='回放时对记录的画面使用此模型重新识别')
+    parser.add_argument('--output', help='把结果写入此JSON文件')
+    parser.add_argument('--log-dir', help='写入调试日志与事故日志的目录（默认不写文件）')
+    parser.add_argument('--engine-args', help='传给 mock_engine.py 的额外参数，例如 --engine-args="--think-ms 50"')
+    parser.add_argument('--movetime', type=int, default=0, help='go movetime 的毫秒数')
+    parser.add_argument('--fixed-scan', action='store_true', help='对手回合使用固定识别间隔，用于与自适应调度对比')
+    parser.add_argument('--engine-bench', type=int, default=0, help='引擎层压测的请求次数（真实时间）')
+    args = parser.parse_args()
+
+    if args.engine_bench:
+        logger.configure(log_dir=args.log_dir, file_level='DEBUG', console=False)
+        table = SimTable(VirtualClock(), random.Random(args.seed))
+        table.start()
+        player = SimulatedPlayer(table, build_settings(args), None)
+        report = engine_bench(player, args.engine_bench)
+        text = json.dumps(report, indent=2, ensure_ascii=False)
+        print(text)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text + '\n')
+        player.send_engine_command("quit")
+        logger.close()
+        return
+
+    clock = VirtualClock()
+    main.time = clock
+    if args.log_dir:
+        logger.configure(log_dir=args.log_dir, file_level='DEBUG', console=False)
+    else:
+        logger.configure(console=False)
+
+    settings = build_settings(args)
+    script = None
+    if args.script:
+        with open(args.script, encoding='utf-8') as f:
+            script = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+    wall_start = _real_time.perf_counter()
+    if args.bundle:
+        player = ReplayPlayer(args.bundle, settings, clock, use_model=bool(args.model))
+    else:
+        rng = random.Random(args.seed)
+        table = SimTable(clock, rng, side=args.side, games=args.games, script=script, noise=args.noise,
+                         noise_hold=args.noise_hold, animation=args.animation, max_plies=args.max_plies)
+        player = SimulatedPlayer(table, settings, clock)
+        table.on_finish_all = lambda: setattr(player, 'game_over', True)
+
+    deadline = clock.now + args.max_seconds
+    original_tick = player.table.tick
+
+    def tick_with_deadline():
+        if clock.now > deadline:
+            player.game_over = True
+        original_tick()
+    player.table.tick = tick_with_deadline
+
+    player.table.start()
+    player.is_running = True
+    player.reset_game()
+    virtual_start = clock.now
+    player.run()
+    wall = _real_time.perf_counter() - wall_start
+    virtual = clock.now - virtual_start
+
+    table = player.table
+    games = max(table.games_done, 1)
+    report = {
+        'games': table.games_done,
+        'results': {k: table.results.count(k) for k in ('win', 'loss', 'draw', 'stall')},
+        'our_moves': table.our_moves,
+        'opponent_moves': table.opponent_moves,
+        'wall_seconds': round(wall, 2),
+        'virtual_seconds': round(virtual, 1),
+        'games_per_wall_minute': round(table.games_done / wall * 60, 2) if wall > 0 else None,
+        'opponent_detect_latency': summarize(player.stats['opponent_latency']),
+        'our_move_latency': summarize(player.stats['our_latency']),
+        'desyncs': player.stats['desyncs'],
+        'resets_expected': player.stats['resets_expected'],
+        'resets_unexpected': player.stats['resets_unexpected'],
+        'unexpected_resets_per_game': round(player.stats['resets_unexpected'] / games, 3),
+        'counters': dict(player.metrics.counters),
+    }
+    if args.bundle:
+        report = {k: report[k] for k in ('wall_seconds', 'virtual_seconds', 'resets_unexpected', 'counters')}
+        report['replayed'] = player.position
+        report['moves'] = player.all_moves
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    logger.close()
+
+
+if __name__ == '__main__':
+    main_cli()
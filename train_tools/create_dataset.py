@@ -1,12 +1,16 @@
 # encoding: utf-8
+import argparse  # 导入命令行参数解析模块
+import multiprocessing  # 导入多进程模块，用于并行生成图片
 import os  # 导入操作系统接口模块，用于文件和目录操作
 import random  # 导入随机数生成模块，用于随机选择和打乱数据
+import numpy as np  # 导入NumPy，用于向量化的alpha混合
 from PIL import Image  # 从PIL库导入Image模块，用于图像处理
-from PIL import ImageEnhance
 import shutil  # 导入shutil模块，用于高级文件操作
 
 PIECES_DIR = "pieces"  # 定义棋子图片存放目录
 PIECES_DIR_SECOND = "NewPieces"
+SPRITE_BANK_DIR = "sprites"  # ingest_skin.py 生成的已解码棋子素材库（.npz），目录不存在时忽略
+BANK_SEPARATOR = "#"  # 素材库中的棋子路径形如 sprites/tiantian.npz#rP_1
 BOARD_DIR = "board"  # 定义棋盘图片存放目录
 OUTPUT_DIR = "datasets"  # 定义输出数据集目录
 BOARD_WIDTH, BOARD_HEIGHT = 628, 693  # 定义棋盘图片的宽度和高度（像素）
@@ -16,6 +20,7 @@ NUM_ROWS = 10  # 定义棋盘行数（象棋棋盘为10行）
 
 NUM_TRAIN_IMAGES = 2500  # 定义训练集图片数量
 NUM_VAL_IMAGES = 500  # 定义验证集图片数量
+DEFAULT_SEED = 0  # 默认随机种子：每张图片的种子由 (种子, 划分, 序号) 决定，与进程数无关
 
 piece_types = ['P', 'R', 'K', 'N', 'C', 'A', 'B', 'X']  # 定义棋子类型列表：兵、车、将、马、炮、仕、相、无棋子
 colors = ['r', 'b']  # 定义棋子颜色列表：红色、黑色
@@ -51,142 +56,234 @@ def yolo_format(class_id, center_x, center_y, width, height, image_width, image_
     h = height / image_height  # 将高度归一化到[0,1]范围
     return f"{class_id} {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n"  # 返回YOLO格式的标注字符串
 
-def create_dataset():  # 定义主函数：创建数据集
+def list_board_files():  # 定义函数：获取所有棋盘图片文件路径（排序保证顺序一致）
+    return sorted(os.path.join(BOARD_DIR, f) for f in os.listdir(BOARD_DIR) if f.endswith('.png'))
 
-    if os.path.exists(OUTPUT_DIR):  # 检查输出目录是否存在
-        shutil.rmtree(OUTPUT_DIR)  # 如果存在则删除整个目录（清理旧数据）
-    for split in ['train', 'val']:  # 遍历数据集划分（训练集和验证集）
-        os.makedirs(os.path.join(OUTPUT_DIR, 'images', split), exist_ok=True)  # 创建图片存放目录
-        os.makedirs(os.path.join(OUTPUT_DIR, 'labels', split), exist_ok=True)  # 创建标签存放目录
-    board_files = [os.path.join(BOARD_DIR, f) for f in os.listdir(BOARD_DIR) if f.endswith('.png')]  # 获取所有棋盘图片文件路径
-    
-    # 从两个目录获取棋子文件
-    piece_files_dir1 = [f for f in os.listdir(PIECES_DIR) if f.endswith('.png')]  # 获取第一个目录的棋子
-    piece_files_dir2 = [f for f in os.listdir(PIECES_DIR_SECOND) if f.endswith('.png')]  # 获取第二个目录的棋子
-    
-    print(f"从 {PIECES_DIR} 目录加载 {len(piece_files_dir1)} 个棋子文件")
-    print(f"从 {PIECES_DIR_SECOND} 目录加载 {len(piece_files_dir2)} 个棋子文件")
-    
+def load_piece_info():  # 定义函数：从两个棋子目录收集每个类别的图片路径
     piece_info = {}  # 初始化棋子信息字典
-    
-    # 处理第一个目录的棋子文件
-    for f in piece_files_dir1:  # 遍历第一个目录的每个棋子文件
-        color = f[0]  # 从文件名提取颜色信息（第一个字符）
-        piece_type = f[1]  # 从文件名提取棋子类型信息（第二个字符）
-        class_name = f"{color}{piece_type}"  # 组合生成类别名称
-        if class_name in piece_info:  # 如果该类别已存在
-            piece_info[class_name].append(os.path.join(PIECES_DIR, f))  # 将文件路径添加到现有列表
-        else:  # 如果该类别不存在
-            piece_info[class_name] = [os.path.join(PIECES_DIR, f)]  # 创建新的类别列表
-    
-    # 处理第二个目录的棋子文件
-    for f in piece_files_dir2:  # 遍历第二个目录的每个棋子文件
-        color = f[0]  # 从文件名提取颜色信息（第一个字符）
-        piece_type = f[1]  # 从文件名提取棋子类型信息（第二个字符）
-        class_name = f"{color}{piece_type}"  # 组合生成类别名称
-        if class_name in piece_info:  # 如果该类别已存在
-            piece_info[class_name].append(os.path.join(PIECES_DIR_SECOND, f))  # 将文件路径添加到现有列表
-        else:  # 如果该类别不存在
-            piece_info[class_name] = [os.path.join(PIECES_DIR_SECOND, f)]  # 创建新的类别列表
-    
+    for pieces_dir in (PIECES_DIR, PIECES_DIR_SECOND):  # 遍历两个棋子目录
+        piece_files = sorted(f for f in os.listdir(pieces_dir) if f.endswith('.png'))  # 排序保证不同机器上顺序一致
+        print(f"从 {pieces_dir} 目录加载 {len(piece_files)} 个棋子文件")
+        for f in piece_files:  # 遍历每个棋子文件
+            class_name = f[:2]  # 从文件名提取类别名称（颜色+棋子类型）
+            piece_info.setdefault(class_name, []).append(os.path.join(pieces_dir, f))  # 将文件路径添加到该类别列表
+    if os.path.isdir(SPRITE_BANK_DIR):
+        for bank_file in sorted(f for f in os.listdir(SPRITE_BANK_DIR) if f.endswith('.npz')):
+            bank_path = os.path.join(SPRITE_BANK_DIR, bank_file)
+            with np.load(bank_path) as archive:  # 只读取目录，不解压数组
+                keys = sorted(archive.files)
+            print(f"从 {bank_path} 加载 {len(keys)} 个棋子")
+            for key in keys:  # 键名形如 rP_1，下划线前为类别名称
+                piece_info.setdefault(key.split('_')[0], []).append(f"{bank_path}{BANK_SEPARATOR}{key}")
+    return piece_info  # 返回类别到图片路径列表的映射
+
+def load_sprites(paths):  # 定义函数：把棋子路径解码为RGBA数组
+    """PNG 路径直接解码；素材库路径（bank.npz#key）从已解码的数组中读取，每个素材库只打开一次。"""
+    sprites, archives = {}, {}
+    for path in paths:
+        if BANK_SEPARATOR in path:
+            bank_path, key = path.split(BANK_SEPARATOR, 1)
+            if bank_path not in archives:
+                archives[bank_path] = np.load(bank_path)
+            sprites[path] = archives[bank_path][key]
+        else:
+            sprites[path] = np.asarray(Image.open(path).convert("RGBA"))
+    for archive in archives.values():
+        archive.close()
+    return sprites
+
+class SpriteBank:
+    """
+    解码一次的素材库：棋盘与棋子PNG在构造时解码为NumPy数组，之后不再读盘（sprites/*.npz 中的棋子已是数组，直接读取）。
+    棋子按 (路径, 尺寸) 缓存LANCZOS缩放后的预乘alpha变体，亮度调整在混合时按系数计算，不再逐次生成新图片。
+    在主进程中构造后传给工作进程，每个进程各自积累缩放变体缓存。
+    """
+
+    def __init__(self, board_files, piece_info):
+        self.board_files = board_files
+        self.piece_info = piece_info
+        self.class_names = list(piece_info.keys())
+        self.boards = {path: np.asarray(Image.open(path).convert("RGB")) for path in board_files}
+        self.sprites = load_sprites(path for paths in piece_info.values() for path in paths)
+        self._variants = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_variants'] = {}  # 缩放变体在各工作进程内按需生成，不随进程间传递
+        return state
+
+    def variant(self, path, size=None):
+        """返回棋子缩放到 size x size 后的 (预乘RGB, alpha)，size 为 None 表示原尺寸。"""
+        key = (path, size)
+        cached = self._variants.get(key)
+        if cached is None:
+            rgba = self.sprites[path]
+            if size is not None:
+                rgba = np.asarray(Image.fromarray(rgba).resize((size, size), Image.LANCZOS))
+            alpha = rgba[:, :, 3:].astype(np.float32) / 255
+            cached = (rgba[:, :, :3].astype(np.float32) * alpha, alpha)
+            self._variants[key] = cached
+        return cached
+
+def blend(canvas, premultiplied, alpha, left, top, brightness=1.0):
+    """
+    把预乘alpha的棋子就地混合到 canvas (H, W, 3, uint8) 的 (left, top) 处，超出画布的部分裁掉，
+    只有棋子覆盖的区域参与浮点运算。brightness 与 ImageEnhance.Brightness 一致：只缩放颜色，保留alpha。
+    """
+    h, w = alpha.shape[:2]
+    x0, y0 = max(left, 0), max(top, 0)
+    x1, y1 = min(left + w, canvas.shape[1]), min(top + h, canvas.shape[0])
+    if x0 >= x1 or y0 >= y1:
+        return
+    sy, sx = slice(y0 - top, y1 - top), slice(x0 - left, x1 - left)
+    region = canvas[y0:y1, x0:x1].astype(np.float32)
+    region *= 1 - alpha[sy, sx]
+    region += premultiplied[sy, sx] * brightness
+    region += 0.5  # 四舍五入
+    canvas[y0:y1, x0:x1] = region
+
+def render_sample(rng, bank, grid_coords):  # 定义函数：用给定的随机数生成器合成一张图片，返回 (RGB数组, YOLO标签行)
+    board_path = rng.choice(bank.board_files)  # 随机选择一个棋盘图片
+    canvas = bank.boards[board_path].copy()  # 复制已解码的棋盘作为画布
+    board_img_height, board_img_width = canvas.shape[:2]
+    num_pieces_to_place = rng.randint(15, 40)  # 随机决定要放置的棋子数量（15-40个）
+    placement_positions = rng.sample(grid_coords, num_pieces_to_place)  # 随机选择N个位置作为棋子放置位置
+
+    yolo_labels = []  # 初始化YOLO标签列表
+
+    # 添加棋盘区域标注
+    board_filename = os.path.basename(board_path)
+    if board_filename in BOARD_REGIONS:
+        x1, y1, x2, y2 = BOARD_REGIONS[board_filename]
+        board_center_x = (x1 + x2) // 2
+        board_center_y = (y1 + y2) // 2
+        board_width = x2 - x1
+        board_height = y2 - y1
+        board_class_id = CLASS_MAP['board']
+        board_label = yolo_format(board_class_id, board_center_x, board_center_y, board_width, board_height, board_img_width, board_img_height)
+        yolo_labels.append(board_label)
+
+    for pos in placement_positions:  # 遍历每个棋子放置位置
+        class_name = rng.choice(bank.class_names)  # 随机选择一种棋子类型
+        piece_path = rng.choice(bank.piece_info[class_name])  # 从该类型中随机选择一个棋子图片
+        center_x, center_y = pos  # 获取棋子放置的中心坐标
+
+        size = None  # 默认保持原尺寸
+        if rng.random() < 0.7:
+            size = rng.randint(18, 40)
+        elif board_img_height < BOARD_HEIGHT:
+            #如果board_img的高度小于BOARD_HEIGHT，则棋子缩放成47*47
+            size = 47
+        premultiplied, alpha = bank.variant(piece_path, size)  # 取缓存的缩放变体
+        piece_height, piece_width = alpha.shape[:2]
+
+        brightness = 1.0
+        if rng.random() < 0.5:
+            # 降低棋子亮度
+            brightness = rng.uniform(0.4, 0.7)  # 随机选择亮度因子，0.4-0.7之间
+
+        top_left_x = center_x - piece_width // 2  # 计算棋子左上角x坐标
+        top_left_y = center_y - piece_height // 2  # 计算棋子左上角y坐标
+        if top_left_y + piece_height > board_img_height:
+            continue
+        if top_left_x + piece_width > board_img_width:
+            continue
+        blend(canvas, premultiplied, alpha, top_left_x, top_left_y, brightness)  # 将棋子混合到棋盘上
+
+        #如果class_name不在CLASS_NAMES中，则跳过
+        if class_name not in CLASS_NAMES:
+            continue
+
+        #生成标注
+        class_id = CLASS_MAP[class_name]  # 获取类别ID
+        label_str = yolo_format(class_id, center_x, center_y, piece_width, piece_height, board_img_width, board_img_height)  # 生成YOLO格式标注
+        yolo_labels.append(label_str)  # 将标注添加到标签列表
+
+    return canvas, yolo_labels  # 返回RGB图片数组与标签
+
+_worker_state = {}  # 每个工作进程的只读数据（素材库、网格坐标与输出目录）
+
+def _init_worker(bank, grid_coords, output_dir, seed):  # 工作进程初始化：只传一次公共数据
+    _worker_state.update(bank=bank, grid_coords=grid_coords, output_dir=output_dir, seed=seed)
+
+def _generate_one(task):  # 定义函数：生成并保存一张图片，task 为 (划分, 序号)
+    split, i = task
+    state = _worker_state
+    rng = random.Random(f"{state['seed']}:{split}:{i}")  # 每张图片独立的确定性种子，结果与进程数和调度顺序无关
+    canvas, yolo_labels = render_sample(rng, state['bank'], state['grid_coords'])
+    img_path = os.path.join(state['output_dir'], 'images', split, f"{split}_{i}.jpg")  # 构建图片保存路径
+    label_path = os.path.join(state['output_dir'], 'labels', split, f"{split}_{i}.txt")  # 构建标签保存路径
+    Image.fromarray(canvas).save(img_path)  # 保存生成的图片
+    with open(label_path, 'w') as f:  # 打开标签文件进行写入
+        f.writelines(yolo_labels)  # 写入所有YOLO标签
+    return split
+
+def create_dataset(num_train=NUM_TRAIN_IMAGES, num_val=NUM_VAL_IMAGES, seed=DEFAULT_SEED, workers=0, output_dir=OUTPUT_DIR):  # 定义主函数：创建数据集
+    """
+    并行生成数据集。workers 为 0 时使用全部CPU核心，为 1 时在当前进程内串行生成。
+    相同的 seed 与数量在任意进程数下生成完全相同的图片与标签。
+    """
+    if os.path.exists(output_dir):  # 检查输出目录是否存在
+        shutil.rmtree(output_dir)  # 如果存在则删除整个目录（清理旧数据）
+    for split in ['train', 'val']:  # 遍历数据集划分（训练集和验证集）
+        os.makedirs(os.path.join(output_dir, 'images', split), exist_ok=True)  # 创建图片存放目录
+        os.makedirs(os.path.join(output_dir, 'labels', split), exist_ok=True)  # 创建标签存放目录
+    board_files = list_board_files()  # 获取所有棋盘图片文件路径
+
+    piece_info = load_piece_info()  # 收集各类别的棋子图片
+
     # 显示每个棋子类型的可用选项数量
     print("\n各棋子类型的可用选项数量：")
     for class_name, paths in piece_info.items():
         print(f"  {class_name}: {len(paths)} 个选项")
-    
+
     grid_coords = get_grid_coordinates(BOARD_WIDTH, BOARD_HEIGHT, NUM_COLS, NUM_ROWS)  # 获取棋盘所有网格坐标点
 
-    for split in ['train', 'val']:  # 遍历数据集划分
-        num_images = NUM_TRAIN_IMAGES if split == 'train' else NUM_VAL_IMAGES  # 根据划分类型确定生成图片数量
-        print(f"--- Generating {split} data ---")  # 打印当前生成的数据集类型
-
-        for i in range(num_images):  # 遍历生成每张图片
-            board_path = random.choice(board_files)  # 随机选择一个棋盘图片
-            board_img = Image.open(board_path).convert("RGBA")  # 打开棋盘图片并转换为RGBA格式
-            num_pieces_to_place = random.randint(15, 40)  # 随机决定要放置的棋子数量（5-32个）
-            random.shuffle(grid_coords)  # 随机打乱网格坐标顺序
-            placement_positions = grid_coords[:num_pieces_to_place]  # 选择前N个位置作为棋子放置位置
-            
-            yolo_labels = []  # 初始化YOLO标签列表
-            
-            # 添加棋盘区域标注
-            board_filename = os.path.basename(board_path)
-            if board_filename in BOARD_REGIONS:
-                x1, y1, x2, y2 = BOARD_REGIONS[board_filename]
-                board_center_x = (x1 + x2) // 2
-                board_center_y = (y1 + y2) // 2
-                board_width = x2 - x1
-                board_height = y2 - y1
-                board_class_id = CLASS_MAP['board']
-                board_label = yolo_format(board_class_id, board_center_x, board_center_y, board_width, board_height, board_img.width, board_img.height)
-                yolo_labels.append(board_label)
-
-            for pos in placement_positions:  # 遍历每个棋子放置位置
-                class_name = random.choice(list(piece_info.keys()))  # 随机选择一种棋子类型
-                piece_path = random.choice(piece_info[class_name])  # 从该类型中随机选择一个棋子图片
-                piece_img = Image.open(piece_path).convert("RGBA")  # 打开棋子图片并转换为RGBA格式
-                center_x, center_y = pos  # 获取棋子放置的中心坐标
-
-                if random.random() < 0.7:
-                    pSize = random.randint(18, 40)
-                    piece_img = piece_img.resize((pSize, pSize), Image.LANCZOS)
-                else:
-                    #如果board_img的高度小于BOARD_HEIGHT，则棋子缩放成47*47
-                    if board_img.height < BOARD_HEIGHT:
-                        piece_img = piece_img.resize((47, 47), Image.LANCZOS)
-                            
-                if random.random() < 0.5:
-                    # piece_img 降低图片亮度
-                    enhancer = ImageEnhance.Brightness(piece_img)
-                    brightness_factor = random.uniform(0.4, 0.7)  # 随机选择亮度因子，0.3-0.8之间
-                    piece_img = enhancer.enhance(brightness_factor)
-
-                top_left_x = center_x - piece_img.width // 2  # 计算棋子左上角x坐标
-                top_left_y = center_y - piece_img.height // 2  # 计算棋子左上角y坐标
-                #如果board_img的高度小于BOARD_HEIGHT，则棋子缩放成47*47
-                if top_left_y + piece_img.height > board_img.height:
-                    continue
-                if top_left_x + piece_img.width > board_img.width:
-                    continue
-                board_img.paste(piece_img, (top_left_x, top_left_y), piece_img)  # 将棋子粘贴到棋盘上
-                
-                #如果class_name不在CLASS_NAMES中，则跳过
-                if class_name not in CLASS_NAMES:
-                    continue
-
-                #生成标注
-                class_id = CLASS_MAP[class_name]  # 获取类别ID
-                label_str = yolo_format(class_id, center_x, center_y, piece_img.width, piece_img.height, board_img.width, board_img.height)  # 生成YOLO格式标注
-                yolo_labels.append(label_str)  # 将标注添加到标签列表
-
-            final_image = board_img.convert('RGB')  # 将最终图片转换为RGB格式
-            img_filename = f"{split}_{i}.jpg"  # 生成图片文件名
-            label_filename = f"{split}_{i}.txt"  # 生成标签文件名
-
-            img_path = os.path.join(OUTPUT_DIR, 'images', split, img_filename)  # 构建图片保存路径
-            label_path = os.path.join(OUTPUT_DIR, 'labels', split, label_filename)  # 构建标签保存路径
-
-            final_image.save(img_path)  # 保存生成的图片
-            with open(label_path, 'w') as f:  # 打开标签文件进行写入
-                f.writelines(yolo_labels)  # 写入所有YOLO标签
-            
-            if (i + 1) % 100 == 0:  # 每生成100张图片
-                print(f"Generated {i + 1}/{num_images} images for {split} set.")  # 打印进度信息
+    counts = {'train': num_train, 'val': num_val}  # 每个划分要生成的图片数量
+    tasks = [(split, i) for split in ['train', 'val'] for i in range(counts[split])]  # 全部生成任务
+    workers = workers or os.cpu_count() or 1  # 0 表示使用全部核心
+    bank = SpriteBank(board_files, piece_info)  # 所有素材只解码一次
+    initargs = (bank, grid_coords, output_dir, seed)
+    print(f"--- Generating {num_train} train + {num_val} val images with {workers} worker(s), seed={seed} ---")
+
+    done = {'train': 0, 'val': 0}  # 各划分已完成的数量
+    def report(split):  # 汇总进度：每个划分每完成100张打印一次
+        done[split] += 1
+        if done[split] % 100 == 0 or done[split] == counts[split]:
+            print(f"Generated {done[split]}/{counts[split]} images for {split} set.")
+
+    if workers == 1:
+        _init_worker(*initargs)
+        for task in tasks:
+            report(_generate_one(task))
+    else:
+        chunksize = max(1, min(16, len(tasks) // (workers * 4)))  # 小块分发，兼顾负载均衡与进程间通信开销
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+            for split in pool.imap_unordered(_generate_one, tasks, chunksize=chunksize):
+                report(split)
 
     print("--- Dataset generation complete! ---")  # 打印数据集生成完成信息
     print(f"Class map: {CLASS_MAP}")  # 打印类别映射字典
 
-def mkview():
-    os.makedirs(os.path.join(OUTPUT_DIR, 'test'), exist_ok=True)
+def mkview(output_dir=OUTPUT_DIR):
+    os.makedirs(os.path.join(output_dir, 'test'), exist_ok=True)
     #将val的图片和标签都复制到test目录
-    for img in os.listdir(os.path.join(OUTPUT_DIR, 'images', 'val')):
-        shutil.copy(os.path.join(OUTPUT_DIR, 'images', 'val', img), os.path.join(OUTPUT_DIR, 'test', img))
-    for label in os.listdir(os.path.join(OUTPUT_DIR, 'labels', 'val')):
-        shutil.copy(os.path.join(OUTPUT_DIR, 'labels', 'val', label), os.path.join(OUTPUT_DIR, 'test', label))
+    for img in os.listdir(os.path.join(output_dir, 'images', 'val')):
+        shutil.copy(os.path.join(output_dir, 'images', 'val', img), os.path.join(output_dir, 'test', img))
+    for label in os.listdir(os.path.join(output_dir, 'labels', 'val')):
+        shutil.copy(os.path.join(output_dir, 'labels', 'val', label), os.path.join(output_dir, 'test', label))
 
-    shutil.copy('classes.txt', os.path.join(OUTPUT_DIR, 'test', 'classes.txt'))
+    shutil.copy('classes.txt', os.path.join(output_dir, 'test', 'classes.txt'))
 
 
 if __name__ == '__main__':  # 判断是否为主程序入口
-    create_dataset()  # 调用数据集创建函数
-    mkview()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='生成揭棋棋子检测的合成数据集')
+    parser.add_argument('--train', type=int, default=NUM_TRAIN_IMAGES, help='训练集图片数量')
+    parser.add_argument('--val', type=int, default=NUM_VAL_IMAGES, help='验证集图片数量')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='随机种子，相同种子在任意进程数下结果相同')
+    parser.add_argument('--workers', type=int, default=0, help='并行进程数，0 表示使用全部CPU核心')
+    parser.add_argument('--output', default=OUTPUT_DIR, help='输出目录')
+    args = parser.parse_args()
+
+    create_dataset(args.train, args.val, args.seed, args.workers, args.output)  # 调用数据集创建函数
+    mkview(args.output)
\ No newline at end of file
@@ -0,0 +1,289 @@
+# encoding: utf-8
+"""
+整盘识别评估：代替只看单张图片的 show_test.py 与训练时只报告 mAP 的做法，直接衡量对局中真正重要的指标。
+
+对一个或多个带标注的数据集（YOLO 目录或 packed_dataset 分片目录，每个数据集视为一种皮肤）运行任意模型
+（.pt、ONNX/量化 ONNX，或逐格分类器 .cellnet），按批次分给多个工作进程，报告：
+  - 整盘完全正确率（90格全部正确的图片比例）与逐格准确率，总体及按皮肤分别统计；
+  - 逐类别混淆（真实 -> 识别，含空格）与每类的精确率/召回率；
+  - 吞吐量（含模型加载的总耗时）与每批推理耗时的分位数（一批 --batch 张图片一起推理，不是单张延迟）；
+  - 识别出错的图片及出错格子。
+结果写入键有序、数值取整的 JSON 报告，便于对不同模型的报告直接 diff。
+
+用法（在 train_tools 目录下）:
+    python evaluate.py best.pt --data wooden=datasets --data classic=classic.pack --workers 4 --report eval_best.json
+    python evaluate.py best_int8.onnx --data datasets --imgsz 640 608
+    python evaluate.py best.pt --show test_board2.jpg      # 单张图片画框查看（原 show_test.py）
+"""
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import time
+
+import cv2
+import numpy as np
+
+from create_dataset import CLASS_MAP, CLASS_NAMES, NUM_COLS, NUM_ROWS, get_grid_coordinates
+
+BOARD_CLASS = CLASS_MAP['board']
+CELL_LABELS = [name for name in CLASS_NAMES if name != 'board'] + ['empty']  # 报告中使用的类别名，-1 记为 empty
+NUM_CELLS = NUM_COLS * NUM_ROWS
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+@functools.lru_cache(maxsize=64)
+def image_grid(width, height):
+    """
+    按图片尺寸缩放的交叉点坐标 (90,2) 与间距 (x, y)。合成棋盘（628x693）上与合成时的网格完全一致；
+    棋盘ROI截图（难例采集、飞行记录仪画面）的格子中心与它相差不到格距的5%，同样适用。
+    """
+    grid = np.array(get_grid_coordinates(width, height, NUM_COLS, NUM_ROWS), dtype=np.float32)
+    return grid, (grid[1, 0] - grid[0, 0], grid[NUM_COLS, 1] - grid[0, 1])
+
+class LabelledSet:
+    """带标注的评估集：YOLO 目录（images/<split>、labels/<split>）或分片数据集目录。按序号读取，可在工作进程中重新打开。"""
+
+    def __init__(self, path, split='val'):
+        self.path = path
+        self.split = split
+        self.pack = None
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            from packed_dataset import PackedSplit
+            self.pack = PackedSplit(path, split)
+            self.names = self.pack.names
+        else:
+            image_dir = os.path.join(path, 'images', split)
+            self.names = sorted(f for f in os.listdir(image_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+    def __len__(self):
+        return len(self.names)
+
+    def load(self, i):
+        """返回 (BGR图片, (n,5) 标签)。"""
+        if self.pack is not None:
+            return self.pack.image(i), self.pack.labels(i)
+        name = self.names[i]
+        label_path = os.path.join(self.path, 'labels', self.split, os.path.splitext(name)[0] + '.txt')
+        labels = np.zeros((0, 5), np.float32)
+        if os.path.exists(label_path):
+            labels = np.loadtxt(label_path, dtype=np.float32, ndmin=2).reshape(-1, 5)
+        return cv2.imread(os.path.join(self.path, 'images', self.split, name)), labels
+
+def cells_from_boxes(centers, classes, shape, confs=None, threshold=0.0):
+    """
+    把框中心（像素）对齐到 shape 尺寸图片上最近的棋盘交叉点，返回长度90的类别数组（-1为空），同一格取置信度最高者。
+    离最近交叉点超过半格的框不计入。
+    """
+    grid, spacing = image_grid(shape[1], shape[0])
+    board = np.full(NUM_CELLS, -1, dtype=np.int64)
+    best = np.zeros(NUM_CELLS, dtype=np.float32)
+    for i, (center, cls) in enumerate(zip(centers, classes)):
+        conf = 1.0 if confs is None else confs[i]
+        if cls == BOARD_CLASS or conf <= threshold:
+            continue
+        dist = np.linalg.norm(grid - center, axis=1)
+        cell = int(dist.argmin())
+        if dist[cell] <= 0.5 * min(spacing) and conf > best[cell]:
+            board[cell], best[cell] = int(cls), conf
+    return board
+
+def truth_cells(labels, shape):
+    """标注 -> 长度90的真实类别数组。"""
+    h, w = shape[:2]
+    return cells_from_boxes(labels[:, 1:3] * (w, h), labels[:, 0].astype(int), shape)
+
+def detection_cells(result, threshold):
+    """ultralytics 检测结果 -> 长度90的识别类别数组。"""
+    xyxy = result.boxes.xyxy.cpu().numpy()
+    centers = (xyxy[:, :2] + xyxy[:, 2:]) / 2
+    return cells_from_boxes(centers, result.boxes.cls.cpu().numpy().astype(int), result.orig_shape,
+                            result.boxes.conf.cpu().numpy(), threshold)
+
+class Recognizer:
+    """统一的识别接口：predict(图片列表) -> 每张图片长度90的类别数组。"""
+
+    def __init__(self, model_path, conf, imgsz=None, threads=0):
+        self.conf = conf
+        self.imgsz = imgsz
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        if model_path.lower().endswith('.cellnet'):
+            import torch
+            extra = {'meta.json': ''}
+            self.cellnet = torch.jit.load(model_path, map_location='cpu', _extra_files=extra).eval()
+            meta = json.loads(extra['meta.json'])
+            self.size = meta['size']
+            # 分类器的类别序号 -> 数据集类别序号（空格为 -1）
+            self.class_ids = np.array([CLASS_MAP[name] if name else -1 for name in meta['names']])
+        else:
+            from ultralytics import YOLO
+            self.cellnet = None
+            self.model = YOLO(model_path, task='detect')
+
+    def predict(self, images):
+        if self.cellnet is None:
+            kwargs = {'imgsz': self.imgsz} if self.imgsz else {}
+            return [detection_cells(r, self.conf) for r in self.model(images, verbose=False, **kwargs)]
+        import torch
+        from train_cell_classifier import crop_cell
+        crops = []
+        for img in images:
+            grid, spacing = image_grid(img.shape[1], img.shape[0])
+            crops.extend(crop_cell(img, center, spacing[0], spacing[1], self.size) for center in grid)
+        crops = np.stack(crops)
+        with torch.inference_mode():
+            x = torch.from_numpy(crops).permute(0, 3, 1, 2).float().div_(255)
+            probs = torch.softmax(self.cellnet(x), dim=1).numpy()
+        best = probs.argmax(1)
+        cells = np.where(probs[np.arange(len(best)), best] > self.conf, self.class_ids[best], -1)
+        return list(cells.reshape(len(images), NUM_CELLS))
+
+_worker = {}
+
+def _init_worker(model_path, conf, imgsz, threads, sets):
+    _worker['recognizer'] = Recognizer(model_path, conf, imgsz, threads)
+    _worker['sets'] = {skin: LabelledSet(path) for skin, path in sets.items()}
+
+def _evaluate_batch(task):
+    """工作进程：识别一批图片，返回 ([(皮肤, 图片名, 真实, 识别)], 本批推理耗时秒)。"""
+    skin, indices = task
+    dataset = _worker['sets'][skin]
+    images, truths = [], []
+    for i in indices:
+        img, labels = dataset.load(i)
+        images.append(img)
+        truths.append(truth_cells(labels, img.shape))
+    start = time.perf_counter()
+    preds = _worker['recognizer'].predict(images)
+    seconds = time.perf_counter() - start
+    return [(skin, dataset.names[i], t, p) for i, t, p in zip(indices, truths, preds)], seconds
+
+def summarize(records, batch_seconds, wall_seconds, max_failures=50):
+    """汇总逐图结果为报告字典。batch_seconds 为每批的推理耗时，wall_seconds 为含模型加载的总耗时。"""
+    n_cls = len(CELL_LABELS)
+    confusion = np.zeros((n_cls, n_cls), dtype=np.int64)
+    skins = {}
+    failures = []
+    for skin, name, truth, pred in records:
+        np.add.at(confusion, (truth, pred), 1)  # -1（空格）索引到最后一类
+        stats = skins.setdefault(skin, {'images': 0, 'exact': 0, 'cells_correct': 0})
+        correct = truth == pred
+        stats['images'] += 1
+        stats['exact'] += bool(correct.all())
+        stats['cells_correct'] += int(correct.sum())
+        if not correct.all() and len(failures) < max_failures:
+            wrong = [f"r{cell // NUM_COLS}c{cell % NUM_COLS} {CELL_LABELS[truth[cell]]}->{CELL_LABELS[pred[cell]]}"
+                     for cell in np.flatnonzero(~correct)]
+            failures.append({'skin': skin, 'image': name, 'cells': wrong})
+
+    def rates(stats):
+        return {'images': stats['images'],
+                'board_exact': round(stats['exact'] / stats['images'], 6),
+                'cell_accuracy': round(stats['cells_correct'] / (stats['images'] * NUM_CELLS), 6)}
+
+    total = {'images': 0, 'exact': 0, 'cells_correct': 0}
+    for stats in skins.values():
+        for key in total:
+            total[key] += stats[key]
+    per_class = {}
+    for k, label in enumerate(CELL_LABELS):
+        tp, support, predicted = int(confusion[k, k]), int(confusion[k].sum()), int(confusion[:, k].sum())
+        per_class[label] = {'support': support,
+                            'precision': round(tp / predicted, 6) if predicted else None,
+                            'recall': round(tp / support, 6) if support else None}
+    ms = np.array(batch_seconds) * 1000
+    return {
+        'overall': rates(total),
+        'skins': {skin: rates(stats) for skin, stats in sorted(skins.items())},
+        'per_class': per_class,
+        # 只列出非零项：真实类别 -> {识别类别: 格数}
+        'confusion': {CELL_LABELS[t]: {CELL_LABELS[p]: int(confusion[t, p]) for p in range(n_cls) if confusion[t, p]}
+                      for t in range(n_cls) if confusion[t].any()},
+        'speed': {'wall_seconds': round(wall_seconds, 3),
+                  'images_per_second': round(len(records) / wall_seconds, 3),
+                  'inference_ms_per_image': round(float(ms.sum()) / len(records), 3),
+                  'batch_ms': {f"p{q}": round(float(np.percentile(ms, q)), 3) for q in (50, 90, 99)}},
+        'failures': failures,
+    }
+
+def evaluate(model_path, sets, conf=0.9, imgsz=None, workers=1, batch=8, threads=0, max_failures=50, limit=None):
+    """在 sets（皮肤名 -> 数据集路径）上评估模型，返回报告字典。limit 限制每个数据集使用的图片数。"""
+    tasks = []
+    for skin, path in sets.items():
+        n = min(len(LabelledSet(path)), limit or float('inf'))
+        tasks.extend((skin, list(range(i, min(i + batch, n)))) for i in range(0, n, batch))
+    initargs = (model_path, conf, imgsz, threads, sets)
+    start = time.perf_counter()  # 两种方式都从加载模型之前开始计时，吞吐量可以相互比较
+    records, batch_seconds = [], []
+    if workers <= 1:
+        _init_worker(*initargs)
+        results = map(_evaluate_batch, tasks)
+    else:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=initargs)
+        results = pool.imap_unordered(_evaluate_batch, tasks)
+    for batch_records, seconds in results:
+        records.extend(batch_records)
+        batch_seconds.append(seconds)
+    if workers > 1:
+        pool.close()
+        pool.join()
+    records.sort(key=lambda r: (r[0], r[1]))
+    report = summarize(records, batch_seconds, time.perf_counter() - start, max_failures)
+    report['config'] = {'model': model_path, 'conf': conf, 'imgsz': list(imgsz) if isinstance(imgsz, tuple) else imgsz,
+                        'workers': workers, 'batch': batch, 'threads': threads, 'data': sets}
+    return report
+
+def show(model_path, image_path, output='results1.jpg'):
+    """画出单张图片的检测框并打印结果（原 show_test.py 的功能）。"""
+    from ultralytics import YOLO
+    from PIL import Image
+    model = YOLO(model_path)
+    for r in model(image_path):
+        im = Image.fromarray(r.plot()[..., ::-1])
+        im.show()
+        im.save(output)
+        for box in r.boxes:
+            print(f"检测到棋子: {model.names[int(box.cls)]}, 置信度: {float(box.conf):.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='整盘识别评估')
+    parser.add_argument('model', help='模型文件：.pt、.onnx 或 .cellnet')
+    parser.add_argument('--data', action='append', default=[],
+                        help='评估集，格式为 皮肤名=路径 或 路径（皮肤名取目录名），可重复指定')
+    parser.add_argument('--conf', type=float, default=0.90, help='识别置信度阈值，与主程序设置一致')
+    parser.add_argument('--imgsz', type=int, nargs='+', help='推理尺寸：一个数或 高 宽')
+    parser.add_argument('--workers', type=int, default=1, help='工作进程数')
+    parser.add_argument('--batch', type=int, default=8, help='每次推理的图片数')
+    parser.add_argument('--threads', type=int, default=0, help='每个工作进程的 torch 线程数，0 表示默认')
+    parser.add_argument('--max-failures', type=int, default=50, help='报告中最多列出的出错图片数')
+    parser.add_argument('--limit', type=int, help='每个评估集最多使用的图片数')
+    parser.add_argument('--report', help='JSON 报告保存路径（默认 eval_<模型名>.json）')
+    parser.add_argument('--show', help='只对这张图片画框查看，不做评估')
+    args = parser.parse_args()
+
+    if args.show:
+        show(args.model, args.show)
+        return
+    sets = {}
+    for item in args.data or ['datasets']:
+        skin, _, path = item.rpartition('=')
+        sets[skin or os.path.basename(os.path.normpath(path))] = path
+    imgsz = tuple(args.imgsz) if args.imgsz and len(args.imgsz) > 1 else (args.imgsz[0] if args.imgsz else None)
+    report = evaluate(args.model, sets, args.conf, imgsz, args.workers, args.batch, args.threads, args.max_failures, args.limit)
+
+    overall = report['overall']
+    print(f"整盘完全正确率 {overall['board_exact']:.4f}  逐格准确率 {overall['cell_accuracy']:.5f}  ({overall['images']} 张)")
+    for skin, stats in report['skins'].items():
+        print(f"  {skin}: 整盘 {stats['board_exact']:.4f}  逐格 {stats['cell_accuracy']:.5f}  ({stats['images']} 张)")
+    speed = report['speed']
+    print(f"吞吐 {speed['images_per_second']:.1f} 张/秒（含模型加载）  平均推理 {speed['inference_ms_per_image']:.1f} ms/张  "
+          f"每批({args.batch}张)耗时 " + "  ".join(f"{k} {v:.1f}ms" for k, v in speed['batch_ms'].items()))
+    path = args.report or f"eval_{os.path.splitext(os.path.basename(args.model))[0]}.json"
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+    print(f"报告已保存到 {path}")
+
+if __name__ == '__main__':
+    main()
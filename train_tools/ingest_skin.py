@@ -0,0 +1,179 @@
+# encoding: utf-8
+"""
+导入新平台的棋子皮肤：把一个目录下的棋子图集（sprite sheet）按布局描述切块，
+去掉完全相同的棋子后直接写入合成数据使用的已解码素材库 sprites/<皮肤名>.npz，
+create_dataset / synthetic_data / train_cell_classifier 下次运行时自动加载，不需要再手工切图、改名、拷贝。
+
+布局描述为内置名称（见 LAYOUTS）或 JSON 文件:
+    {
+      "tile": [80, 80],             # 单个棋子的宽高
+      "origin": [0, 0],             # 第一个棋子左上角 (x, y)，可省略
+      "gap": [0, 0],                # 相邻棋子之间的间隔 (x, y)，可省略
+      "sheet_size": [720, 160],     # 图集尺寸，不符的文件跳过，可省略
+      "pattern": "*.png",           # 图集文件名匹配，可省略
+      "names": [["rP", "rC", ...],  # 每行每列的棋子名，行列数即网格大小；null 表示跳过该格
+                ["bP", "bC", ...]]
+    }
+不在 CLASS_NAMES 中的名字也会写入素材库，合成时作为无标注的干扰图案。
+
+用法（在 train_tools 目录下）:
+    python ingest_skin.py path/to/sheets --layout tiantian --skin tiantian
+    python ingest_skin.py path/to/sheets --layout layout.json --skin newsite --png output
+"""
+import argparse
+import fnmatch
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from create_dataset import SPRITE_BANK_DIR
+
+LAYOUTS = {
+    # 天天象棋：720x160 的图集，上行红方、下行黑方，每格 80x80，最后一列为废弃图案与空白
+    'tiantian': {
+        'tile': [80, 80],
+        'sheet_size': [720, 160],
+        'names': [['rP', 'rC', 'rN', 'rR', 'rB', 'rA', 'rK', 'rX', None],
+                  ['bP', 'bC', 'bN', 'bR', 'bB', 'bA', 'bK', 'bX', None]],
+    },
+}
+
+def load_layout(spec):
+    """按内置名称或 JSON 文件读取布局描述，并检查网格是否规整。"""
+    if spec in LAYOUTS:
+        layout = dict(LAYOUTS[spec])
+    else:
+        with open(spec, encoding='utf-8') as f:
+            layout = json.load(f)
+    names = layout['names']
+    if not names or any(len(row) != len(names[0]) for row in names):
+        raise ValueError("布局描述的 names 必须是行长度相同的二维列表")
+    if any(name and '_' in name for row in names for name in row):
+        raise ValueError("棋子名中不能包含下划线（素材库键名用下划线分隔类别与来源）")
+    layout.setdefault('origin', [0, 0])
+    layout.setdefault('gap', [0, 0])
+    layout.setdefault('pattern', '*.png')
+    return layout
+
+def tile_view(sheet, layout):
+    """返回形状为 (行, 列, 高, 宽, 4) 的只读视图，不复制像素。"""
+    rows, cols = len(layout['names']), len(layout['names'][0])
+    tile_w, tile_h = layout['tile']
+    ox, oy = layout['origin']
+    pitch_x, pitch_y = tile_w + layout['gap'][0], tile_h + layout['gap'][1]
+    if oy + (rows - 1) * pitch_y + tile_h > sheet.shape[0] or ox + (cols - 1) * pitch_x + tile_w > sheet.shape[1]:
+        raise ValueError(f"图集尺寸 {sheet.shape[1]}x{sheet.shape[0]} 容纳不下 {rows}x{cols} 的网格")
+    region = sheet[oy:, ox:]
+    s_y, s_x, s_c = region.strides
+    return np.lib.stride_tricks.as_strided(region, shape=(rows, cols, tile_h, tile_w, 4),
+                                           strides=(pitch_y * s_y, pitch_x * s_x, s_y, s_x, s_c), writeable=False)
+
+def tile_digest(tile):
+    return hashlib.blake2b(np.ascontiguousarray(tile).tobytes() + repr(tile.shape).encode(), digest_size=16).hexdigest()
+
+def _slice_sheet(task):
+    """工作进程：解码一张图集并切块，返回 (文件名, [(棋子名, 摘要, RGBA数组)], 空白格数, 错误信息)。"""
+    path, layout = task
+    name = os.path.basename(path)
+    try:
+        with Image.open(path) as img:
+            if layout.get('sheet_size') and list(img.size) != list(layout['sheet_size']):
+                return name, [], 0, f"尺寸为 {img.size}，不是 {tuple(layout['sheet_size'])}"
+            sheet = np.asarray(img.convert('RGBA'))
+        tiles = tile_view(sheet, layout)
+    except (OSError, ValueError) as e:
+        return name, [], 0, str(e)
+    found, blank = [], 0
+    for r, row in enumerate(layout['names']):
+        for c, piece in enumerate(row):
+            if not piece:
+                continue
+            tile = tiles[r, c]
+            if not tile[:, :, 3].any():  # 完全透明的空格
+                blank += 1
+                continue
+            found.append((piece, tile_digest(tile), np.ascontiguousarray(tile)))
+    return name, found, blank, None
+
+def existing_digests(output_dir, exclude):
+    """已有素材库中全部棋子的摘要，用于跨皮肤去重。"""
+    digests = set()
+    if not os.path.isdir(output_dir):
+        return digests
+    for f in sorted(os.listdir(output_dir)):
+        path = os.path.join(output_dir, f)
+        if f.endswith('.npz') and os.path.abspath(path) != os.path.abspath(exclude):
+            with np.load(path) as archive:
+                digests.update(tile_digest(archive[key]) for key in archive.files)
+    return digests
+
+def ingest(sheet_dir, layout, skin, output_dir=SPRITE_BANK_DIR, workers=0, png_dir=None):
+    """切分 sheet_dir 下的全部图集并写入 output_dir/<skin>.npz，返回写入的棋子数。"""
+    start = time.perf_counter()
+    files = sorted(os.path.join(sheet_dir, f) for f in os.listdir(sheet_dir) if fnmatch.fnmatch(f, layout['pattern']))
+    if not files:
+        raise SystemExit(f"{sheet_dir} 中没有匹配 {layout['pattern']} 的图集")
+    bank_path = os.path.join(output_dir, f"{skin}.npz")
+    seen = existing_digests(output_dir, bank_path)
+    workers = min(workers or os.cpu_count() or 1, len(files))
+
+    tasks = [(path, layout) for path in files]
+    if workers == 1:
+        results = [_slice_sheet(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.map(_slice_sheet, tasks)  # 按文件顺序返回，键名与进程数无关
+    bank, counts = {}, {}
+    duplicates = blanks = 0
+    for name, found, blank, error in results:
+        if error:
+            print(f"跳过 {name}: {error}")
+            continue
+        blanks += blank
+        stem = os.path.splitext(name)[0]
+        for piece, digest, tile in found:
+            if digest in seen:
+                duplicates += 1
+                continue
+            seen.add(digest)
+            key, k = f"{piece}_{stem}", 1
+            while key in bank:
+                key, k = f"{piece}_{stem}-{k}", k + 1
+            bank[key] = tile
+            counts[piece] = counts.get(piece, 0) + 1
+    if not bank:
+        raise SystemExit("没有切出任何新棋子")
+
+    os.makedirs(output_dir, exist_ok=True)
+    temp_path = bank_path + '.tmp.npz'
+    np.savez(temp_path, **bank)  # 不压缩：合成时直接读取数组
+    os.replace(temp_path, bank_path)
+    if png_dir:
+        os.makedirs(png_dir, exist_ok=True)
+        for key, tile in bank.items():
+            piece, source = key.split('_', 1)
+            Image.fromarray(tile).save(os.path.join(png_dir, f"{piece}{source}.png"))
+
+    print(f"{len(files)} 张图集, {workers} 个进程, 用时 {time.perf_counter() - start:.2f} 秒")
+    print(f"写入 {bank_path}: {len(bank)} 个棋子, 跳过重复 {duplicates} 个、空白 {blanks} 个")
+    print("  " + ", ".join(f"{piece}: {n}" for piece, n in sorted(counts.items())))
+    return len(bank)
+
+def main():
+    parser = argparse.ArgumentParser(description='把棋子图集切块并写入合成数据使用的素材库')
+    parser.add_argument('sheets', help='图集所在目录')
+    parser.add_argument('--layout', default='tiantian', help=f"布局描述：内置 {', '.join(LAYOUTS)} 或 JSON 文件路径")
+    parser.add_argument('--skin', required=True, help='皮肤名称，写入 <output>/<皮肤名>.npz，重复导入时覆盖')
+    parser.add_argument('--output', default=SPRITE_BANK_DIR, help='素材库目录')
+    parser.add_argument('--workers', type=int, default=0, help='并行进程数，0 表示使用全部CPU核心')
+    parser.add_argument('--png', help='同时把切出的棋子保存为PNG（文件名为 棋子名+图集名）')
+    args = parser.parse_args()
+    ingest(args.sheets, load_layout(args.layout), args.skin, args.output, args.workers, args.png)
+
+if __name__ == '__main__':
+    main()
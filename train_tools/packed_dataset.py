@@ -0,0 +1,307 @@
+# encoding: utf-8
+"""
+紧凑的分片数据集格式：代替 datasets/images|labels/{train,val} 下成千上万个小文件。
+
+目录结构（以 datasets.pack/ 为例）:
+    meta.json              版本、类别名与各划分的样本数/分片数
+    train-000.jpgs ...     分片：原样拼接的 JPEG 字节，单个分片默认不超过 512MB
+    train-index.npy        每个样本一行：分片号、偏移、长度、图片高宽、在标签表中的起始行与行数
+    train-labels.npy       整个划分的标签表 (M, 5) float32：类别, x, y, w, h（YOLO 归一化格式）
+    train-names.txt        每个样本的原始文件名，转换回 YOLO 目录时使用
+
+读取时索引、标签表与分片都用内存映射打开，取样只是一次切片，不需要逐个打开文件。
+分片可以直接复制、校验与分发。
+
+用法:
+    python packed_dataset.py pack datasets datasets.pack      # YOLO 目录 -> 分片格式
+    python packed_dataset.py unpack datasets.pack datasets    # 分片格式 -> YOLO 目录
+    python packed_dataset.py info datasets.pack
+训练时运行 train_gpu.py / train_cpu.py --packed（读取 chess_packed.yaml 指向的 datasets.pack）。
+"""
+import argparse
+import json
+import math
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+FORMAT_VERSION = 1
+DEFAULT_SHARD_MB = 512
+INDEX_DTYPE = np.dtype([
+    ('shard', '<u2'), ('offset', '<u8'), ('length', '<u4'),
+    ('height', '<u2'), ('width', '<u2'),
+    ('label_start', '<u8'), ('label_count', '<u4'),
+])
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+def _shard_path(root, split, shard):
+    return os.path.join(root, f"{split}-{shard:03d}.jpgs")
+
+def resize_for_loader(im, imgsz, rect_mode=True):
+    """与 ultralytics BaseDataset.load_image 相同的缩放规则，返回 (图片, 原尺寸, 缩放后尺寸)。"""
+    h0, w0 = im.shape[:2]
+    if rect_mode:
+        r = imgsz / max(h0, w0)
+        if r != 1:
+            w, h = (min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz))
+            im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+    elif not (h0 == w0 == imgsz):
+        im = cv2.resize(im, (imgsz, imgsz), interpolation=cv2.INTER_LINEAR)
+    return im, (h0, w0), im.shape[:2]
+
+class PackWriter:
+    """顺序写入分片数据集。每个划分独立分片，close() 时写出索引、标签表与 meta.json。"""
+
+    def __init__(self, root, names=None, shard_mb=DEFAULT_SHARD_MB):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.names = names
+        self.shard_bytes = shard_mb * 1024 * 1024
+        self._splits = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, split, name, data, labels, shape):
+        """追加一个样本：data 为编码后的图片字节，labels 为 (n, 5) 的 YOLO 标签，shape 为 (高, 宽)。"""
+        state = self._splits.get(split)
+        if state is None:
+            state = self._splits[split] = {'shard': 0, 'file': open(_shard_path(self.root, split, 0), 'wb'),
+                                           'offset': 0, 'index': [], 'labels': [], 'names': [], 'label_rows': 0}
+        if state['offset'] and state['offset'] + len(data) > self.shard_bytes:
+            state['file'].close()
+            state['shard'] += 1
+            state['file'] = open(_shard_path(self.root, split, state['shard']), 'wb')
+            state['offset'] = 0
+        state['file'].write(data)
+        labels = np.asarray(labels, dtype=np.float32).reshape(-1, 5)
+        state['index'].append((state['shard'], state['offset'], len(data), shape[0], shape[1],
+                               state['label_rows'], len(labels)))
+        state['labels'].append(labels)
+        state['names'].append(name)
+        state['offset'] += len(data)
+        state['label_rows'] += len(labels)
+
+    def close(self):
+        meta = {'version': FORMAT_VERSION, 'names': self.names, 'splits': {}}
+        for split, state in self._splits.items():
+            state['file'].close()
+            np.save(os.path.join(self.root, f"{split}-index.npy"), np.array(state['index'], dtype=INDEX_DTYPE))
+            np.save(os.path.join(self.root, f"{split}-labels.npy"),
+                    np.concatenate(state['labels']) if state['labels'] else np.zeros((0, 5), np.float32))
+            with open(os.path.join(self.root, f"{split}-names.txt"), 'w', encoding='utf-8') as f:
+                f.write('\n'.join(state['names']) + '\n')
+            meta['splits'][split] = {'count': len(state['index']), 'shards': state['shard'] + 1}
+        with open(os.path.join(self.root, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        self._splits = {}
+
+class PackedSplit:
+    """
+    分片数据集中一个划分的只读视图。索引、标签表与分片均为内存映射，按需打开。
+    可以被 pickle 传给 DataLoader 工作进程：映射不随进程传递，在子进程中重新打开。
+    """
+
+    def __init__(self, root, split):
+        self.root = root
+        self.split = split
+        with open(os.path.join(root, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != FORMAT_VERSION:
+            raise ValueError(f"不支持的分片数据集版本: {self.meta.get('version')}")
+        if split not in self.meta['splits']:
+            raise KeyError(f"{root} 中没有 {split} 划分")
+        with open(os.path.join(root, f"{split}-names.txt"), encoding='utf-8') as f:
+            self.names = f.read().splitlines()
+        self._open()
+
+    def _open(self):
+        self.index = np.load(os.path.join(self.root, f"{self.split}-index.npy"), mmap_mode='r')
+        self.label_table = np.load(os.path.join(self.root, f"{self.split}-labels.npy"), mmap_mode='r')
+        self._shards = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('index', 'label_table', '_shards'):
+            state.pop(key)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def __len__(self):
+        return len(self.index)
+
+    def _shard(self, shard):
+        mapped = self._shards.get(shard)
+        if mapped is None:
+            mapped = self._shards[shard] = np.memmap(_shard_path(self.root, self.split, shard), dtype=np.uint8, mode='r')
+        return mapped
+
+    def data(self, i):
+        """第 i 个样本的编码图片字节（内存映射切片，不复制）。"""
+        row = self.index[i]
+        offset = int(row['offset'])
+        return self._shard(int(row['shard']))[offset:offset + int(row['length'])]
+
+    def image(self, i):
+        """解码第 i 个样本为 BGR 图片。"""
+        return cv2.imdecode(np.asarray(self.data(i)), cv2.IMREAD_COLOR)
+
+    def shape(self, i):
+        row = self.index[i]
+        return int(row['height']), int(row['width'])
+
+    def labels(self, i):
+        """第 i 个样本的 (n, 5) 标签：类别, x, y, w, h。"""
+        row = self.index[i]
+        start = int(row['label_start'])
+        return np.array(self.label_table[start:start + int(row['label_count'])])
+
+def _read_yolo_labels(path):
+    if not os.path.exists(path):
+        return np.zeros((0, 5), np.float32)
+    with open(path, encoding='utf-8') as f:
+        rows = [line.split() for line in f if line.strip()]
+    return np.array(rows, dtype=np.float32).reshape(-1, 5)
+
+def from_yolo(src, dst, shard_mb=DEFAULT_SHARD_MB):
+    """把 YOLO 目录（images/{split} 与 labels/{split}）打包为分片格式，图片字节原样保存，不重新编码。"""
+    names = None
+    classes_file = os.path.join(src, 'classes.txt')
+    if os.path.exists(classes_file):
+        with open(classes_file, encoding='utf-8') as f:
+            names = f.read().split()
+    with PackWriter(dst, names, shard_mb) as writer:
+        for split in sorted(os.listdir(os.path.join(src, 'images'))):
+            image_dir = os.path.join(src, 'images', split)
+            files = sorted(f for f in os.listdir(image_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+            for name in files:
+                path = os.path.join(image_dir, name)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                with Image.open(path) as img:  # 只读文件头获取尺寸
+                    width, height = img.size
+                labels = _read_yolo_labels(os.path.join(src, 'labels', split, os.path.splitext(name)[0] + '.txt'))
+                writer.add(split, name, data, labels, (height, width))
+            print(f"{split}: 打包 {len(files)} 张图片")
+
+def to_yolo(src, dst):
+    """把分片格式还原为 YOLO 目录结构。"""
+    with open(os.path.join(src, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    for split in meta['splits']:
+        pack = PackedSplit(src, split)
+        os.makedirs(os.path.join(dst, 'images', split), exist_ok=True)
+        os.makedirs(os.path.join(dst, 'labels', split), exist_ok=True)
+        for i, name in enumerate(pack.names):
+            with open(os.path.join(dst, 'images', split, name), 'wb') as f:
+                f.write(pack.data(i).tobytes())
+            with open(os.path.join(dst, 'labels', split, os.path.splitext(name)[0] + '.txt'), 'w') as f:
+                f.writelines(f"{int(c)} {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n" for c, x, y, w, h in pack.labels(i))
+        print(f"{split}: 还原 {len(pack)} 张图片")
+    if meta.get('names'):
+        with open(os.path.join(dst, 'classes.txt'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(meta['names']) + '\n')
+
+def packed_trainer():
+    """
+    返回从分片格式读取数据的 DetectionTrainer 子类，传给 model.train(trainer=...)。
+    数据集 yaml 中 train/val 指向分片目录（见 chess_packed.yaml），训练用 train 划分，验证用 val 划分。
+    """
+    from ultralytics.data.dataset import YOLODataset
+    from ultralytics.models.yolo.detect import DetectionTrainer
+    from ultralytics.utils import colorstr
+
+    class PackedYOLODataset(YOLODataset):
+        def __init__(self, *args, split='train', **kwargs):
+            self.split = split
+            super().__init__(*args, **kwargs)
+
+        def get_img_files(self, img_path):
+            self.pack = PackedSplit(img_path, self.split)
+            files = [f"{img_path}/{self.split}/{name}" for name in self.pack.names]
+            self._positions = {f: i for i, f in enumerate(files)}  # rect 模式会按宽高比重排，按文件名找回分片中的序号
+            return files
+
+        def get_labels(self):
+            labels = []
+            for i, im_file in enumerate(self.im_files):
+                table = self.pack.labels(i)
+                labels.append({
+                    'im_file': im_file,
+                    'shape': self.pack.shape(i),
+                    'cls': table[:, :1],
+                    'bboxes': table[:, 1:],
+                    'segments': [],
+                    'keypoints': None,
+                    'normalized': True,
+                    'bbox_format': 'xywh',
+                })
+            return labels
+
+        def load_image(self, i, rect_mode=True):
+            image = self.pack.image(self._positions[self.im_files[i]])
+            return resize_for_loader(image, self.imgsz, rect_mode)
+
+    class PackedTrainer(DetectionTrainer):
+        def build_dataset(self, img_path, mode='train', batch=None):
+            model = getattr(self.model, 'module', self.model)
+            stride = max(int(model.stride.max() if model else 0), 32)
+            cfg = self.args
+            return PackedYOLODataset(
+                img_path=img_path,
+                imgsz=cfg.imgsz,
+                batch_size=batch,
+                augment=mode == 'train',
+                hyp=cfg,
+                rect=cfg.rect or mode == 'val',
+                cache=cfg.cache or None,
+                single_cls=cfg.single_cls or False,
+                stride=stride,
+                pad=0.0 if mode == 'train' else 0.5,
+                prefix=colorstr(f"{mode}: "),
+                task=cfg.task,
+                classes=cfg.classes,
+                data=self.data,
+                fraction=cfg.fraction if mode == 'train' else 1.0,
+                split='train' if mode == 'train' else 'val',
+            )
+
+    return PackedTrainer
+
+def main():
+    parser = argparse.ArgumentParser(description='分片数据集格式与 YOLO 目录之间的转换')
+    sub = parser.add_subparsers(dest='command', required=True)
+    pack = sub.add_parser('pack', help='YOLO 目录 -> 分片格式')
+    pack.add_argument('src')
+    pack.add_argument('dst')
+    pack.add_argument('--shard-mb', type=int, default=DEFAULT_SHARD_MB, help='单个分片的最大MB数')
+    unpack = sub.add_parser('unpack', help='分片格式 -> YOLO 目录')
+    unpack.add_argument('src')
+    unpack.add_argument('dst')
+    info = sub.add_parser('info', help='显示分片数据集概况')
+    info.add_argument('src')
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        from_yolo(args.src, args.dst, args.shard_mb)
+    elif args.command == 'unpack':
+        to_yolo(args.src, args.dst)
+    else:
+        with open(os.path.join(args.src, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        for split, entry in meta['splits'].items():
+            pack = PackedSplit(args.src, split)
+            size = sum(os.path.getsize(_shard_path(args.src, split, k)) for k in range(entry['shards']))
+            print(f"{split}: {entry['count']} 张图片, {len(pack.label_table)} 个标注, "
+                  f"{entry['shards']} 个分片, {size / 1024 / 1024:.1f} MB")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+# encoding: utf-8
+"""
+在线合成训练数据：不再先把几千张 JPEG/标签写进 datasets/ 再读回来，
+而是在 DataLoader 的工作进程里用 create_dataset 的棋盘/棋子/区域逻辑直接合成图片与 YOLO 标签。
+
+- 训练集：每次取样都合成一张全新的图片，每个 epoch 的样本都不重复，数量不受 NUM_TRAIN_IMAGES 限制。
+  随机数由 (种子, DataLoader 工作进程, 该进程的第几次取样, 样本序号) 决定，种子、batch 与 workers 相同时训练数据可复现。
+- 验证集：按固定种子合成一次并以 JPEG 编码缓存在内存中，每轮评估使用同一批样本，结果可比较。
+
+用法（在 train_tools 目录下，需要 board/、pieces/、NewPieces/ 素材）:
+    model.train(data='chess_synthetic.yaml', trainer=synthetic_trainer(epoch_size=2500, val_size=500, seed=0), ...)
+或直接运行 train_gpu.py / train_cpu.py 时加上 --synthetic。
+"""
+import random
+
+import cv2
+import numpy as np
+import torch
+from ultralytics.data.dataset import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer
+from ultralytics.utils import colorstr
+
+from create_dataset import (BOARD_HEIGHT, BOARD_WIDTH, NUM_COLS, NUM_ROWS, NUM_TRAIN_IMAGES, NUM_VAL_IMAGES,
+                            SpriteBank, get_grid_coordinates, list_board_files, load_piece_info, render_sample)
+from packed_dataset import resize_for_loader
+
+def parse_labels(yolo_labels):
+    """把 YOLO 标签行转换为 (cls (n,1), bboxes (n,4) 归一化xywh)。"""
+    table = np.array([line.split() for line in yolo_labels], dtype=np.float32).reshape(-1, 5)
+    return table[:, :1], table[:, 1:]
+
+class SyntheticYOLODataset(YOLODataset):
+    """
+    图片在取样时合成的 YOLODataset。im_files 只是虚拟的样本名，不对应磁盘文件。
+    fixed_seed 为 None 时每次取样都是新图片（训练，随机数由 seed 派生），否则按 (种子, 序号) 合成一次并缓存（验证）。
+    """
+
+    def __init__(self, *args, length=NUM_TRAIN_IMAGES, fixed_seed=None, seed=0, **kwargs):
+        self.length = length
+        self.fixed_seed = fixed_seed
+        self.seed = seed
+        self.draws = 0  # 本进程内的取样次数，每个 DataLoader 工作进程各有一份
+        self.bank = SpriteBank(list_board_files(), load_piece_info())
+        self.grid_coords = get_grid_coordinates(BOARD_WIDTH, BOARD_HEIGHT, NUM_COLS, NUM_ROWS)
+        self.encoded = {}  # 验证集缓存：样本名 -> JPEG 字节
+        super().__init__(*args, **kwargs)
+
+    def get_img_files(self, img_path):
+        prefix = 'val' if self.fixed_seed is not None else 'train'
+        return [f"synthetic/{prefix}_{i}.jpg" for i in range(self.length)]
+
+    def _make_label(self, im_file, shape, yolo_labels):
+        cls, bboxes = parse_labels(yolo_labels)
+        return {
+            'im_file': im_file,
+            'shape': shape,
+            'cls': cls,
+            'bboxes': bboxes,
+            'segments': [],
+            'keypoints': None,
+            'normalized': True,
+            'bbox_format': 'xywh',
+        }
+
+    def get_labels(self):
+        if self.fixed_seed is None:
+            # 训练样本的标签在取样时才生成，这里只占位
+            return [self._make_label(f, (BOARD_HEIGHT, BOARD_WIDTH), []) for f in self.im_files]
+        labels = []
+        for i, im_file in enumerate(self.im_files):
+            canvas, yolo_labels = render_sample(random.Random(f"{self.fixed_seed}:val:{i}"), self.bank, self.grid_coords)
+            ok, buf = cv2.imencode('.jpg', canvas[:, :, ::-1], [cv2.IMWRITE_JPEG_QUALITY, 95])
+            self.encoded[im_file] = buf.tobytes()
+            labels.append(self._make_label(im_file, canvas.shape[:2], yolo_labels))
+        return labels
+
+    def load_image(self, i, rect_mode=True):
+        buf = np.frombuffer(self.encoded[self.im_files[i]], dtype=np.uint8)
+        return resize_for_loader(cv2.imdecode(buf, cv2.IMREAD_COLOR), self.imgsz, rect_mode)
+
+    def get_image_and_label(self, index):
+        if self.fixed_seed is not None:
+            return super().get_image_and_label(index)
+        worker = torch.utils.data.get_worker_info()
+        rng = random.Random(f"{self.seed}:train:{worker.id if worker else 0}:{self.draws}:{index}")
+        self.draws += 1
+        canvas, yolo_labels = render_sample(rng, self.bank, self.grid_coords)
+        label = self._make_label(self.im_files[index], canvas.shape[:2], yolo_labels)
+        label.pop('shape')
+        label['img'], label['ori_shape'], label['resized_shape'] = resize_for_loader(
+            np.ascontiguousarray(canvas[:, :, ::-1]), self.imgsz)
+        label['ratio_pad'] = (label['resized_shape'][0] / label['ori_shape'][0],
+                              label['resized_shape'][1] / label['ori_shape'][1])
+        if self.rect:
+            label['rect_shape'] = self.batch_shapes[self.batch[index]]
+        return self.update_labels_info(label)
+
+def synthetic_trainer(epoch_size=NUM_TRAIN_IMAGES, val_size=NUM_VAL_IMAGES, seed=0):
+    """返回使用在线合成数据的 DetectionTrainer 子类，传给 model.train(trainer=...)。"""
+
+    class SyntheticTrainer(DetectionTrainer):
+        def build_dataset(self, img_path, mode='train', batch=None):
+            model = getattr(self.model, 'module', self.model)
+            stride = max(int(model.stride.max() if model else 0), 32)
+            cfg = self.args
+            return SyntheticYOLODataset(
+                img_path=img_path,
+                imgsz=cfg.imgsz,
+                batch_size=batch,
+                augment=mode == 'train',
+                hyp=cfg,
+                rect=cfg.rect or mode == 'val',
+                cache=None,
+                single_cls=cfg.single_cls or False,
+                stride=stride,
+                pad=0.0 if mode == 'train' else 0.5,
+                prefix=colorstr(f"{mode}: "),
+                task=cfg.task,
+                classes=cfg.classes,
+                data=self.data,
+                length=epoch_size if mode == 'train' else val_size,
+                fixed_seed=None if mode == 'train' else seed,
+                seed=seed,
+            )
+
+        def plot_training_labels(self):
+            pass  # 训练标签在取样时才生成，没有可统计的标签分布
+
+    return SyntheticTrainer
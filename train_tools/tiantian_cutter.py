@@ -1,50 +0,0 @@
-import os
-from PIL import Image
-
-def process_images():
-    output_dir = 'output'
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    top_row_names = ['rP', 'rC', 'rN', 'rR', 'rB', 'rA', 'rK', 'rX', 'waste']
-    bottom_row_names = ['bP', 'bC', 'bN', 'bR', 'bB', 'bA', 'bK', 'bX', 'blank']
-    
-    for i in range(1, 19):
-        input_filename = f'{i}.png'
-        
-        if not os.path.exists(input_filename):
-            print(f"文件 {input_filename} 不存在")
-            continue
-        try:
-            img = Image.open(input_filename) 
-            if img.size != (720, 160):
-                print(f"图片 {input_filename} 尺寸不是720x160，实际为 {img.size}")
-                continue
-            for col, name_prefix in enumerate(top_row_names):
-                left = col * 80
-                top = 0
-                right = left + 80
-                bottom = top + 80
-                cropped_img = img.crop((left, top, right, bottom))
-                output_filename = f'{name_prefix}{i}.png'
-                output_path = os.path.join(output_dir, output_filename)
-                cropped_img.save(output_path)
-                print(f"已保存: {output_path}")
-            for col, name_prefix in enumerate(bottom_row_names):
-                left = col * 80
-                top = 80
-                right = left + 80
-                bottom = top + 80
-                cropped_img = img.crop((left, top, right, bottom))
-                output_filename = f'{name_prefix}{i}.png'
-                output_path = os.path.join(output_dir, output_filename)
-                cropped_img.save(output_path)
-                print(f"已保存: {output_path}")
-                
-            print(f"已完成处理: {input_filename}")
-        except Exception as e:
-            print(f"处理图片 {input_filename} 时出错: {str(e)}")
-    
-    print("所有图片处理完成!")
-
-if __name__ == "__main__":
-    process_images()
\ No newline at end of file
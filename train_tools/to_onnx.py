@@ -1,12 +1,159 @@
+"""
+导出并筛选部署用的 ONNX 模型：
+  1. 导出 FP32 ONNX（动态输入尺寸，整盘识别与单格小块识别共用一个模型）；
+  2. 转换出 FP16 版本，并用渲染的棋盘图片校准出训练后量化的 INT8 版本；
+  3. 在 CPU 上按实际 ROI 宽高比的输入尺寸测每个版本的推理延迟，并在验证集上测整盘识别准确率；
+  4. 在准确率预算内（相对 FP32 的整盘准确率下降不超过 --budget）选出最快的版本，复制为 --output，
+     各版本的测量结果写入同名 .json 报告。
+
+用法（在 train_tools 目录下）:
+    python to_onnx.py --weights best.pt --roi 560 620 --val datasets.pack
+依赖 onnx、onnxruntime；FP16 转换另需 onnxconverter-common，缺少时跳过该版本。
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import shutil
+import statistics
+import time
+
+import cv2
+import numpy as np
 from ultralytics import YOLO
 
-model = YOLO('best.pt')
+from create_dataset import (BOARD_HEIGHT, BOARD_WIDTH, NUM_COLS, NUM_ROWS, SpriteBank,
+                            get_grid_coordinates, list_board_files, load_piece_info, render_sample)
+from evaluate import evaluate
+
+def roi_imgsz(roi_w, roi_h, long_side=640, stride=32):
+    """按ROI宽高比计算推理尺寸 (高, 宽)：长边为 long_side，两边都是 stride 的整数倍。"""
+    scale = long_side / max(roi_w, roi_h)
+    return (max(stride, math.ceil(roi_h * scale / stride) * stride),
+            max(stride, math.ceil(roi_w * scale / stride) * stride))
+
+def letterbox(img_bgr, shape):
+    """与 ultralytics 预处理一致：等比缩放后用114填充到 shape，返回 NCHW float32 RGB。"""
+    h0, w0 = img_bgr.shape[:2]
+    r = min(shape[0] / h0, shape[1] / w0)
+    w, h = round(w0 * r), round(h0 * r)
+    canvas = np.full((shape[0], shape[1], 3), 114, dtype=np.uint8)
+    top, left = (shape[0] - h) // 2, (shape[1] - w) // 2
+    canvas[top:top + h, left:left + w] = cv2.resize(img_bgr, (w, h), interpolation=cv2.INTER_LINEAR)
+    return np.ascontiguousarray(canvas[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255
+
+def cpu_latency(path, imgsz, threads, runs):
+    """用 onnxruntime 在CPU上测单张整盘输入的推理延迟（中位数，毫秒）。"""
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    if threads:
+        options.intra_op_num_threads = threads
+    session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+    name = session.get_inputs()[0].name
+    x = np.random.default_rng(0).random((1, 3, imgsz[0], imgsz[1]), dtype=np.float32)
+    for _ in range(3):
+        session.run(None, {name: x})
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        session.run(None, {name: x})
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+def to_fp16(src, dst):
+    from onnxconverter_common import float16
+    import onnx
+    model = float16.convert_float_to_float16(onnx.load(src), keep_io_types=True)
+    onnx.save(model, dst)
+
+def to_int8(src, dst, calib_images, imgsz, quantize_head=False):
+    """静态训练后量化（QDQ，权重按通道）。默认检测头保持浮点，避免框回归精度明显下降。"""
+    import onnx
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType, quantize_static)
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    class BoardReader(CalibrationDataReader):
+        def __init__(self):
+            self.name = onnx.load(src).graph.input[0].name
+            self.images = iter(calib_images)
+
+        def get_next(self):
+            img = next(self.images, None)
+            return None if img is None else {self.name: letterbox(img, imgsz)}
+
+    prepared = dst + '.prep.onnx'
+    quant_pre_process(src, prepared)
+    exclude = []
+    if not quantize_head:
+        nodes = [n.name for n in onnx.load(prepared).graph.node]
+        layers = [int(m.group(1)) for m in (re.match(r'/model\.(\d+)/', n) for n in nodes) if m]
+        if layers:  # 最后一层即检测头，节点名形如 /model.22/...
+            head = f"/model.{max(layers)}/"
+            exclude = [n for n in nodes if n.startswith(head)]
+    quantize_static(prepared, dst, BoardReader(), quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, nodes_to_exclude=exclude)
+    os.remove(prepared)
+
+def render_calibration(count, seed):
+    """用数据集合成逻辑渲染校准用的棋盘图片（BGR）。"""
+    bank = SpriteBank(list_board_files(), load_piece_info())
+    grid_coords = get_grid_coordinates(BOARD_WIDTH, BOARD_HEIGHT, NUM_COLS, NUM_ROWS)
+    return [np.ascontiguousarray(render_sample(random.Random(f"{seed}:calib:{i}"), bank, grid_coords)[0][:, :, ::-1])
+            for i in range(count)]
+
+def main():
+    parser = argparse.ArgumentParser(description='导出 FP32/FP16/INT8 ONNX 模型并按CPU准确率与延迟筛选')
+    parser.add_argument('--weights', default='best.pt', help='训练得到的 .pt 模型')
+    parser.add_argument('--roi', type=int, nargs=2, metavar=('W', 'H'), default=(640, 640),
+                        help='实际棋盘ROI的宽高（像素），用于确定推理输入的宽高比')
+    parser.add_argument('--val', default='datasets', help='验证集：YOLO 目录或分片数据集目录')
+    parser.add_argument('--val-limit', type=int, default=300, help='最多使用的验证图片数')
+    parser.add_argument('--calib', type=int, default=200, help='INT8 校准用的渲染图片数')
+    parser.add_argument('--calib-seed', type=int, default=0, help='校准图片的随机种子')
+    parser.add_argument('--quantize-head', action='store_true', help='INT8 同时量化检测头')
+    parser.add_argument('--budget', type=float, default=0.005, help='允许相对 FP32 下降的整盘准确率')
+    parser.add_argument('--conf', type=float, default=0.90, help='识别置信度阈值，与主程序设置一致')
+    parser.add_argument('--threads', type=int, default=0, help='测延迟时的CPU线程数，0 表示自动')
+    parser.add_argument('--runs', type=int, default=50, help='测延迟的重复次数')
+    parser.add_argument('--opset', type=int, default=12)
+    parser.add_argument('--output', default='best_cpu.onnx', help='选出的模型保存路径')
+    args = parser.parse_args()
+
+    imgsz = roi_imgsz(*args.roi)
+    print(f"推理输入尺寸 (高, 宽): {imgsz}")
+    stem = os.path.splitext(args.weights)[0]
+
+    exported = YOLO(args.weights).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True, opset=args.opset)
+    variants = {'fp32': f"{stem}_fp32.onnx"}
+    shutil.move(exported, variants['fp32'])
+    try:
+        to_fp16(variants['fp32'], f"{stem}_fp16.onnx")
+        variants['fp16'] = f"{stem}_fp16.onnx"
+    except ImportError:
+        print("未安装 onnxconverter-common，跳过 FP16")
+    to_int8(variants['fp32'], f"{stem}_int8.onnx", render_calibration(args.calib, args.calib_seed), imgsz, args.quantize_head)
+    variants['int8'] = f"{stem}_int8.onnx"
+
+    report = {'imgsz': list(imgsz), 'roi': list(args.roi), 'conf': args.conf, 'budget': args.budget, 'variants': {}}
+    for name, path in variants.items():
+        accuracy = evaluate(path, {'val': args.val}, args.conf, imgsz, limit=args.val_limit)['overall']
+        board_acc, cell_acc = accuracy['board_exact'], accuracy['cell_accuracy']
+        latency = cpu_latency(path, imgsz, args.threads, args.runs)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        report['variants'][name] = {'path': path, 'board_accuracy': board_acc, 'cell_accuracy': cell_acc,
+                                    'latency_ms': latency, 'size_mb': size_mb}
+        print(f"{name:5s} 整盘准确率 {board_acc:.4f}  逐格准确率 {cell_acc:.5f}  CPU延迟 {latency:7.1f} ms  {size_mb:6.1f} MB")
 
-success = model.export(format='onnx', 
-                       imgsz=(640, 640),   # 输入图像尺寸，根据模型训练尺寸修改
-                       dynamic=False,      # 是否使用动态维度
-                       simplify=True,      # 是否简化 ONNX 模型
-                       opset=12,
-                       )
+    floor = report['variants']['fp32']['board_accuracy'] - args.budget
+    passed = {k: v for k, v in report['variants'].items() if v['board_accuracy'] >= floor}
+    best = min(passed, key=lambda k: (passed[k]['latency_ms'], passed[k]['size_mb']))
+    report['selected'] = best
+    shutil.copy(variants[best], args.output)
+    with open(os.path.splitext(args.output)[0] + '.json', 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"选出 {best}（整盘准确率下限 {floor:.4f}），已保存为 {args.output}")
 
-print(f"导出成功: {success}")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
\ No newline at end of file
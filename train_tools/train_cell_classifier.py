@@ -0,0 +1,205 @@
+# encoding: utf-8
+"""
+训练逐格分类器：棋子只会出现在90个固定位置上，整盘识别可以换成90个独立的17类分类（16种棋子 + 空格）。
+模型是一个很小的卷积网络，输入为单格大小的图块（缩放到 --size），导出为主程序可直接加载的 .cellnet（TorchScript）。
+
+训练数据:
+  - 合成：用 create_dataset 的棋盘/棋子合成逻辑渲染整盘，按交叉点切出单格图块，标签由合成时的摆放得到；
+  - 伪标注（可选）：对真实截图目录（棋盘ROI截图，例如飞行记录仪导出的画面）用现有 YOLO 模型识别，
+    置信度高于 --pseudo-conf 的结果作为标签，按主程序相同的格子划分切块。
+
+用法（在 train_tools 目录下）:
+    python train_cell_classifier.py --boards 3000 --output cells.cellnet
+    python train_cell_classifier.py --pseudo ../resource/flight --yolo best.pt
+在主程序设置中把识别模型路径指向生成的 .cellnet 文件即可使用。
+"""
+import argparse
+import json
+import math
+import os
+import random
+import time
+
+import cv2
+import numpy as np
+import torch
+from torch import nn
+
+from create_dataset import (BOARD_HEIGHT, BOARD_WIDTH, CLASS_MAP, CLASS_NAMES, NUM_COLS, NUM_ROWS, SpriteBank,
+                            get_grid_coordinates, list_board_files, load_piece_info, render_sample)
+
+CELL_NAMES = [name for name in CLASS_NAMES if name != 'board'] + ['']  # 最后一类为空格
+EMPTY_INDEX = len(CELL_NAMES) - 1
+GRID = np.array(get_grid_coordinates(BOARD_WIDTH, BOARD_HEIGHT, NUM_COLS, NUM_ROWS), dtype=np.float32)
+SPACING = (GRID[1, 0] - GRID[0, 0], GRID[NUM_COLS, 1] - GRID[0, 1])  # 合成棋盘上相邻交叉点的间距 (x, y)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+class CellNet(nn.Module):
+    """三层卷积 + 全局平均池化的小型分类网络，默认宽度下约2.5万参数。"""
+
+    def __init__(self, num_classes=len(CELL_NAMES), width=16):
+        super().__init__()
+        def block(cin, cout):
+            return nn.Sequential(nn.Conv2d(cin, cout, 3, padding=1, bias=False), nn.BatchNorm2d(cout),
+                                 nn.ReLU(inplace=True), nn.MaxPool2d(2))
+        self.features = nn.Sequential(block(3, width), block(width, width * 2), block(width * 2, width * 4))
+        self.head = nn.Linear(width * 4, num_classes)
+
+    def forward(self, x):
+        return self.head(self.features(x).mean(dim=(2, 3)))
+
+def crop_cell(img, center, cell_w, cell_h, size):
+    """以 center 为中心切出单格大小的图块并缩放到 size（越界部分复制边缘像素）。"""
+    x0, y0 = int(round(center[0] - cell_w / 2)), int(round(center[1] - cell_h / 2))
+    x1, y1 = x0 + int(round(cell_w)), y0 + int(round(cell_h))
+    h, w = img.shape[:2]
+    pad = max(0, -x0, -y0, x1 - w, y1 - h)
+    if pad:
+        img = cv2.copyMakeBorder(img, pad, pad, pad, pad, cv2.BORDER_REPLICATE)
+        x0, y0, x1, y1 = x0 + pad, y0 + pad, x1 + pad, y1 + pad
+    return cv2.resize(img[y0:y1, x0:x1], (size, size), interpolation=cv2.INTER_AREA)
+
+def synthesize_cells(num_boards, seed, size, jitter=0.08):
+    """渲染 num_boards 张整盘并切出全部 90 个格子，返回 (图块 (N,S,S,3) BGR, 标签 (N,))。"""
+    bank = SpriteBank(list_board_files(), load_piece_info())
+    grid_coords = get_grid_coordinates(BOARD_WIDTH, BOARD_HEIGHT, NUM_COLS, NUM_ROWS)
+    crops, targets = [], []
+    for i in range(num_boards):
+        rng = random.Random(f"{seed}:cells:{i}")
+        canvas, yolo_labels = render_sample(rng, bank, grid_coords)
+        img = np.ascontiguousarray(canvas[:, :, ::-1])
+        h, w = img.shape[:2]
+        cell_classes = np.full(len(GRID), EMPTY_INDEX)
+        for line in yolo_labels:
+            cls, cx, cy = line.split()[:3]
+            if int(cls) == CLASS_MAP['board']:
+                continue
+            cell = int(np.linalg.norm(GRID - (float(cx) * w, float(cy) * h), axis=1).argmin())
+            cell_classes[cell] = CELL_NAMES.index(CLASS_NAMES[int(cls)])
+        for cell, center in enumerate(GRID):
+            # 模拟框选ROI时的偏差：格子中心随机偏移
+            offset = (rng.uniform(-jitter, jitter) * SPACING[0], rng.uniform(-jitter, jitter) * SPACING[1])
+            crops.append(crop_cell(img, center + offset, SPACING[0], SPACING[1], size))
+            targets.append(cell_classes[cell])
+    return np.stack(crops), np.array(targets, dtype=np.int64)
+
+def pseudo_label_cells(image_dir, yolo_path, size, conf):
+    """用 YOLO 模型给棋盘ROI截图逐格打标签，格子划分与主程序相同（ROI 均分为 10x9）。"""
+    from ultralytics import YOLO
+    model = YOLO(yolo_path)
+    crops, targets = [], []
+    files = sorted(f for f in os.listdir(image_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+    for name in files:
+        img = cv2.imread(os.path.join(image_dir, name))
+        h, w = img.shape[:2]
+        cell_classes = np.full(90, EMPTY_INDEX)
+        best = np.zeros(90)
+        for box in model(img, verbose=False)[0].boxes:
+            piece = model.names[int(box.cls[0])]
+            x1, y1, x2, y2 = box.xyxy[0].tolist()
+            row, col = int((y1 + y2) / 2 / (h / 10)), int((x1 + x2) / 2 / (w / 9))
+            score = float(box.conf[0])
+            if piece in CELL_NAMES and 0 <= row < 10 and 0 <= col < 9 and score > best[row * 9 + col]:
+                best[row * 9 + col] = score
+                cell_classes[row * 9 + col] = CELL_NAMES.index(piece)
+        for cell in range(90):
+            # 只有低置信度检测的格子标签不可靠，跳过
+            if 0 < best[cell] < conf:
+                continue
+            row, col = divmod(cell, 9)
+            crops.append(crop_cell(img, ((col + 0.5) * w / 9, (row + 0.5) * h / 10), w / 9, h / 10, size))
+            targets.append(cell_classes[cell])
+    print(f"伪标注: {len(files)} 张截图, {len(targets)} 个格子")
+    return np.stack(crops), np.array(targets, dtype=np.int64)
+
+def to_tensor(crops):
+    return torch.from_numpy(crops).permute(0, 3, 1, 2).float().div_(255)
+
+def augment(x):
+    """批内数据增强：随机亮度与对比度。"""
+    n = x.shape[0]
+    gain = torch.empty(n, 1, 1, 1).uniform_(0.7, 1.3)
+    bias = torch.empty(n, 1, 1, 1).uniform_(-0.1, 0.1)
+    return (x * gain + bias).clamp_(0, 1)
+
+def evaluate(model, x, y, batch=1024):
+    model.eval()
+    correct = 0
+    with torch.inference_mode():
+        for i in range(0, len(x), batch):
+            correct += int((model(x[i:i + batch]).argmax(1) == y[i:i + batch]).sum())
+    return correct / len(x)
+
+def benchmark(module, size, runs=50):
+    """CPU上一次性分类90个格子的延迟（中位数，毫秒）。"""
+    x = torch.rand(90, 3, size, size)
+    with torch.inference_mode():
+        for _ in range(5):
+            module(x)
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            module(x)
+            times.append((time.perf_counter() - start) * 1000)
+    return sorted(times)[len(times) // 2]
+
+def main():
+    parser = argparse.ArgumentParser(description='训练逐格分类器并导出为 .cellnet')
+    parser.add_argument('--boards', type=int, default=3000, help='合成训练用的整盘数量（每盘90个格子）')
+    parser.add_argument('--val-boards', type=int, default=300, help='合成验证用的整盘数量')
+    parser.add_argument('--seed', type=int, default=0, help='合成数据的随机种子')
+    parser.add_argument('--pseudo', help='额外的棋盘ROI截图目录，用 --yolo 模型伪标注后加入训练')
+    parser.add_argument('--yolo', default='best.pt', help='伪标注使用的 YOLO 模型')
+    parser.add_argument('--pseudo-conf', type=float, default=0.9, help='伪标注的置信度阈值')
+    parser.add_argument('--size', type=int, default=32, help='单格输入的边长（像素）')
+    parser.add_argument('--width', type=int, default=16, help='网络第一层的通道数')
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--batch', type=int, default=512)
+    parser.add_argument('--lr', type=float, default=3e-3)
+    parser.add_argument('--output', default='cells.cellnet', help='导出的模型路径')
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    x_train, y_train = synthesize_cells(args.boards, args.seed, args.size)
+    x_val, y_val = synthesize_cells(args.val_boards, args.seed + 1, args.size, jitter=0.0)
+    if args.pseudo:
+        x_pseudo, y_pseudo = pseudo_label_cells(args.pseudo, args.yolo, args.size, args.pseudo_conf)
+        x_train, y_train = np.concatenate([x_train, x_pseudo]), np.concatenate([y_train, y_pseudo])
+    print(f"训练 {len(y_train)} 格, 验证 {len(y_val)} 格, 空格占比 {np.mean(y_train == EMPTY_INDEX):.2f}")
+    x_train, y_train = to_tensor(x_train), torch.from_numpy(y_train)
+    x_val, y_val = to_tensor(x_val), torch.from_numpy(y_val)
+
+    model = CellNet(width=args.width)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, weight_decay=1e-4)
+    steps = args.epochs * math.ceil(len(x_train) / args.batch)
+    scheduler = torch.optim.lr_scheduler.OneCycleLR(optimizer, max_lr=args.lr, total_steps=steps)
+    loss_fn = nn.CrossEntropyLoss()
+    best_acc, best_state = -1.0, None
+    for epoch in range(args.epochs):
+        model.train()
+        order = torch.randperm(len(x_train))
+        total = 0.0
+        for i in range(0, len(order), args.batch):
+            idx = order[i:i + args.batch]
+            loss = loss_fn(model(augment(x_train[idx])), y_train[idx])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+            total += float(loss) * len(idx)
+        acc = evaluate(model, x_val, y_val)
+        print(f"epoch {epoch + 1}/{args.epochs}  loss {total / len(x_train):.4f}  验证准确率 {acc:.5f}")
+        if acc > best_acc:
+            best_acc, best_state = acc, {k: v.clone() for k, v in model.state_dict().items()}
+
+    model.load_state_dict(best_state)
+    model.eval()
+    scripted = torch.jit.script(model)
+    meta = {'names': CELL_NAMES, 'size': args.size, 'val_accuracy': best_acc}
+    torch.jit.save(scripted, args.output, _extra_files={'meta.json': json.dumps(meta, ensure_ascii=False)})
+    params = sum(p.numel() for p in model.parameters())
+    print(f"已导出 {args.output}: 验证准确率 {best_acc:.5f}, 参数 {params}, "
+          f"90格批量推理 {benchmark(scripted, args.size):.2f} ms (CPU)")
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,7 @@ from ultralytics import YOLO
 import torch
 import argparse
 
-def train_model(profile=False):
+def train_model(profile=False, synthetic=None, packed=False):
     # 检查GPU是否可用
     if torch.cuda.is_available():
         device = torch.device('cuda')
@@ -17,10 +17,20 @@ def train_model(profile=False):
     # 将模型移动到相应设备
     model.to(device)
 
+    # 使用在线合成数据时替换数据集与训练器
+    data, trainer = 'chess_data.yaml', None
+    if synthetic:
+        from synthetic_data import synthetic_trainer
+        data, trainer = 'chess_synthetic.yaml', synthetic_trainer(**synthetic)
+    elif packed:
+        from packed_dataset import packed_trainer
+        data, trainer = 'chess_packed.yaml', packed_trainer()
+
     # 2. 开始训练
     print("开始训练模型...")
     results = model.train(
-        data='chess_data.yaml',
+        data=data,
+        trainer=trainer,
         epochs=700,
         imgsz=640,
         lr0=0.001,
@@ -53,8 +63,12 @@ def train_model(profile=False):
     print(f"模型和结果保存在: {results.save_dir}")
 
     # (可选) 3. 在验证集上评估模型性能
-    print("\n开始评估模型...")
-    metrics = model.val()
+    if trainer is not None:
+        # 在线合成与分片数据集只能由对应的训练器读取（yaml 中的 val 对默认验证器无效），直接使用训练结束时的验证结果
+        metrics = results
+    else:
+        print("\n开始评估模型...")
+        metrics = model.val()
     print("评估指标:")
     print(f"mAP50-95: {metrics.box.map}")
     print(f"mAP50: {metrics.box.map50}")
@@ -63,9 +77,15 @@ if __name__ == '__main__':
     # 创建参数解析器
     parser = argparse.ArgumentParser(description='训练中国象棋揭棋棋盘YOLO模型')
     parser.add_argument('--profile', action='store_true', help='启用性能分析')
+    parser.add_argument('--synthetic', action='store_true', help='使用在线合成数据训练，不读取 datasets/ 目录')
+    parser.add_argument('--epoch-size', type=int, default=2500, help='在线合成时每个 epoch 的样本数')
+    parser.add_argument('--val-size', type=int, default=500, help='在线合成时固定验证集的样本数')
+    parser.add_argument('--seed', type=int, default=0, help='在线合成数据的随机种子（验证集固定；训练样本在 batch 与 workers 相同时可复现）')
+    parser.add_argument('--packed', action='store_true', help='从分片数据集 datasets.pack 读取（见 packed_dataset.py）')
     
     # 解析参数
     args = parser.parse_args()
     
     # 调用训练函数并传递profile参数
-    train_model(profile=args.profile)
\ No newline at end of file
+    synthetic = dict(epoch_size=args.epoch_size, val_size=args.val_size, seed=args.seed) if args.synthetic else None
+    train_model(profile=args.profile, synthetic=synthetic, packed=args.packed)
\ No newline at end of file